@@ -0,0 +1,97 @@
+"""Measure agent startup: import time and resident memory of main.py, per enabled provider.
+
+Every sample runs in a fresh interpreter that imports main (as the agent does
+at startup) and then loads one provider's client module through
+CloudFactory.load_provider, which is what enabling that provider costs.
+
+Usage:
+    python scripts/startup_benchmark.py [--runs 5] [--providers aws gdrive]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+# Provider SDKs, plus numpy for the dedup chunker; none of them should load with main
+HEAVY_MODULES = ["boto3", "googleapiclient", "msal", "aiohttp", "azure.storage.blob", "numpy"]
+
+CHILD = r"""
+import json, os, sys, time
+start = time.perf_counter()
+import main
+main_seconds = time.perf_counter() - start
+provider = sys.argv[1]
+if provider != "none":
+    from cloud.cloud_factory import CloudFactory
+    CloudFactory.load_provider(provider)
+total_seconds = time.perf_counter() - start
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        return None
+
+print(json.dumps({
+    "main_seconds": main_seconds,
+    "total_seconds": total_seconds,
+    "rss_mb": rss_mb(),
+    "modules": [name for name in json.loads(sys.argv[2]) if name in sys.modules],
+}))
+"""
+
+
+def sample(provider: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD, provider, json.dumps(HEAVY_MODULES)],
+        cwd=SRC_DIR,
+        env={**os.environ, "PYTHONPATH": str(SRC_DIR), "PYTHONDONTWRITEBYTECODE": "1"},
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{provider}: {result.stderr.strip().splitlines()[-1]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    sys.path.insert(0, str(SRC_DIR))
+    from cloud.cloud_factory import PROVIDERS
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="samples per provider (median is reported)")
+    parser.add_argument("--providers", nargs="+", default=["none", *PROVIDERS])
+    args = parser.parse_args()
+
+    # warm the bytecode/page cache so the first row is not penalised
+    sample("none")
+
+    print(f"{'provider':<10} {'main.py (ms)':>12} {'total (ms)':>11} {'RSS (MB)':>9}  Modules loaded")
+    for provider in args.providers:
+        try:
+            samples = [sample(provider) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{provider:<10} failed: {e}")
+            continue
+        main_ms = statistics.median(s["main_seconds"] for s in samples) * 1000
+        total_ms = statistics.median(s["total_seconds"] for s in samples) * 1000
+        rss = [s["rss_mb"] for s in samples if s["rss_mb"] is not None]
+        rss_text = f"{statistics.median(rss):9.1f}" if rss else f"{'n/a':>9}"
+        print(f"{provider:<10} {main_ms:12.0f} {total_ms:11.0f} {rss_text}  {', '.join(samples[-1]['modules']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import io
 import logging
 import os
 from pathlib import Path
@@ -9,71 +10,145 @@ import time
 import random
 import asyncio
 import sqlite3
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from encryption.encryption_handler import EncryptionHandler
 from data.database_handler import DatabaseHandler
+from backup.stream_pipeline import StreamingPipeline, ChunkReader, PipelineAborted
+from backup.incremental import INCREMENT_MEMBER, scan_changes, increment_metadata, apply_increment
+from data.chunk_index import ChunkIndex
+from cloud.provider_registry import ProviderRegistry
+from data.database_operations import DatabaseOperations
 
 logger = logging.getLogger(__name__)
 
+# The active provider is per asyncio task, so concurrent backups for different
+# providers each keep the client they selected with set_cloud_provider.
+_cloud_provider = ContextVar('cloud_provider', default=None)
+_provider_name = ContextVar('provider_name', default=None)
+
 class BackupManager:
+    BACKUP_MODES = ["archive", "dedup", "incremental"]
+
     def __init__(self, encryption_handler: EncryptionHandler, config):
         """Initialize the backup manager."""
-        #self.cloud_provider = cloud_provider
+        self.providers = ProviderRegistry(config, config.get('providers', {}).get('verify_ttl_seconds', 300))
         self.encryption_handler = encryption_handler
         self.config = config
+        self.backup_config = config.get('backup', {})
+        self._chunk_executor = None
+        self._chunk_workers = 0
+        self._chunk_index = None
+        self._db_operations = None
+
+    @property
+    def cloud_provider(self):
+        return _cloud_provider.get()
+
+    @cloud_provider.setter
+    def cloud_provider(self, provider):
+        _cloud_provider.set(provider)
+
+    @property
+    def provider_name(self):
+        return _provider_name.get()
+
+    @provider_name.setter
+    def provider_name(self, name):
+        _provider_name.set(name)
+
+    def __getstate__(self):
+        # The worker pool is rebuilt lazily in a spawned service process (the
+        # active provider is a context variable and is not pickled at all)
+        state = self.__dict__.copy()
+        state.update(_chunk_executor=None, _chunk_workers=0)
+        return state
+
+    def _get_chunk_executor(self):
+        """Lazily create the pool shared by parallel chunk compression/encryption."""
+        if self._chunk_executor is None:
+            workers = self.backup_config.get('workers') or os.cpu_count() or 1
+            self._chunk_workers = workers
+            if self.backup_config.get('executor', 'thread') == 'process':
+                self._chunk_executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                # zlib and AES-GCM release the GIL, so threads scale across cores
+                self._chunk_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="BackupChunk")
+            logging.info(f"Chunk executor started with {workers} workers")
+        return self._chunk_executor
+
+    async def close(self):
+        """Close every cached cloud provider client and stop the chunk executor."""
+        await self.providers.close()
+        self.cloud_provider = None
+        if self._chunk_executor is not None:
+            self._chunk_executor.shutdown(wait=False, cancel_futures=True)
+            self._chunk_executor = None
+
+    def _get_db_operations(self) -> DatabaseOperations:
+        if self._db_operations is None:
+            self._db_operations = DatabaseOperations()
+        return self._db_operations
+
+    async def resolve_backup_type(self, task_id=None, is_directory=True) -> str:
+        """Backup type for the next run of a task, from backup.mode in config.json.
+
+        In incremental mode a directory gets a full backup when it has no
+        usable chain yet (first run, or the chain's full backup was deleted)
+        or after backup.full_every increments; otherwise an incremental one.
+        """
+        mode = self.backup_config.get('mode', 'archive')
+        if mode not in self.BACKUP_MODES:
+            raise ValueError(f"Backup mode {mode} not supported. Valid modes are: {', '.join(self.BACKUP_MODES)}")
+        if mode != "incremental":
+            return mode
+        if not is_directory or task_id is None:
+            return "archive"
+        chain = await self._get_db_operations().aio.get_backup_chain(task_id)
+        if not chain or len(chain) > self.backup_config.get('full_every', 7):
+            return "full"
+        return "incremental"
+
+    def _dedup_backup(self):
+        """DedupBackup bound to the current cloud provider.
+
+        The chunker needs numpy, so dedup is imported the first time a dedup
+        backup is used, like the provider SDKs (see cloud_factory).
+        """
+        from backup.chunker import ContentDefinedChunker
+        from backup.dedup import DedupBackup
+        if self._chunk_index is None:
+            self._chunk_index = ChunkIndex()
+        dedup_config = self.backup_config.get('dedup', {})
+        chunker = ContentDefinedChunker(
+            min_size=dedup_config.get('min_chunk_kb', 512) * 1024,
+            avg_size=dedup_config.get('avg_chunk_kb', 2048) * 1024,
+            max_size=dedup_config.get('max_chunk_kb', 8192) * 1024
+        )
+        return DedupBackup(self.cloud_provider, self.provider_name, self.encryption_handler, self._chunk_index, chunker)
 
     async def set_cloud_provider(self, provider_name: str):
-        """Set the cloud provider based on the selected option."""
-        valid_providers = ["gdrive", "onedrive", "aws", "azure"]
-        if provider_name not in valid_providers:
-            ValueError(f"Provider {provider_name} not supported. Valid providers are: {', '.join(valid_providers)}")
+        """Set the cloud provider based on the selected option (clients are cached by the registry)."""
         logging.info("Setting cloud provider...")
         try:
-            if provider_name == "aws":
-                from cloud.providers.aws_client import AWSClient
-                aws_config = self.config.get('aws', {})
-                self.cloud_provider = AWSClient(
-                    aws_access_key=aws_config.get('aws_access_key'),
-                    aws_secret_key=aws_config.get('aws_secret_key'),
-                    bucket_name=aws_config.get('bucket_name'),
-                    region=aws_config.get('region', 'us-east-1')
-                )
-                logging.info("AWS client initialized successfully")
-            elif provider_name == "gdrive":
-                from cloud.providers.gdrive_client import GoogleDriveClient
-                gdrive_config = self.config.get('gdrive', {})
-                self.cloud_provider = GoogleDriveClient(gdrive_config, True)
-                logging.info("Google Drive client initialized successfully")
-            elif provider_name == "onedrive":
-                from cloud.providers.onedrive_client import OneDriveClient
-                onedrive_config = self.config.get('onedrive', {})
-                self.cloud_provider = OneDriveClient(
-                    client_id=onedrive_config.get('client_id'),
-                    client_secret=onedrive_config.get('client_secret'),
-                    login=True
-                )
-                logging.info("OneDrive client initialized successfully")
-
-            # Verify provider connection and handle token refresh
-            try:
-                await self.cloud_provider.verify_connection()
-            except Exception as auth_error:
-                try:
-                    logging.info("Authentication failed. Attempting token refresh...")
-                    await self.cloud_provider.refresh_token()
-                except Exception as refresh_error:
-                    logging.info(f"Token refresh failed: {refresh_error}")
-                    logging.info("Attempting to re-authenticate...")
-                    await self.cloud_provider.authenticate()
-
+            self.cloud_provider = await self.providers.get(provider_name)
+            self.provider_name = provider_name
             logging.info(f"Using cloud provider: {provider_name}")
             return True
             
         except Exception as e:
+            self.providers.invalidate(provider_name)
             logging.error(f"Failed to initialize {provider_name} provider: {e}")
             raise
 
-    async def create_backup(self, source_path, encrypt=False):
+    def invalidate_provider(self, provider_name: str | None = None):
+        """Mark a provider's client for re-verification after a failed operation."""
+        provider_name = provider_name or self.provider_name
+        if provider_name:
+            self.providers.invalidate(provider_name)
+
+    async def create_backup(self, source_path, encrypt=False, streaming=None, backup_type="archive", task_id=None):
         """Create a backup of the specified path."""
         try:
             logging.info(f"\n=== Starting backup process for: {source_path} ===")
@@ -81,6 +156,17 @@ class BackupManager:
             if not source_path.exists():
                 raise FileNotFoundError(f"Source path not found: {source_path}")
 
+            if backup_type == "dedup":
+                return await self._dedup_backup().create(source_path, encrypt)
+            if backup_type in ("full", "incremental"):
+                return await self._create_incremental_backup(source_path, encrypt, backup_type, task_id)
+
+            if streaming is None:
+                # Providers without a native upload_stream would spool a full-size temp file anyway
+                streaming = self.backup_config.get('streaming', False) and self.cloud_provider.NATIVE_STREAM_UPLOAD
+            if streaming:
+                return await self._create_streaming_backup(source_path, encrypt)
+
             # Create a temporary directory for processing
             with tempfile.TemporaryDirectory() as temp_dir:
                 temp_path = Path(temp_dir) / source_path.name
@@ -99,12 +185,11 @@ class BackupManager:
                 # Encrypt if requested
                 if encrypt:
                     logging.info("Encrypting backup...")
-                    with open(temp_path, 'rb') as f:
-                        data = f.read()
-                    encrypted_data = self.encryption_handler.encrypt(data)
-                    temp_path = temp_path.with_suffix(temp_path.suffix + '.encrypted')
-                    with open(temp_path, 'wb') as f:
-                        f.write(encrypted_data)
+                    encrypted_path = temp_path.with_suffix(temp_path.suffix + '.encrypted')
+                    with open(temp_path, 'rb') as src, open(encrypted_path, 'wb') as dst:
+                        self.encryption_handler.encrypt_stream(src, dst)
+                    temp_path.unlink()
+                    temp_path = encrypted_path
                     logging.info("Encryption completed")
 
                 # Upload to cloud storage
@@ -118,9 +203,71 @@ class BackupManager:
                 return backup_id
 
         except Exception as e:
+            self.invalidate_provider()
             logging.error(f"Error creating backup: {e}")
             raise
 
+    async def _create_incremental_backup(self, source_path: Path, encrypt: bool, backup_type: str, task_id):
+        """Package the files added or changed since the task's last backup, plus a deletion list."""
+        loop = asyncio.get_running_loop()
+        db_operations = self._get_db_operations()
+        previous = await db_operations.aio.get_file_manifest(task_id)
+        current, changed, updated, deleted = await loop.run_in_executor(None, scan_changes, source_path, previous)
+        if backup_type == "full":
+            changed, deleted = sorted(current), []
+        logging.info(f"{backup_type.capitalize()} backup: {len(changed)} files to package, {len(deleted)} deleted")
+
+        backup_id = await self._create_streaming_backup(
+            source_path,
+            encrypt,
+            files=changed,
+            extra_members={INCREMENT_MEMBER: increment_metadata(backup_type, deleted)}
+        )
+
+        # Only record the new state once the upload has succeeded
+        await db_operations.aio.update_file_manifest(task_id, backup_id, current, updated, deleted, replace=backup_type == "full")
+        return backup_id
+
+    async def _create_streaming_backup(self, source_path: Path, encrypt: bool, files=None, extra_members=None):
+        """Zip, encrypt and upload the source chunk by chunk without intermediate files."""
+        file_name = source_path.name + ('.zip' if source_path.is_dir() else '')
+        if encrypt:
+            file_name += '.encrypted'
+
+        queue_depth = self.backup_config.get('queue_depth', 4)
+        parallel = encrypt and self.backup_config.get('parallel', False)
+        executor = None
+        max_in_flight = None
+        if parallel:
+            executor = self._get_chunk_executor()
+            # chunks being compressed/encrypted at once; buffered memory is about
+            # chunk_size * (2 * queue_depth + max_in_flight), whatever the core count
+            max_in_flight = min(self._chunk_workers, self.backup_config.get('max_in_flight_chunks', 4))
+
+        chunk_size = self.backup_config.get('chunk_size_mb', 8) * 1024 * 1024
+        pipeline = StreamingPipeline(
+            source_path,
+            chunk_size=chunk_size,
+            queue_depth=queue_depth,
+            encryptor=self.encryption_handler.chunk_encryptor(chunk_size) if encrypt else None,
+            compress_chunks=parallel,
+            executor=executor,
+            files=files,
+            extra_members=extra_members,
+            max_in_flight=max_in_flight
+        )
+
+        logging.info(f"Streaming {file_name} to cloud storage...")
+        backup_id = await self.cloud_provider.upload_stream(
+            pipeline.chunks(),
+            file_name,
+            destination="backups"
+        )
+
+        logging.info(f"Streamed {pipeline.bytes_read} bytes ({pipeline.bytes_out} uploaded)")
+        logging.info(f"Backup completed successfully with ID: {backup_id}")
+        return backup_id
+
     async def restore_backup(self, backup_info):
         """Restore a backup to the specified destination."""
         try:
@@ -140,66 +287,47 @@ class BackupManager:
             logging.info(f"Creating destination directory: {destination}")
             destination.mkdir(parents=True, exist_ok=True)
 
+            if backup_info.get('backup_type') == "dedup":
+                await self.set_cloud_provider(backup_info['provider'])
+                await self._dedup_backup().restore(
+                    backup_info['backup_id'],
+                    destination,
+                    None if backup_info['is_directory'] else backup_info['original_name']
+                )
+                logging.info(f"Restore completed successfully to: {destination}")
+                return True
+
+            if backup_info.get('backup_type') in ("full", "incremental"):
+                await self._restore_backup_chain(backup_info, destination)
+                logging.info(f"Restore completed successfully to: {destination}")
+                return True
+
             # Create a temporary directory for the download
             temp_dir = Path(tempfile.mkdtemp())
             logging.info(f"Using temporary directory for download: {temp_dir}")
 
             try:
-                # Create a specific temporary file for the download
-                temp_file = temp_dir / f"download_{backup_info['backup_id']}"
-                logging.info(f"Downloading to temporary file: {temp_file}")
-                
                 logging.info(f"Set provider")
                 await self.set_cloud_provider(backup_info['provider'])
 
-                # Download the file using the cloud provider's download_file method
-                logging.info(f"Starting file download from cloud")
-                success = await self.cloud_provider.download_file(backup_info['backup_id'], str(temp_file))
-                
-                if not success:
-                    raise Exception("Failed to download file")
-
-                logging.info(f"File downloaded successfully to: {temp_file}")
-
-                # Verify that the file exists
-                if not temp_file.exists():
-                    raise Exception(f"Downloaded file not found at {temp_file}")
-
-                # Read the file content
-                with open(temp_file, 'rb') as f:
-                    file_content = f.read()
-
-                # If the file is encrypted, decrypt it
-                if backup_info['is_encrypted']:
-                    logging.info("Decrypting file...")
-                    try:
-                        file_content = self.encryption_handler.decrypt(file_content)
-                        logging.info("Decryption completed successfully")
-                    except Exception as e:
-                        logging.error(f"Error during decryption: {e}")
-                        raise Exception(f"Failed to decrypt file: {e}")
+                temp_file = await self._download_backup(backup_info['backup_id'], backup_info['is_encrypted'], temp_dir)
+                loop = asyncio.get_running_loop()
 
                 # If it was a directory (zip file)
                 if backup_info['is_directory']:
                     logging.info(f"Processing zip archive")
                     try:
-                        # Create a temporary zip file
-                        temp_zip = temp_dir / f'temp_{backup_info['backup_id']}.zip'
-                        with open(temp_zip, 'wb') as f:
-                            f.write(file_content)
-                        
-                        # Extract the zip
+                        # Extract the zip straight from the downloaded file
                         logging.info(f"Extracting zip to: {destination}")
-                        shutil.unpack_archive(str(temp_zip), str(destination))
+                        await loop.run_in_executor(None, shutil.unpack_archive, str(temp_file), str(destination), 'zip')
                         
                     except Exception as e:
                         logging.error(f"Error processing zip archive: {e}")
                         raise
                 else:
-                    # Write the file to the final destination
+                    # Move the file to the final destination
                     logging.info(f"Writing file to: {final_destination}")
-                    with open(final_destination, 'wb') as f:
-                        f.write(file_content)
+                    await loop.run_in_executor(None, shutil.move, str(temp_file), str(final_destination))
 
                 logging.info(f"Restore completed successfully to: {destination}")
                 return True
@@ -214,10 +342,84 @@ class BackupManager:
                     logging.warning(f"Warning: Could not delete temporary directory: {e}")
 
         except Exception as e:
+            self.invalidate_provider()
             logging.error(f"Error restoring backup: {e}")
             raise
 
-    async def delete_backup(self, backup_id: str, provider_name: str):
+    async def _download_backup(self, backup_id: str, is_encrypted, temp_dir: Path) -> Path:
+        """Download a backup object into temp_dir and decrypt it; returns the plaintext file.
+
+        With backup.restore_connections > 1 large objects are fetched with
+        parallel ranged requests: plaintext parts are written in place, and
+        encrypted parts are fed in order to the decryptor, so only the
+        plaintext reaches the disk. Either way memory stays bounded whatever
+        the backup size.
+        """
+        temp_file = temp_dir / f"download_{backup_id.replace('/', '_')}"
+        logging.info(f"Downloading to temporary file: {temp_file}")
+
+        connections = self.backup_config.get('restore_connections', 4)
+        part_size = self.backup_config.get('restore_part_size_mb', 16) * 1024 * 1024
+        if is_encrypted:
+            logging.info("Downloading and decrypting file...")
+            try:
+                await self._download_decrypted(backup_id, temp_file, part_size, connections)
+                logging.info("Decryption completed successfully")
+            except Exception as e:
+                logging.error(f"Error during decryption: {e}")
+                raise Exception(f"Failed to decrypt file: {e}")
+        else:
+            # Parallel ranged download (single request for small objects or connections == 1)
+            logging.info(f"Starting file download from cloud")
+            success = await self.cloud_provider.download_parallel(backup_id, str(temp_file), part_size, connections)
+            if not success:
+                raise Exception("Failed to download file")
+
+        # Verify that the file exists
+        if not temp_file.exists():
+            raise Exception(f"Downloaded file not found at {temp_file}")
+
+        logging.info(f"File downloaded successfully to: {temp_file}")
+        return temp_file
+
+    async def _download_decrypted(self, backup_id: str, target: Path, part_size: int, connections: int):
+        """Feed the provider's download stream, in order, to a thread that decrypts it into target."""
+        reader = ChunkReader(self.backup_config.get('queue_depth', 4))
+
+        def decrypt():
+            try:
+                with io.BufferedReader(reader, buffer_size=1024 * 1024) as src, open(target, 'wb') as dst:
+                    self.encryption_handler.decrypt_stream(src, dst)
+            finally:
+                # unblocks feed() whether decryption failed or stopped at the final frame
+                reader.abort()
+
+        decrypting = asyncio.get_running_loop().run_in_executor(None, decrypt)
+        try:
+            await reader.feed(self.cloud_provider.download_stream_parallel(backup_id, part_size, connections))
+        except PipelineAborted:
+            pass  # the decrypt thread failed; its error is raised below
+        except BaseException:
+            await asyncio.gather(decrypting, return_exceptions=True)
+            raise
+        await decrypting
+
+    async def _restore_backup_chain(self, backup_info, destination: Path):
+        """Rebuild the state at backup_info by applying its full backup and every increment up to it."""
+        chain = await self._get_db_operations().aio.get_backup_chain(backup_info['task_id'], backup_info['backup_id'])
+        if not chain:
+            raise Exception(f"Cannot rebuild backup {backup_info['backup_id']}: its full backup is no longer available")
+        logging.info(f"Restoring chain of {len(chain)} backups: {[backup_id for backup_id, _ in chain]}")
+
+        await self.set_cloud_provider(backup_info['provider'])
+        loop = asyncio.get_running_loop()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for backup_id, _ in chain:
+                archive = await self._download_backup(backup_id, backup_info['is_encrypted'], Path(temp_dir))
+                await loop.run_in_executor(None, apply_increment, archive, destination)
+                archive.unlink()
+
+    async def delete_backup(self, backup_id: str, provider_name: str, backup_type: str = "archive"):
         """Delete a backup from the cloud provider and database."""
         try:
             logging.info(f"Deleting backup with ID: {backup_id} from provider: {provider_name}")
@@ -225,9 +427,39 @@ class BackupManager:
             logging.info(f"Set provider")
             await self.set_cloud_provider(provider_name)
             # Delete from cloud provider
-            await self.cloud_provider.delete_file(backup_id)
+            if backup_type == "dedup":
+                await self._dedup_backup().delete(backup_id)
+            else:
+                await self.cloud_provider.delete_file(backup_id)
             
             logging.info(f"Backup {backup_id} deleted successfully")
         except Exception as e:
+            self.invalidate_provider(provider_name)
             logging.error(f"Failed to delete backup {backup_id}: {e}")
-            raise 
\ No newline at end of file
+            raise
+
+    async def delete_backups(self, provider_name: str, backups):
+        """Delete several (backup_id, backup_type) backups of one provider with a bulk delete.
+
+        Dedup manifests go first; the chunks only they referenced are deleted
+        afterwards, and only for the manifests the provider actually removed.
+        Returns the backup ids that were removed from the provider.
+        """
+        try:
+            await self.set_cloud_provider(provider_name)
+            removed = set(await self.cloud_provider.delete_files([backup_id for backup_id, _ in backups]))
+            deleted = [backup_id for backup_id, _ in backups if backup_id in removed]
+
+            released = [backup_id for backup_id, backup_type in backups if backup_type == "dedup" and backup_id in removed]
+            if released:
+                try:
+                    await self._dedup_backup().release(released)
+                except Exception as e:
+                    # the manifests are gone either way; their chunks just stay in the index
+                    logging.error(f"Failed to delete unreferenced chunks from {provider_name}: {e}")
+            logging.info(f"Deleted {len(deleted)} of {len(backups)} backups from {provider_name}")
+            return deleted
+        except Exception as e:
+            self.invalidate_provider(provider_name)
+            logging.error(f"Failed to delete backups from {provider_name}: {e}")
+            raise
\ No newline at end of file
@@ -0,0 +1,105 @@
+import hashlib
+import logging
+from typing import BinaryIO, Iterator
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Gear table for the rolling hash: 256 fixed pseudo-random 64-bit values.
+# Derived from SHA-256 so chunk boundaries are stable across agents and versions.
+GEAR = np.array(
+    [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'big') for i in range(256)],
+    dtype=np.uint64
+)
+WINDOW = 64
+SCAN_BLOCK = 256 * 1024
+
+
+def _top_bits_mask(bits: int) -> int:
+    # The gear hash shifts left on every byte, so its high bits depend on the
+    # most bytes of the window; the boundary test uses those bits.
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+class ContentDefinedChunker:
+    """Splits a byte stream at content-defined boundaries (FastCDC-style gear hash).
+
+    Boundaries depend only on the bytes around them, so an insertion or
+    deletion only changes the chunks it touches and every other chunk keeps
+    its hash. Normalized chunking uses a stricter mask before avg_size and a
+    looser one after it, which keeps chunk sizes close to the average.
+
+    The hash at byte i is the gear hash of the 64-byte window ending at i,
+    sum(GEAR[b[i-k]] << k for k in 0..63) mod 2**64. It is computed for a
+    whole block at once with numpy by doubling the window six times.
+    """
+
+    def __init__(self, min_size: int = 512 * 1024, avg_size: int = 2 * 1024 * 1024, max_size: int = 8 * 1024 * 1024):
+        if not WINDOW <= min_size < avg_size < max_size:
+            raise ValueError("Chunk sizes must satisfy min_size < avg_size < max_size")
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        bits = avg_size.bit_length() - 1
+        self.mask_strict = _top_bits_mask(bits + 1)
+        self.mask_loose = _top_bits_mask(bits - 1)
+
+    @staticmethod
+    def _window_hashes(data: bytes, offset: int, count: int) -> np.ndarray:
+        """Gear hashes for positions offset..offset+count-1 (needs WINDOW-1 bytes of history)."""
+        start = offset - (WINDOW - 1)
+        h = GEAR[np.frombuffer(data, dtype=np.uint8, count=count + WINDOW - 1, offset=start)]
+        width = 1
+        while width < WINDOW:
+            # numpy buffers overlapping operands, so this reads the previous pass
+            h[width:] += h[:-width] << np.uint64(width)
+            width *= 2
+        return h[WINDOW - 1:]
+
+    def _first_boundary(self, data: bytes, low: int, high: int, mask: int) -> int | None:
+        """Position of the first byte in [low, high) whose hash matches mask, scanning block by block."""
+        mask = np.uint64(mask)
+        position = low
+        while position < high:
+            end = min(position + SCAN_BLOCK, high)
+            hits = np.flatnonzero((self._window_hashes(data, position, end - position) & mask) == 0)
+            if hits.size:
+                return position + int(hits[0])
+            position = end
+        return None
+
+    def _find_cut(self, data: bytes, start: int, available: int) -> int:
+        """Return the length of the chunk starting at start."""
+        if available <= self.min_size:
+            return available
+        end = min(available, self.max_size)
+        normal = min(end, self.avg_size)
+        boundary = self._first_boundary(data, start + self.min_size, start + normal, self.mask_strict)
+        if boundary is None:
+            boundary = self._first_boundary(data, start + normal, start + end, self.mask_loose)
+        if boundary is None:
+            return end
+        return boundary - start + 1
+
+    def chunks(self, fileobj: BinaryIO) -> Iterator[bytes]:
+        """Yield the chunks of fileobj; holds at most two max-size chunks in memory."""
+        buffer = b''
+        position = 0
+        eof = False
+        while True:
+            if not eof and len(buffer) - position < self.max_size:
+                data = fileobj.read(self.max_size)
+                if data:
+                    buffer = buffer[position:] + data
+                    position = 0
+                else:
+                    eof = True
+            available = len(buffer) - position
+            if available == 0:
+                return
+            if available < self.max_size and not eof:
+                continue
+            length = self._find_cut(buffer, position, available)
+            yield buffer[position:position + length]
+            position += length
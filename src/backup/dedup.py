@@ -0,0 +1,267 @@
+import io
+import json
+import asyncio
+import hashlib
+import logging
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+from backup.chunker import ContentDefinedChunker
+from data.chunk_index import ChunkIndex
+from encryption.encryption_handler import EncryptionHandler
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FORMAT = 'bk-manifest'
+MANIFEST_VERSION = 1
+
+
+class DedupBackup:
+    """Deduplicated backups: content-defined chunks plus a manifest per backup.
+
+    Each chunk is stored once per provider as its own object, named by its
+    chunk id: the SHA-256 of the plaintext for unencrypted backups, a keyed
+    HMAC (EncryptionHandler.chunk_id) for encrypted ones, so object names do
+    not reveal content hashes. Encrypted and plaintext chunks are never
+    shared. A backup uploads only chunks the local ChunkIndex does not know
+    for the provider, then uploads a manifest that lists every file with its
+    chunk ids and the object id of every chunk.
+    The manifest's object id is the backup id. Restores only need the
+    manifest, so they also work on a machine with an empty index.
+    """
+
+    def __init__(self, cloud_provider, provider_name: str, encryption_handler: EncryptionHandler,
+                 chunk_index: ChunkIndex, chunker: ContentDefinedChunker):
+        self.cloud_provider = cloud_provider
+        self.provider_name = provider_name
+        self.encryption_handler = encryption_handler
+        self.chunk_index = chunk_index
+        self._pinned = set()
+        # (hash, object_id, size) of the chunks this backup uploaded, recorded in the index at the end
+        self._uploaded = []
+        self.chunker = chunker
+        self.uploaded_bytes = 0
+        self.reused_bytes = 0
+
+    def _seal(self, data: bytes) -> bytes:
+        encryptor = self.encryption_handler.chunk_encryptor(max(len(data), 1))
+        return encryptor.header + encryptor.seal_compressed(0, data) + encryptor.final_frame(1)
+
+    def _open(self, payload: bytes) -> bytes:
+        output = io.BytesIO()
+        self.encryption_handler.decrypt_stream(io.BytesIO(payload), output)
+        return output.getvalue()
+
+    def _pin(self, hashes):
+        """Keep chunks this backup uses out of find_orphans until its manifest is indexed."""
+        new = set(hashes) - self._pinned
+        self._pinned |= new
+        self.chunk_index.pin(self.provider_name, new)
+
+    def _next_chunk(self, iterator, encrypt: bool):
+        chunk = next(iterator, None)
+        if chunk is None:
+            return None
+        if encrypt:
+            return self.encryption_handler.chunk_id(chunk), chunk
+        return hashlib.sha256(chunk).hexdigest(), chunk
+
+    async def _store_chunk(self, chunk_hash: str, chunk: bytes, encrypt: bool) -> str:
+        loop = asyncio.get_running_loop()
+        payload = await loop.run_in_executor(None, self._seal, chunk) if encrypt else chunk
+        object_id = await self.cloud_provider.upload_bytes(payload, chunk_hash, destination="backups")
+        self._uploaded.append((chunk_hash, object_id, len(chunk)))
+        self.uploaded_bytes += len(chunk)
+        return object_id
+
+    async def _resolve_chunk(self, chunk_hash: str, chunk: bytes, encrypt: bool) -> str:
+        """Object id of a chunk; it is uploaded only if neither the index nor a concurrent backup holds it."""
+        index = self.chunk_index
+        while True:
+            async with index.release_lock:
+                self._pin([chunk_hash])
+                claim = index.claimed(self.provider_name, chunk_hash, encrypt)
+                if claim is None:
+                    known = await index.aio.get_known_chunks(self.provider_name, [chunk_hash], encrypt)
+                    if known:
+                        self.reused_bytes += len(chunk)
+                        return known[chunk_hash]
+                    claim = index.claim(self.provider_name, chunk_hash, encrypt)
+                    owned = True
+                else:
+                    owned = False
+
+            if owned:
+                try:
+                    object_id = await self._store_chunk(chunk_hash, chunk, encrypt)
+                except BaseException:
+                    index.settle(self.provider_name, [chunk_hash], encrypt)
+                    claim.set_result(None)
+                    raise
+                claim.set_result(object_id)
+                return object_id
+
+            object_id = await asyncio.shield(claim)
+            if object_id is not None:
+                self.reused_bytes += len(chunk)
+                return object_id
+            # the other backup's upload failed: claim it again
+
+    async def _record(self, encrypt: bool, manifest_id: str | None = None, hashes=(), cache_entries=()):
+        """Write this backup's uploaded chunks (and manifest) to the index in one transaction, then drop its claims."""
+        uploaded, self._uploaded = self._uploaded, []
+        try:
+            await self.chunk_index.aio.record_backup(self.provider_name, encrypt, uploaded, manifest_id, hashes, cache_entries)
+        finally:
+            self.chunk_index.settle(self.provider_name, [h for h, _, _ in uploaded], encrypt)
+
+    async def _store_file(self, path: Path, encrypt: bool, object_ids: dict) -> list:
+        """Chunk a file and upload the chunks the provider does not hold yet."""
+        loop = asyncio.get_running_loop()
+        hashes = []
+        with open(path, 'rb') as f:
+            iterator = self.chunker.chunks(f)
+            while True:
+                item = await loop.run_in_executor(None, self._next_chunk, iterator, encrypt)
+                if item is None:
+                    break
+                chunk_hash, chunk = item
+                hashes.append(chunk_hash)
+                if chunk_hash in object_ids:
+                    self.reused_bytes += len(chunk)
+                else:
+                    object_ids[chunk_hash] = await self._resolve_chunk(chunk_hash, chunk, encrypt)
+        return hashes
+
+    async def create(self, source_path: Path, encrypt: bool) -> str:
+        """Back up source_path and return the manifest's object id."""
+        try:
+            return await self._create(Path(source_path), encrypt)
+        finally:
+            if self._uploaded:
+                # the backup failed: keep what it uploaded reusable instead of leaking it
+                try:
+                    await self._record(encrypt)
+                except Exception as e:
+                    logging.error(f"Could not index the chunks of a failed dedup backup: {e}")
+            self.chunk_index.unpin(self.provider_name, self._pinned)
+            self._pinned = set()
+
+    async def _create(self, source_path: Path, encrypt: bool) -> str:
+        if source_path.is_dir():
+            entries = sorted(source_path.rglob('*'))
+            directories = [p for p in entries if p.is_dir()]
+            files = [p for p in entries if p.is_file()]
+            root = source_path
+        else:
+            directories, files, root = [], [source_path], source_path.parent
+
+        object_ids = {}
+        manifest_files = []
+        cache_updates = []
+        for path in files:
+            stat = path.stat()
+            hashes = await self.chunk_index.aio.get_cached_chunks(str(path), stat.st_size, stat.st_mtime_ns, encrypt)
+            if hashes is not None:
+                async with self.chunk_index.release_lock:
+                    known = await self.chunk_index.aio.get_known_chunks(self.provider_name, hashes, encrypt)
+                    self._pin(known)
+                if len(known) == len(set(hashes)):
+                    object_ids.update(known)
+                    self.reused_bytes += stat.st_size
+                else:
+                    hashes = None
+            if hashes is None:
+                hashes = await self._store_file(path, encrypt, object_ids)
+                cache_updates.append((str(path), stat.st_size, stat.st_mtime_ns, hashes))
+            manifest_files.append({
+                'path': path.relative_to(root).as_posix(),
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'chunks': hashes
+            })
+
+        referenced = {h for entry in manifest_files for h in entry['chunks']}
+        manifest = {
+            'format': MANIFEST_FORMAT,
+            'version': MANIFEST_VERSION,
+            'name': source_path.name,
+            'is_directory': source_path.is_dir(),
+            'created': datetime.now().isoformat(),
+            'encrypted': encrypt,
+            'directories': [p.relative_to(root).as_posix() for p in directories],
+            'files': manifest_files,
+            'chunks': {h: object_ids[h] for h in referenced}
+        }
+        payload = json.dumps(manifest).encode()
+        if encrypt:
+            payload = self._seal(payload)
+
+        manifest_name = f"{source_path.name}.{datetime.now().strftime('%Y%m%dT%H%M%S')}.manifest"
+        manifest_id = await self.cloud_provider.upload_bytes(payload, manifest_name, destination="backups")
+        await self._record(encrypt, manifest_id, referenced, cache_updates)
+
+        logging.info(f"Dedup backup {manifest_id}: {len(manifest_files)} files, {len(referenced)} chunks, "
+                     f"{self.uploaded_bytes} bytes uploaded, {self.reused_bytes} bytes already stored")
+        return manifest_id
+
+    async def _download(self, object_id: str, temp_dir: Path, encrypted: bool) -> bytes:
+        temp_file = temp_dir / f"object_{object_id.replace('/', '_')}"
+        success = await self.cloud_provider.download_file(object_id, str(temp_file))
+        if not success:
+            raise Exception(f"Failed to download object {object_id}")
+        payload = temp_file.read_bytes()
+        temp_file.unlink()
+        if encrypted:
+            return self._open(payload)
+        return payload
+
+    async def restore(self, manifest_id: str, destination: Path, original_name: str | None = None):
+        """Rebuild the files listed in a manifest under destination."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_dir = Path(temp_dir)
+            raw = await self._download(manifest_id, temp_dir, encrypted=False)
+            if not raw.lstrip().startswith(b'{'):
+                raw = self._open(raw)
+            manifest = json.loads(raw)
+            if manifest.get('format') != MANIFEST_FORMAT:
+                raise ValueError(f"Backup {manifest_id} is not a dedup manifest")
+
+            encrypted = manifest['encrypted']
+            root = Path(destination)
+            if not manifest['is_directory'] and original_name:
+                # single-file backups restore to destination/original_name like archive backups
+                manifest['files'][0]['path'] = original_name
+
+            for directory in manifest['directories']:
+                (root / directory).mkdir(parents=True, exist_ok=True)
+
+            for entry in manifest['files']:
+                target = root / entry['path']
+                target.parent.mkdir(parents=True, exist_ok=True)
+                logging.info(f"Restoring {target} from {len(entry['chunks'])} chunks")
+                with open(target, 'wb') as f:
+                    for chunk_hash in entry['chunks']:
+                        f.write(await self._download(manifest['chunks'][chunk_hash], temp_dir, encrypted))
+
+    async def release(self, manifest_ids: List[str]) -> int:
+        """Delete the chunks only these manifests referenced; call once the manifests are gone from the provider.
+
+        The index only drops what the provider reports as deleted, so a failed
+        delete leaves the chunk indexed instead of orphaned. Returns the number
+        of chunks deleted.
+        """
+        async with self.chunk_index.release_lock:
+            orphans = await self.chunk_index.find_orphans(self.provider_name, manifest_ids)
+            removed = set(await self.cloud_provider.delete_files([object_id for _, object_id in orphans])) if orphans else set()
+            await self.chunk_index.aio.release(self.provider_name, manifest_ids,
+                                               [(h, object_id) for h, object_id in orphans if object_id in removed])
+        return len(removed)
+
+    async def delete(self, manifest_id: str):
+        """Delete a manifest and every chunk no other manifest references."""
+        await self.cloud_provider.delete_file(manifest_id)
+        deleted = await self.release([manifest_id])
+        logging.info(f"Deleted dedup backup {manifest_id} and {deleted} unreferenced chunks")
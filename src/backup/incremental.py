@@ -0,0 +1,76 @@
+import os
+import json
+import hashlib
+import logging
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Archive member holding the increment's metadata (type and deletion list)
+INCREMENT_MEMBER = '.bk_increment.json'
+
+FileState = Tuple[int, int, int, str]  # size, mtime_ns, inode, content_hash
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_changes(source_path: Path, previous: Dict[str, FileState]):
+    """Compare the tree under source_path with the previous file manifest.
+
+    Files whose size, mtime and inode all match are taken as unchanged
+    without being read. Anything else is hashed, and only counts as changed
+    if the content hash differs (a touched but identical file is not
+    re-uploaded, but its new metadata is recorded).
+
+    Returns (current, changed, updated, deleted): the full new state keyed
+    by relative posix path, the paths to package, the paths whose recorded
+    state changed (changed plus touched files), and the paths that no
+    longer exist.
+    """
+    current = {}
+    changed = []
+    updated = []
+    for path in sorted(source_path.rglob('*')):
+        if not path.is_file():
+            continue
+        relative = path.relative_to(source_path).as_posix()
+        stat = path.stat()
+        old = previous.get(relative)
+        if old and old[:3] == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            current[relative] = old
+            continue
+        content_hash = hash_file(path)
+        current[relative] = (stat.st_size, stat.st_mtime_ns, stat.st_ino, content_hash)
+        updated.append(relative)
+        if not old or old[3] != content_hash:
+            changed.append(relative)
+    deleted = sorted(set(previous) - set(current))
+    return current, changed, updated, deleted
+
+
+def increment_metadata(backup_type: str, deleted: List[str]) -> bytes:
+    return json.dumps({'type': backup_type, 'deleted': deleted}).encode()
+
+
+def apply_increment(archive_path: Path, destination: Path):
+    """Extract one full or incremental archive over destination and apply its deletions."""
+    with zipfile.ZipFile(archive_path) as archive:
+        names = archive.namelist()
+        metadata = {'type': 'full', 'deleted': []}
+        if INCREMENT_MEMBER in names:
+            metadata = json.loads(archive.read(INCREMENT_MEMBER))
+        archive.extractall(destination, [name for name in names if name != INCREMENT_MEMBER])
+
+    for relative in metadata['deleted']:
+        target = destination / relative
+        if target.is_file():
+            os.remove(target)
+    logging.info(f"Applied {metadata['type']} backup: {len(names)} entries, {len(metadata['deleted'])} deletions")
@@ -0,0 +1,273 @@
+import io
+import logging
+import asyncio
+import queue
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import AsyncIterator, Callable
+
+from encryption.chunked_container import ChunkedEncryptor
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class PipelineAborted(Exception):
+    """Raised inside the producer thread when the consumer stopped reading."""
+
+
+class _ChunkWriter:
+    """Write-only, non-seekable file object that cuts its input into fixed-size chunks."""
+
+    def __init__(self, put: Callable[[bytes], None], chunk_size: int):
+        self._put = put
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self._chunk_size:
+            self._put(bytes(self._buffer[:self._chunk_size]))
+            del self._buffer[:self._chunk_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+
+class ChunkReader(io.RawIOBase):
+    """Read-only, non-seekable file object fed with chunks from the event loop.
+
+    The reverse of the pipeline above: feed() pushes an async iterator of
+    chunks (e.g. a download) into a bounded queue, and a worker thread reads
+    them back as a file. Wrap it in io.BufferedReader for readline/peek.
+    """
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, queue_depth: int = 4):
+        self._chunks = queue.Queue(maxsize=queue_depth)
+        self._abort = threading.Event()
+        self._current = b''
+        self._position = 0
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def abort(self):
+        """Stop both sides; called by the reader when it fails."""
+        self._abort.set()
+
+    def _get(self):
+        while True:
+            if self._abort.is_set():
+                raise PipelineAborted()
+            try:
+                return self._chunks.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+    def _put(self, item):
+        while True:
+            if self._abort.is_set():
+                raise PipelineAborted()
+            try:
+                self._chunks.put(item, timeout=self.POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def readinto(self, buffer) -> int:
+        while self._position >= len(self._current):
+            if self._eof:
+                return 0
+            item = self._get()
+            if item is _END:
+                self._eof = True
+                return 0
+            self._current, self._position = item, 0
+        size = min(len(buffer), len(self._current) - self._position)
+        buffer[:size] = self._current[self._position:self._position + size]
+        self._position += size
+        return size
+
+    async def feed(self, chunks: AsyncIterator[bytes]):
+        """Push every chunk, then end-of-stream. Raises PipelineAborted if the reader gave up."""
+        loop = asyncio.get_running_loop()
+        try:
+            async for chunk in chunks:
+                await loop.run_in_executor(None, self._put, chunk)
+        except PipelineAborted:
+            raise
+        except BaseException:
+            self.abort()
+            raise
+        await loop.run_in_executor(None, self._put, _END)
+
+
+class StreamingPipeline:
+    """Archive -> encrypt -> consumer pipeline with bounded buffers between stages.
+
+    A producer thread walks the source and writes a zip archive (or the raw
+    file) into fixed-size chunks. When an encryptor is given, each chunk is
+    sealed into a container frame on the executor; the consumer receives the
+    container header, the frames and the final frame through ``chunks()``.
+    Every stage holds at most ``queue_depth`` chunks, so memory stays at
+    roughly ``chunk_size * queue_depth * 2`` regardless of the source size.
+
+    With ``compress_chunks`` the archive is written stored (uncompressed) and
+    every chunk is compressed right before it is sealed, so both compression
+    and encryption run on ``executor``. Up to ``max_in_flight`` chunks
+    (default ``queue_depth``) are sealed at once, on top of the two queues,
+    and frames are emitted strictly in chunk order.
+    """
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, source_path, chunk_size: int = 8 * 1024 * 1024, queue_depth: int = 4,
+                 encryptor: ChunkedEncryptor | None = None,
+                 compression: int = zipfile.ZIP_DEFLATED,
+                 compress_chunks: bool = False,
+                 executor: Executor | None = None,
+                 files: list | None = None,
+                 extra_members: dict | None = None,
+                 max_in_flight: int | None = None):
+        self.source_path = Path(source_path)
+        self.chunk_size = chunk_size
+        self.queue_depth = queue_depth
+        self.max_in_flight = max_in_flight or queue_depth
+        self.encryptor = encryptor
+        self.compress_chunks = compress_chunks and encryptor is not None
+        self.compression = zipfile.ZIP_STORED if self.compress_chunks else compression
+        self.executor = executor
+        # Optional subset of the tree to archive (relative paths) and extra in-memory members
+        self.files = files
+        self.extra_members = extra_members or {}
+        self.bytes_read = 0
+        self.bytes_out = 0
+        self._raw_chunks = queue.Queue(maxsize=queue_depth)
+        self._abort = threading.Event()
+
+    def _put(self, item):
+        """Blocking put that gives up once the pipeline is aborted."""
+        while True:
+            if self._abort.is_set():
+                raise PipelineAborted()
+            try:
+                self._raw_chunks.put(item, timeout=self.POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def _put_chunk(self, chunk: bytes):
+        self.bytes_read += len(chunk)
+        self._put(chunk)
+
+    def _produce(self):
+        """Producer thread: archive or read the source into chunks."""
+        try:
+            writer = _ChunkWriter(self._put_chunk, self.chunk_size)
+            if self.source_path.is_dir():
+                logging.info(f"Streaming zip archive of {self.source_path}")
+                if self.files is None:
+                    entries = sorted(self.source_path.rglob('*'))
+                else:
+                    entries = [self.source_path / relative for relative in self.files]
+                with zipfile.ZipFile(writer, 'w', compression=self.compression) as archive:
+                    for item in entries:
+                        archive.write(item, item.relative_to(self.source_path))
+                    for name, data in self.extra_members.items():
+                        archive.writestr(name, data)
+            else:
+                logging.info(f"Streaming file {self.source_path}")
+                with open(self.source_path, 'rb') as f:
+                    while True:
+                        data = f.read(self.chunk_size)
+                        if not data:
+                            break
+                        writer.write(data)
+            writer.close()
+            self._put(_END)
+        except PipelineAborted:
+            logging.info("Streaming pipeline aborted by consumer")
+        except Exception as e:
+            logging.error(f"Streaming pipeline producer failed: {e}")
+            try:
+                self._put(e)
+            except PipelineAborted:
+                pass
+
+    async def _raw(self) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                item = await loop.run_in_executor(None, self._raw_chunks.get, True, self.POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    async def _encrypted(self, source: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Seal up to max_in_flight chunks at once on the executor, queueing up to queue_depth frames for the consumer."""
+        loop = asyncio.get_running_loop()
+        results = asyncio.Queue(maxsize=self.queue_depth)
+        seal = self.encryptor.seal_compressed if self.compress_chunks else self.encryptor.seal
+
+        async def worker():
+            pending = deque()
+            try:
+                await results.put(self.encryptor.header)
+                index = 0
+                async for chunk in source:
+                    pending.append(loop.run_in_executor(self.executor, seal, index, chunk))
+                    index += 1
+                    if len(pending) >= self.max_in_flight:
+                        await results.put(await pending.popleft())
+                while pending:
+                    await results.put(await pending.popleft())
+                await results.put(self.encryptor.final_frame(index))
+                await results.put(_END)
+            except Exception as e:
+                for future in pending:
+                    future.cancel()
+                await results.put(e)
+
+        task = asyncio.create_task(worker())
+        try:
+            while True:
+                item = await results.get()
+                if item is _END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            task.cancel()
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Yield the processed chunks in order; aborts the producer if iteration stops early."""
+        producer = threading.Thread(target=self._produce, name="BackupStreamProducer", daemon=True)
+        producer.start()
+        source = self._raw()
+        if self.encryptor:
+            source = self._encrypted(source)
+        try:
+            async for chunk in source:
+                self.bytes_out += len(chunk)
+                yield chunk
+        finally:
+            self._abort.set()
+            await source.aclose()
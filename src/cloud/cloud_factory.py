@@ -1,38 +1,78 @@
-from cloud.providers.gdrive_client import GoogleDriveClient
-from cloud.providers.onedrive_client import OneDriveClient
-from cloud.providers.aws_client import AWSClient
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Provider modules pull in their SDK (googleapiclient, msal + aiohttp, boto3,
+# azure-storage-blob), so each one is imported the first time its provider is
+# used. The imports stay literal so Nuitka (--follow-imports) still bundles them.
+def _load_gdrive():
+    from cloud.providers.gdrive_client import GoogleDriveClient
+    return GoogleDriveClient
+
+
+def _load_onedrive():
+    from cloud.providers.onedrive_client import OneDriveClient
+    return OneDriveClient
+
+
+def _load_aws():
+    from cloud.providers.aws_client import AWSClient
+    return AWSClient
+
+
+def _load_azure():
+    from cloud.providers.azure_client import AzureClient
+    return AzureClient
+
+
+# provider name -> (display name, loader)
+PROVIDERS = {
+    "gdrive": ("Google Drive", _load_gdrive),
+    "onedrive": ("OneDrive", _load_onedrive),
+    "aws": ("AWS S3", _load_aws),
+    "azure": ("Azure Blob Storage", _load_azure),
+}
+
 
 class CloudFactory:
     @staticmethod
-    def get_provider(provider_name, credentials):
+    def load_provider(provider_name):
+        """Import the provider's module (and SDK) and return its client class."""
+        if provider_name not in PROVIDERS:
+            raise ValueError(f"Provider {provider_name} not supported. Valid providers are: {', '.join(PROVIDERS)}")
+        return PROVIDERS[provider_name][1]()
+
+    @staticmethod
+    def get_provider(provider_name, credentials, login=False):
+        """Build a client from the provider's section of config.json.
+
+        login lets Google Drive and OneDrive start an interactive login when
+        no cached token is available.
+        """
+        provider_class = CloudFactory.load_provider(provider_name)
         if provider_name == "gdrive":
-            return GoogleDriveClient(credentials)
+            return provider_class(credentials, login)
         elif provider_name == "onedrive":
-            return OneDriveClient(credentials.get('client_id'), credentials.get('client_secret'))
+            return provider_class(credentials.get('client_id'), credentials.get('client_secret'), login=login)
         elif provider_name == "aws":
-            return AWSClient(
+            return provider_class(
                 credentials.get('aws_access_key'),
                 credentials.get('aws_secret_key'),
                 credentials.get('bucket_name'),
-                credentials.get('region', 'us-east-1')
+                credentials.get('region', 'us-east-1'),
+                credentials.get('transfer')
+            )
+        elif provider_name == "azure":
+            return provider_class(
+                credentials.get('connection_string'),
+                credentials.get('container_name'),
+                credentials.get('tenant_id'),
+                credentials.get('client_id'),
+                credentials.get('client_secret'),
+                credentials.get('transfer')
             )
-
-        else:
-            ValueError(f"Unsupported cloud provider: {provider_name}") 
-
-    @staticmethod
-    async def check_provider_status(provider_name, credentials):
-        try:
-            provider = CloudFactory.get_provider(provider_name, credentials)
-            await provider.verify_connection()
-            return True
-        except Exception:
-            return False
 
     @staticmethod
     def get_available_providers():
-        return {
-            "gdrive": "Google Drive",
-            "onedrive": "OneDrive",
-            "aws": "AWS S3",
-        } 
\ No newline at end of file
+        return {provider_name: display_name for provider_name, (display_name, _) in PROVIDERS.items()}
@@ -1,22 +1,185 @@
 from abc import ABC, abstractmethod
+from collections import deque
+from pathlib import Path
+import asyncio
+import logging
+import tempfile
+
+from cloud.sdk_executor import sdk_executor, DEFAULT
 
 class CloudProvider(ABC):
+    # Size of the pieces download_stream yields
+    STREAM_CHUNK_SIZE = 1024 * 1024
+    # True when upload_stream sends the chunks as they come instead of spooling them to a temp file
+    NATIVE_STREAM_UPLOAD = False
+
+    async def _run_blocking(self, func, *args, timeout=DEFAULT, cancel_event=None, **kwargs):
+        """Run a blocking SDK call on the shared SDK thread pool so the event loop keeps running.
+
+        timeout defaults to providers.sdk_timeout_seconds; pass None for whole-file
+        transfers, which check cancel_event between chunks instead.
+        """
+        return await sdk_executor.run(func, *args, timeout=timeout, cancel_event=cancel_event, **kwargs)
+
     @abstractmethod
     async def upload_file(self, file_path, destination):
         pass
 
+    async def upload_stream(self, chunks, file_name, destination):
+        """Upload an async iterator of byte chunks as a single object named file_name.
+
+        Providers that can upload without knowing the total size override this.
+        The default spools the chunks to a temporary file and uses upload_file.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir) / file_name
+            with open(temp_path, 'wb') as f:
+                async for chunk in chunks:
+                    f.write(chunk)
+            return await self.upload_file(str(temp_path), destination)
+
+    async def upload_bytes(self, data: bytes, file_name, destination):
+        """Upload a small in-memory object named file_name.
+
+        Providers override this with a single request when data fits below
+        their multipart threshold; the default goes through upload_stream.
+        """
+        async def single():
+            yield data
+        return await self.upload_stream(single(), file_name, destination)
+
+    async def download_stream(self, file_id):
+        """Yield the content of file_id as byte chunks, holding one chunk in memory at a time.
+
+        The default downloads to a temporary file with download_file and reads
+        it back; providers that can stream the response body override this.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir) / "download"
+            await self.download_file(file_id, str(temp_path))
+            with open(temp_path, 'rb') as f:
+                while chunk := f.read(self.STREAM_CHUNK_SIZE):
+                    yield chunk
+
+    async def _open_ranged(self, file_id):
+        """Return (size, fetch) for ranged downloads, or None if unsupported.
+
+        fetch(start, end) is a coroutine returning the bytes start..end
+        inclusive. Providers that support HTTP Range requests override this.
+        """
+        return None
+
+    async def download_parallel(self, file_id, destination, part_size: int = 16 * 1024 * 1024, concurrency: int = 4):
+        """Download file_id with up to concurrency ranged requests written in place.
+
+        The destination is preallocated to the object size and every part is
+        written at its own offset, so at most concurrency parts are in memory.
+        Objects smaller than two parts, or providers without ranged reads,
+        use a single download_file.
+        """
+        ranged = await self._open_ranged(file_id) if concurrency > 1 else None
+        if ranged is None or ranged[0] < 2 * part_size:
+            return await self.download_file(file_id, destination)
+        size, fetch = ranged
+        offsets = list(range(0, size, part_size))
+        logging.info(f"Downloading {size} bytes in {len(offsets)} parts over {concurrency} connections")
+
+        with open(destination, 'wb') as f:
+            f.truncate(size)
+
+        loop = asyncio.get_running_loop()
+
+        def write_at(f, offset, data):
+            f.seek(offset)
+            f.write(data)
+
+        async def worker():
+            # one handle per worker, so seek + write never interleave
+            with open(destination, 'r+b') as f:
+                while offsets:
+                    start = offsets.pop(0)
+                    end = min(start + part_size, size) - 1
+                    data = await fetch(start, end)
+                    if len(data) != end - start + 1:
+                        raise IOError(f"Range {start}-{end} of {file_id} returned {len(data)} bytes")
+                    await loop.run_in_executor(None, write_at, f, start, data)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(offsets)))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        return True
+
+    async def download_stream_parallel(self, file_id, part_size: int = 16 * 1024 * 1024, concurrency: int = 4):
+        """Like download_stream, but keeps up to concurrency ranged requests ahead and yields the parts in order.
+
+        At most concurrency parts are in memory. Objects smaller than two parts,
+        or providers without ranged reads, fall back to download_stream.
+        """
+        ranged = await self._open_ranged(file_id) if concurrency > 1 else None
+        if ranged is None or ranged[0] < 2 * part_size:
+            async for chunk in self.download_stream(file_id):
+                yield chunk
+            return
+        size, fetch = ranged
+        offsets = iter(range(0, size, part_size))
+        pending = deque()
+
+        def schedule_next():
+            start = next(offsets, None)
+            if start is not None:
+                end = min(start + part_size, size) - 1
+                pending.append((start, end, asyncio.ensure_future(fetch(start, end))))
+
+        try:
+            for _ in range(concurrency):
+                schedule_next()
+            while pending:
+                start, end, part = pending.popleft()
+                data = await part
+                if len(data) != end - start + 1:
+                    raise IOError(f"Range {start}-{end} of {file_id} returned {len(data)} bytes")
+                schedule_next()
+                yield data
+        finally:
+            for _, _, part in pending:
+                part.cancel()
+            await asyncio.gather(*(part for _, _, part in pending), return_exceptions=True)
+
+    async def delete_files(self, file_ids):
+        """Delete several files and return the ids that are gone; failures are logged, not raised.
+
+        Default: one delete_file per id. Providers with a bulk/batch delete API override this.
+        """
+        deleted = []
+        for file_id in file_ids:
+            try:
+                await self.delete_file(file_id)
+                deleted.append(file_id)
+            except Exception as e:
+                logging.error(f"Failed to delete {file_id}: {e}")
+        return deleted
+
+    async def close(self):
+        """Release pooled connections; providers that keep sessions override this."""
+        pass
+
     @abstractmethod
     async def download_file(self, file_id, destination):
         pass
-        
+
     @abstractmethod
     async def verify_connection(self):
         pass
-        
+
     @abstractmethod
     async def refresh_token(self):
         pass
-        
+
     @abstractmethod
     async def authenticate(self):
-        pass 
\ No newline at end of file
+        pass
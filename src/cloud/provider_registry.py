@@ -0,0 +1,141 @@
+import time
+import asyncio
+import logging
+from typing import Dict
+
+from cloud.interfaces.cloud_provider import CloudProvider
+from cloud.cloud_factory import CloudFactory, PROVIDERS
+from cloud.sdk_executor import sdk_executor
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderRegistry:
+    """Keeps one initialized client per provider for the lifetime of the process.
+
+    A client is built on first use and verified at most once per verify_ttl
+    seconds. invalidate() marks a client as unverified after an error, so the
+    next get() checks the connection (refreshing or re-authenticating) before
+    handing it out again. check_status() answers from the same cache, so the
+    console and the backups share one health probe per provider and TTL.
+    """
+
+    VALID_PROVIDERS = list(PROVIDERS)
+
+    def __init__(self, config: dict, verify_ttl: float = 300):
+        self.config = config
+        self.verify_ttl = verify_ttl
+        self._clients: Dict[str, CloudProvider] = {}
+        self._verified_at: Dict[str, float] = {}
+        self._failed_at: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        sdk_executor.configure(config.get('providers'))
+
+    def __getstate__(self):
+        # Clients (SDK sessions) and loop-bound locks stay in this process; a
+        # spawned service process builds and verifies its own on first use
+        state = self.__dict__.copy()
+        state.update(_clients={}, _verified_at={}, _failed_at={}, _locks={})
+        return state
+
+    def _create_client(self, provider_name: str, login: bool = True) -> CloudProvider:
+        client = CloudFactory.get_provider(provider_name, self.config.get(provider_name, {}), login)
+        logging.info(f"{PROVIDERS[provider_name][0]} client initialized successfully")
+        return client
+
+    async def _client(self, provider_name: str, login: bool = True) -> CloudProvider:
+        """The cached client, built on the SDK pool if missing; callers hold the provider's lock."""
+        client = self._clients.get(provider_name)
+        if client is None:
+            # Constructors may load or refresh tokens over the network, or open an interactive login
+            client = await sdk_executor.run(self._create_client, provider_name, login, timeout=None)
+            self._clients[provider_name] = client
+        return client
+
+    async def _verify(self, client: CloudProvider):
+        """Verify provider connection and handle token refresh."""
+        try:
+            await client.verify_connection()
+        except Exception as auth_error:
+            try:
+                logging.info("Authentication failed. Attempting token refresh...")
+                await client.refresh_token()
+            except Exception as refresh_error:
+                logging.info(f"Token refresh failed: {refresh_error}")
+                logging.info("Attempting to re-authenticate...")
+                await client.authenticate()
+
+    async def get(self, provider_name: str) -> CloudProvider:
+        """Return the provider's client, creating and verifying it only when needed."""
+        lock = self._locks.setdefault(provider_name, asyncio.Lock())
+        async with lock:
+            client = await self._client(provider_name)
+
+            verified_at = self._verified_at.get(provider_name)
+            if verified_at is None or time.monotonic() - verified_at > self.verify_ttl:
+                await self._verify(client)
+                self._verified_at[provider_name] = time.monotonic()
+                self._failed_at.pop(provider_name, None)
+            else:
+                logging.debug(f"Reusing {provider_name} client verified {time.monotonic() - verified_at:.0f}s ago")
+            return client
+
+    async def _probe(self, provider_name: str):
+        client = await self._client(provider_name, login=False)
+        await client.verify_connection()
+
+    async def check_status(self, provider_name: str, timeout: float | None = None) -> bool:
+        """Whether the provider is reachable, for status displays.
+
+        A result younger than verify_ttl (success or failure) is returned
+        without a request. Unlike get(), a failed probe is not followed by a
+        token refresh or an interactive login. A probe (client creation
+        included) taking longer than timeout seconds counts as a failure.
+        The client it builds stays cached for get().
+        """
+        lock = self._locks.setdefault(provider_name, asyncio.Lock())
+        async with lock:
+            now = time.monotonic()
+            verified_at = self._verified_at.get(provider_name)
+            if verified_at is not None and now - verified_at <= self.verify_ttl:
+                return True
+            failed_at = self._failed_at.get(provider_name)
+            if failed_at is not None and now - failed_at <= self.verify_ttl:
+                return False
+
+            try:
+                await asyncio.wait_for(self._probe(provider_name), timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Health probe for {provider_name} timed out after {timeout}s")
+                self._failed_at[provider_name] = time.monotonic()
+                return False
+            except Exception as e:
+                logging.warning(f"Health probe for {provider_name} failed: {e}")
+                self._failed_at[provider_name] = time.monotonic()
+                return False
+            self._verified_at[provider_name] = time.monotonic()
+            self._failed_at.pop(provider_name, None)
+            return True
+
+    async def check_all(self, provider_names, timeout: float | None = None):
+        """Probe several providers concurrently, yielding (provider_name, active) as each one finishes."""
+        async def probe(provider_name):
+            return provider_name, await self.check_status(provider_name, timeout)
+
+        for result in asyncio.as_completed([probe(provider_name) for provider_name in provider_names]):
+            yield await result
+
+    def invalidate(self, provider_name: str):
+        """Force the next get() to re-verify the client (e.g. after an auth error)."""
+        self._verified_at.pop(provider_name, None)
+
+    async def close(self):
+        """Close every cached client."""
+        for provider_name, client in list(self._clients.items()):
+            try:
+                await client.close()
+            except Exception as e:
+                logging.warning(f"Error closing {provider_name} client: {e}")
+        self._clients.clear()
+        self._verified_at.clear()
+        self._failed_at.clear()
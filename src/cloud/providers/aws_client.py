@@ -1,21 +1,88 @@
 from cloud.interfaces.cloud_provider import CloudProvider
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 import logging
+import threading
 from pathlib import Path
+import asyncio
 import uuid
 
 logger = logging.getLogger(__name__)
 
+MB = 1024 * 1024
+
+
+class TransferCancelled(Exception):
+    pass
+
+
+class TransferProgress:
+    """Thread-safe boto3 transfer callback that logs progress every few percent.
+
+    Raising from the callback makes boto3 abort the transfer, so setting
+    cancel_event stops a transfer whose caller timed out or was cancelled.
+    """
+
+    def __init__(self, label: str, total: int, step: int = 10, cancel_event: threading.Event | None = None):
+        self.label = label
+        self.total = total
+        self.step = step
+        self.cancel_event = cancel_event
+        self.transferred = 0
+        self._next_report = step
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount: int):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise TransferCancelled(f"{self.label} cancelled")
+        with self._lock:
+            self.transferred += bytes_amount
+            if not self.total:
+                return
+            percent = self.transferred * 100 // self.total
+            if percent >= self._next_report:
+                self._next_report = (percent // self.step + 1) * self.step
+                logging.info(f"{self.label}: {percent}% ({self.transferred}/{self.total} bytes)")
+
+
 class AWSClient(CloudProvider):
-    def __init__(self, aws_access_key: str, aws_secret_key: str, bucket_name: str, region: str = 'us-east-1'):
+    # S3 requires every part except the last to be at least 5 MiB and allows
+    # at most 10,000 parts, so 64 MiB parts cover objects up to ~640 GB.
+    MIN_PART_SIZE = 5 * MB
+    MAX_PARTS = 10_000
+    NATIVE_STREAM_UPLOAD = True
+    DEFAULT_PART_SIZE = 64 * MB
+
+    def __init__(self, aws_access_key: str, aws_secret_key: str, bucket_name: str, region: str = 'us-east-1', transfer: dict = None):
+        """
+        Args:
+            transfer (dict): optional 'transfer' settings from the 'aws' section of config.json:
+                multipart_chunksize_mb, max_concurrency and max_in_flight_mb
+        """
         self.bucket_name = bucket_name
+        transfer = transfer or {}
+        self.part_size = max(self.MIN_PART_SIZE, int(transfer.get('multipart_chunksize_mb', 64) * MB))
+        # Bound memory: at most max_in_flight_mb of parts may be buffered at once
+        in_flight = int(transfer.get('max_in_flight_mb', 1024) * MB)
+        self.max_concurrency = max(1, min(transfer.get('max_concurrency', 10), in_flight // self.part_size))
+        self.transfer_config = TransferConfig(
+            multipart_threshold=self.part_size,
+            multipart_chunksize=self.part_size,
+            max_concurrency=self.max_concurrency,
+            # download buffer: io_chunksize (256 KiB) entries
+            max_io_queue=max(1, in_flight // (256 * 1024)),
+            use_threads=True
+        )
         # AWS SDK (boto3) handles credential caching automatically
         # in ~/.aws/credentials and ~/.aws/config
         self.s3_client = boto3.client(
             's3',
             aws_access_key_id=aws_access_key,
             aws_secret_access_key=aws_secret_key,
-            region_name=region
+            region_name=region,
+            # one pooled connection per concurrent part
+            config=Config(max_pool_connections=max(10, self.max_concurrency))
         )
 
     async def upload_file(self, file_path: str, destination: str):
@@ -30,10 +97,16 @@ class AWSClient(CloudProvider):
             # Usar el ID como parte del path en S3
             s3_path = f"{destination}/{file_id}/{file_path.name}"
 
-            self.s3_client.upload_file(
+            cancel_event = threading.Event()
+            await self._run_blocking(
+                self.s3_client.upload_file,
                 str(file_path),
                 self.bucket_name,
-                s3_path
+                s3_path,
+                Config=self.transfer_config,
+                Callback=TransferProgress(f"Upload {file_path.name}", file_path.stat().st_size, cancel_event=cancel_event),
+                timeout=None,
+                cancel_event=cancel_event
             )
             logging.info(f"Successfully uploaded {file_path} to S3")
             return file_id  # Devolver el ID único
@@ -41,29 +114,153 @@ class AWSClient(CloudProvider):
             logging.error(f"Failed to upload file to S3: {e}")
             raise
 
-    async def download_file(self, file_id: str, destination: str):
+    async def upload_stream(self, chunks, file_name: str, destination: str):
+        """Upload an async iterator of chunks with a multipart upload.
+
+        Up to max_concurrency parts are uploaded at once; reading from chunks
+        pauses while that many parts are in flight, which bounds memory.
+        The stream fails, and the upload is aborted, as soon as it needs more
+        than MAX_PARTS parts.
+        """
+        file_id = str(uuid.uuid4())
+        s3_path = f"{destination}/{file_id}/{file_name}"
+        upload = await self._run_blocking(self.s3_client.create_multipart_upload, Bucket=self.bucket_name, Key=s3_path)
+        upload_id = upload['UploadId']
+        parts = []
+        pending = set()
+        progress = TransferProgress(f"Upload {file_name}", 0)
+
+        async def upload_part(part_number: int, body: bytes):
+            response = await self._run_blocking(
+                self.s3_client.upload_part,
+                Bucket=self.bucket_name,
+                Key=s3_path,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body,
+                timeout=None
+            )
+            parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+            progress(len(body))
+            logging.info(f"Upload {file_name}: part {part_number} done ({progress.transferred} bytes)")
+
+        async def submit(part_number: int, body: bytes):
+            self._check_part_count(part_number)
+            if len(pending) >= self.max_concurrency:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.difference_update(done)
+                for task in done:
+                    task.result()
+            pending.add(asyncio.create_task(upload_part(part_number, body)))
+
         try:
-            # Buscar el objeto en el bucket usando el file_id en la estructura de carpetas
-            prefix = f"backups/{file_id}/"
-            response = self.s3_client.list_objects_v2(
+            buffer = bytearray()
+            part_number = 0
+            async for chunk in chunks:
+                buffer += chunk
+                if len(buffer) >= self.part_size:
+                    part_number += 1
+                    await submit(part_number, bytes(buffer[:self.part_size]))
+                    del buffer[:self.part_size]
+            if buffer or not part_number:
+                part_number += 1
+                await submit(part_number, bytes(buffer))
+            if pending:
+                await asyncio.gather(*pending)
+
+            await self._run_blocking(
+                self.s3_client.complete_multipart_upload,
                 Bucket=self.bucket_name,
-                Prefix=prefix
+                Key=s3_path,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': sorted(parts, key=lambda part: part['PartNumber'])}
             )
+            logging.info(f"Successfully streamed {file_name} to S3 in {len(parts)} parts")
+            return file_id
+        except Exception as e:
+            logging.error(f"Failed to stream file to S3: {e}")
+            for task in pending:
+                task.cancel()
+            await self._run_blocking(self.s3_client.abort_multipart_upload, Bucket=self.bucket_name, Key=s3_path, UploadId=upload_id)
+            raise
+
+    def _check_part_count(self, parts: int):
+        if parts > self.MAX_PARTS:
+            raise ValueError(f"Upload needs more than {self.MAX_PARTS} parts of {self.part_size // MB} MiB; "
+                             f"increase aws.transfer.multipart_chunksize_mb")
+
+    async def upload_bytes(self, data: bytes, file_name: str, destination: str):
+        """Upload data with a single PutObject when it is smaller than one part."""
+        if len(data) >= self.part_size:
+            return await super().upload_bytes(data, file_name, destination)
+        file_id = str(uuid.uuid4())
+        s3_path = f"{destination}/{file_id}/{file_name}"
+        try:
+            await self._run_blocking(self.s3_client.put_object, Bucket=self.bucket_name, Key=s3_path, Body=data)
+            return file_id
+        except Exception as e:
+            logging.error(f"Failed to upload {file_name} to S3: {e}")
+            raise
+
+    async def _find_object(self, file_id: str):
+        """Return (key, size) of the object stored under file_id."""
+        # Buscar el objeto en el bucket usando el file_id en la estructura de carpetas
+        prefix = f"backups/{file_id}/"
+        response = await self._run_blocking(
+            self.s3_client.list_objects_v2,
+            Bucket=self.bucket_name,
+            Prefix=prefix
+        )
+
+        # Obtener el primer objeto que coincida con el prefix
+        if 'Contents' not in response or not response['Contents']:
+            raise FileNotFoundError(f"No file found with ID: {file_id}")
+
+        # Obtener la key completa del primer objeto
+        return response['Contents'][0]['Key'], response['Contents'][0].get('Size', 0)
+
+    async def download_stream(self, file_id: str):
+        """Yield the object's body in STREAM_CHUNK_SIZE pieces as it arrives."""
+        s3_key, size = await self._find_object(file_id)
+        logging.info(f"Streaming S3 object: {s3_key} ({size} bytes)")
+        response = await self._run_blocking(self.s3_client.get_object, Bucket=self.bucket_name, Key=s3_key)
+        body = response['Body']
+        try:
+            while chunk := await self._run_blocking(body.read, self.STREAM_CHUNK_SIZE, timeout=None):
+                yield chunk
+        finally:
+            body.close()
+
+    async def _open_ranged(self, file_id: str):
+        s3_key, size = await self._find_object(file_id)
+
+        def read_range(start: int, end: int) -> bytes:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key, Range=f"bytes={start}-{end}")
+            with response['Body'] as body:
+                return body.read()
 
-            # Obtener el primer objeto que coincida con el prefix
-            if 'Contents' not in response or not response['Contents']:
-                raise FileNotFoundError(f"No file found with ID: {file_id}")
+        async def fetch(start: int, end: int) -> bytes:
+            return await self._run_blocking(read_range, start, end, timeout=None)
 
-            # Obtener la key completa del primer objeto
-            s3_key = response['Contents'][0]['Key']
+        return size, fetch
+
+    async def download_file(self, file_id: str, destination: str):
+        try:
+            s3_key, size = await self._find_object(file_id)
             
             logging.info(f"Downloading S3 object: {s3_key}")
             
             # Descargar el archivo
-            self.s3_client.download_file(
+            cancel_event = threading.Event()
+            await self._run_blocking(
+                self.s3_client.download_file,
                 self.bucket_name,
                 s3_key,
-                destination
+                destination,
+                Config=self.transfer_config,
+                Callback=TransferProgress(f"Download {s3_key}", size, cancel_event=cancel_event),
+                timeout=None,
+                cancel_event=cancel_event
             )
             
             logging.info(f"Successfully downloaded file to {destination}")
@@ -74,8 +271,8 @@ class AWSClient(CloudProvider):
 
     async def verify_connection(self):
         try:
-            # Attempt to list buckets to verify connection
-            self.s3_client.list_buckets()
+            # HEAD on the backup bucket: one request that also checks access to it
+            await self._run_blocking(self.s3_client.head_bucket, Bucket=self.bucket_name)
             logging.info("AWS S3 connection verified successfully")
             return True
         except Exception as e:
@@ -96,16 +293,56 @@ class AWSClient(CloudProvider):
         try:
             # Construct the S3 key from the file ID
             prefix = f"backups/{file_id}/"
-            response = self.s3_client.list_objects_v2(
+            response = await self._run_blocking(
+                self.s3_client.list_objects_v2,
                 Bucket=self.bucket_name,
                 Prefix=prefix
             )
             
             if 'Contents' in response:
                 for obj in response['Contents']:
-                    self.s3_client.delete_object(Bucket=self.bucket_name, Key=obj['Key'])
+                    await self._run_blocking(self.s3_client.delete_object, Bucket=self.bucket_name, Key=obj['Key'])
             
             logging.info(f"Successfully deleted file with ID: {file_id} from S3")
         except Exception as e:
             logging.error(f"Failed to delete file from S3: {e}")
-            raise 
\ No newline at end of file
+            raise
+
+    # delete_objects accepts at most 1000 keys per request
+    DELETE_BATCH_SIZE = 1000
+
+    async def delete_files(self, file_ids):
+        """Delete many backups with delete_objects (1000 keys per request) instead of one call per object."""
+        owners = {}
+        listings = await asyncio.gather(*[
+            self._run_blocking(self.s3_client.list_objects_v2, Bucket=self.bucket_name, Prefix=f"backups/{file_id}/")
+            for file_id in file_ids
+        ], return_exceptions=True)
+        failed = set()
+        for file_id, listing in zip(file_ids, listings):
+            if isinstance(listing, Exception):
+                logging.error(f"Failed to list S3 objects for {file_id}: {listing}")
+                failed.add(file_id)
+                continue
+            for obj in listing.get('Contents', []):
+                owners[obj['Key']] = file_id
+
+        keys = list(owners)
+        for i in range(0, len(keys), self.DELETE_BATCH_SIZE):
+            batch = keys[i:i + self.DELETE_BATCH_SIZE]
+            try:
+                response = await self._run_blocking(
+                    self.s3_client.delete_objects,
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+                )
+                for error in response.get('Errors', []):
+                    logging.error(f"Failed to delete S3 object {error['Key']}: {error.get('Message')}")
+                    failed.add(owners[error['Key']])
+            except Exception as e:
+                logging.error(f"Failed to delete S3 objects: {e}")
+                failed.update(owners[key] for key in batch)
+
+        deleted = [file_id for file_id in file_ids if file_id not in failed]
+        logging.info(f"Deleted {len(deleted)} of {len(file_ids)} backups from S3 in {-(-len(keys) // self.DELETE_BATCH_SIZE)} requests")
+        return deleted
\ No newline at end of file
@@ -3,27 +3,64 @@ from azure.storage.blob import BlobServiceClient
 from azure.identity import ClientSecretCredential
 from azure.core.exceptions import AzureError
 import logging
+import asyncio
+import threading
 from pathlib import Path
 import uuid
 
 logger = logging.getLogger(__name__)
 
+MB = 1024 * 1024
+
+
+class TransferCancelled(Exception):
+    pass
+
+
+def _cancellable_hook(cancel_event: threading.Event):
+    """SDK progress_hook that aborts the transfer once cancel_event is set."""
+    def hook(current, total):
+        if cancel_event.is_set():
+            raise TransferCancelled("Azure transfer cancelled")
+    return hook
+
+
 class AzureClient(CloudProvider):
-    def __init__(self, connection_string: str, container_name: str, tenant_id: str = None, client_id: str = None, client_secret: str = None):
+    # A block blob holds at most 50,000 blocks, so 8 MiB blocks cover ~390 GB.
+    MAX_BLOCKS = 50_000
+    DEFAULT_BLOCK_SIZE = 8 * MB
+    NATIVE_STREAM_UPLOAD = True
+
+    def __init__(self, connection_string: str, container_name: str, tenant_id: str = None, client_id: str = None, client_secret: str = None, transfer: dict = None):
+        """
+        Args:
+            transfer (dict): optional 'transfer' settings from the 'azure' section of config.json:
+                block_size_mb, max_concurrency and max_in_flight_mb
+        """
         self.container_name = container_name
         self.connection_string = connection_string
         self.tenant_id = tenant_id
         self.client_id = client_id
         self.client_secret = client_secret
+        transfer = transfer or {}
+        self.block_size = max(1 * MB, int(transfer.get('block_size_mb', self.DEFAULT_BLOCK_SIZE // MB) * MB))
+        # Bound memory: at most max_in_flight_mb of blocks may be buffered at once
+        in_flight = int(transfer.get('max_in_flight_mb', 256) * MB)
+        self.max_concurrency = max(1, min(transfer.get('max_concurrency', 8), in_flight // self.block_size))
         # Azure SDK handles credential caching automatically
-        self.blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        self.blob_service_client = BlobServiceClient.from_connection_string(connection_string, **self._transfer_options())
         self.container_client = self.blob_service_client.get_container_client(container_name)
 
+    def _transfer_options(self) -> dict:
+        # Anything above one block is staged as blocks in parallel and committed with a block list
+        return {'max_block_size': self.block_size, 'max_single_put_size': self.block_size}
+
     async def upload_file(self, file_path: str, destination: str):
         try:
             file_path = Path(file_path)
             if not file_path.exists():
                 raise FileNotFoundError(f"File not found: {file_path}")
+            self._check_block_count(-(-file_path.stat().st_size // self.block_size))
 
             # Generar un ID único para el archivo
             file_id = str(uuid.uuid4())
@@ -32,8 +69,18 @@ class AzureClient(CloudProvider):
             blob_path = f"{destination}/{file_id}/{file_path.name}"
 
             blob_client = self.container_client.get_blob_client(blob_path)
-            with open(file_path, "rb") as data:
-                blob_client.upload_blob(data, overwrite=True)
+            cancel_event = threading.Event()
+
+            def upload():
+                with open(file_path, "rb") as data:
+                    blob_client.upload_blob(
+                        data,
+                        overwrite=True,
+                        max_concurrency=self.max_concurrency,
+                        progress_hook=_cancellable_hook(cancel_event)
+                    )
+
+            await self._run_blocking(upload, timeout=None, cancel_event=cancel_event)
             
             logging.info(f"Successfully uploaded {file_path} to Azure Blob Storage")
             return file_id  # Devolver el ID único
@@ -41,26 +88,131 @@ class AzureClient(CloudProvider):
             logging.error(f"Failed to upload file to Azure: {e}")
             raise
 
+    async def upload_stream(self, chunks, file_name: str, destination: str):
+        """Upload an async iterator of chunks as a block blob.
+
+        Blocks of block_size are staged up to max_concurrency at a time;
+        reading from chunks pauses while that many are in flight, which
+        bounds memory. The block list is committed once every block is staged.
+        The stream fails as soon as it needs more than MAX_BLOCKS blocks.
+        """
+        file_id = str(uuid.uuid4())
+        blob_client = self.container_client.get_blob_client(f"{destination}/{file_id}/{file_name}")
+        block_ids = []
+        pending = set()
+        uploaded = 0
+
+        async def stage_block(block_id: str, body: bytes):
+            nonlocal uploaded
+            await self._run_blocking(blob_client.stage_block, block_id, body, length=len(body))
+            uploaded += len(body)
+            logging.info(f"Upload {file_name}: block {block_id} staged ({uploaded} bytes)")
+
+        async def submit(body: bytes):
+            if len(pending) >= self.max_concurrency:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.difference_update(done)
+                for task in done:
+                    task.result()
+            self._check_block_count(len(block_ids) + 1)
+            # Block ids must all have the same length
+            block_id = f"{len(block_ids):06d}"
+            block_ids.append(block_id)
+            pending.add(asyncio.create_task(stage_block(block_id, body)))
+
+        try:
+            buffer = bytearray()
+            async for chunk in chunks:
+                buffer += chunk
+                if len(buffer) >= self.block_size:
+                    await submit(bytes(buffer[:self.block_size]))
+                    del buffer[:self.block_size]
+            if buffer:
+                await submit(bytes(buffer))
+            if pending:
+                await asyncio.gather(*pending)
+
+            await self._run_blocking(blob_client.commit_block_list, block_ids)
+            logging.info(f"Successfully streamed {file_name} to Azure Blob Storage in {len(block_ids)} blocks")
+            return file_id
+        except Exception as e:
+            # Uncommitted blocks are discarded by the service after a week
+            logging.error(f"Failed to stream file to Azure: {e}")
+            for task in pending:
+                task.cancel()
+            raise
+
+    async def upload_bytes(self, data: bytes, file_name: str, destination: str):
+        """Upload data with a single Put Blob when it fits in one block."""
+        if len(data) > self.block_size:
+            return await super().upload_bytes(data, file_name, destination)
+        file_id = str(uuid.uuid4())
+        blob_client = self.container_client.get_blob_client(f"{destination}/{file_id}/{file_name}")
+        try:
+            await self._run_blocking(blob_client.upload_blob, data, overwrite=True)
+            return file_id
+        except Exception as e:
+            logging.error(f"Failed to upload {file_name} to Azure: {e}")
+            raise
+
+    def _check_block_count(self, blocks: int):
+        if blocks > self.MAX_BLOCKS:
+            raise ValueError(f"Upload needs more than {self.MAX_BLOCKS} blocks of {self.block_size // MB} MiB; "
+                             f"increase azure.transfer.block_size_mb")
+
+    async def _find_blob_client(self, file_id: str):
+        # Buscar el blob usando el file_id en la estructura de carpetas
+        prefix = f"backups/{file_id}/"
+
+        # Obtener el primer blob que coincida con el prefix
+        blob = await self._run_blocking(lambda: next(iter(self.container_client.list_blobs(name_starts_with=prefix)), None))
+        if not blob:
+            raise FileNotFoundError(f"No file found with ID: {file_id}")
+
+        # Obtener el blob client para el archivo específico
+        return self.container_client.get_blob_client(blob.name)
+
+    async def download_stream(self, file_id: str):
+        """Yield the blob's content chunk by chunk as the SDK downloads it."""
+        blob_client = await self._find_blob_client(file_id)
+        logging.info(f"Streaming Azure blob: {blob_client.blob_name}")
+        downloader = await self._run_blocking(blob_client.download_blob)
+        chunks = downloader.chunks()
+        while (chunk := await self._run_blocking(next, chunks, None, timeout=None)) is not None:
+            yield chunk
+
+    async def download_parallel(self, file_id: str, destination: str, part_size: int = 16 * 1024 * 1024, concurrency: int = 4):
+        """Ranged download handled by the SDK: max_concurrency parallel GETs written in place."""
+        try:
+            blob_client = await self._find_blob_client(file_id)
+            logging.info(f"Downloading Azure blob {blob_client.blob_name} over {concurrency} connections")
+            cancel_event = threading.Event()
+
+            def download():
+                with open(destination, "wb") as file:
+                    downloader = blob_client.download_blob(max_concurrency=concurrency, progress_hook=_cancellable_hook(cancel_event))
+                    downloader.readinto(file)
+
+            await self._run_blocking(download, timeout=None, cancel_event=cancel_event)
+            logging.info(f"Successfully downloaded file to {destination}")
+            return True
+        except Exception as e:
+            logging.error(f"Failed to download file from Azure: {e}")
+            raise
+
     async def download_file(self, file_id: str, destination: str):
         try:
-            # Buscar el blob usando el file_id en la estructura de carpetas
-            prefix = f"backups/{file_id}/"
-            blobs = self.container_client.list_blobs(name_starts_with=prefix)
+            blob_client = await self._find_blob_client(file_id)
             
-            # Obtener el primer blob que coincida con el prefix
-            blob = next(blobs, None)
-            if not blob:
-                raise FileNotFoundError(f"No file found with ID: {file_id}")
+            logging.info(f"Downloading Azure blob: {blob_client.blob_name}")
+            cancel_event = threading.Event()
 
-            # Obtener el blob client para el archivo específico
-            blob_client = self.container_client.get_blob_client(blob.name)
-            
-            logging.info(f"Downloading Azure blob: {blob.name}")
-            
-            # Descargar el archivo
-            with open(destination, "wb") as file:
-                data = blob_client.download_blob()
-                file.write(data.readall())
+            # Descargar el archivo por partes, sin cargarlo entero en memoria
+            def download():
+                with open(destination, "wb") as file:
+                    blob_client.download_blob(progress_hook=_cancellable_hook(cancel_event)).readinto(file)
+
+            await self._run_blocking(download, timeout=None, cancel_event=cancel_event)
             
             logging.info(f"Successfully downloaded file to {destination}")
             return True
@@ -82,7 +234,8 @@ class AzureClient(CloudProvider):
                     client_id=self.client_id,
                     client_secret=self.client_secret
                 )
-                self.blob_service_client = BlobServiceClient(account_url=self.connection_string, credential=credential)
+                self.blob_service_client = BlobServiceClient(account_url=self.connection_string, credential=credential, **self._transfer_options())
+                self.container_client = self.blob_service_client.get_container_client(self.container_name)
                 logging.info("Authentication with Azure AD completed successfully.")
             else:
                 logging.info("Authentication completed using connection string.")
@@ -111,10 +264,8 @@ class AzureClient(CloudProvider):
     async def verify_connection(self):
         """Verifica que la conexión a Azure Blob Storage sea válida."""
         try:
-            # Realizamos una operación simple, como listar los blobs del contenedor, para verificar la conexión.
-            blobs = list(self.container_client.list_blobs())
-            if not blobs:
-                raise AzureError(f"No blobs found in the container {self.container_name}.")
+            # Leer las propiedades del contenedor: una sola petición, sin importar cuántos blobs tenga
+            await self._run_blocking(self.container_client.get_container_properties)
             logging.info(f"Successfully connected to Azure Blob Storage container {self.container_name}.")
             return True
         except AzureError as e:
@@ -128,13 +279,51 @@ class AzureClient(CloudProvider):
         try:
             # Construct the blob path from the file ID
             prefix = f"backups/{file_id}/"
-            blobs = self.container_client.list_blobs(name_starts_with=prefix)
-            
-            for blob in blobs:
-                blob_client = self.container_client.get_blob_client(blob.name)
-                blob_client.delete_blob()
+
+            def delete():
+                for blob in self.container_client.list_blobs(name_starts_with=prefix):
+                    self.container_client.get_blob_client(blob.name).delete_blob()
+
+            await self._run_blocking(delete)
             
             logging.info(f"Successfully deleted file with ID: {file_id} from Azure Blob Storage")
         except Exception as e:
             logging.error(f"Failed to delete file from Azure: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    # Blob batch requests take up to 256 sub-requests
+    DELETE_BATCH_SIZE = 256
+
+    async def delete_files(self, file_ids):
+        """Delete many backups with blob batch requests (256 deletes per call)."""
+        owners = {}
+        failed = set()
+        for file_id in file_ids:
+            try:
+                blobs = await self._run_blocking(
+                    lambda file_id=file_id: list(self.container_client.list_blobs(name_starts_with=f"backups/{file_id}/"))
+                )
+                owners.update((blob.name, file_id) for blob in blobs)
+            except Exception as e:
+                logging.error(f"Failed to list Azure blobs for {file_id}: {e}")
+                failed.add(file_id)
+
+        names = list(owners)
+        for i in range(0, len(names), self.DELETE_BATCH_SIZE):
+            batch = names[i:i + self.DELETE_BATCH_SIZE]
+            try:
+                responses = await self._run_blocking(
+                    lambda batch=batch: list(self.container_client.delete_blobs(*batch, raise_on_any_failure=False))
+                )
+                for name, response in zip(batch, responses):
+                    # 404: already gone
+                    if response.status_code not in (202, 404):
+                        logging.error(f"Failed to delete Azure blob {name}: {response.status_code}")
+                        failed.add(owners[name])
+            except Exception as e:
+                logging.error(f"Failed to delete Azure blobs: {e}")
+                failed.update(owners[name] for name in batch)
+
+        deleted = [file_id for file_id in file_ids if file_id not in failed]
+        logging.info(f"Deleted {len(deleted)} of {len(file_ids)} backups from Azure Blob Storage")
+        return deleted
\ No newline at end of file
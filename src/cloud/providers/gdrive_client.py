@@ -3,21 +3,29 @@ from ..interfaces.cloud_provider import CloudProvider
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import Resource
 from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+from google.auth.transport.requests import Request, AuthorizedSession
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload, MediaIoBaseUpload
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
 import pickle
 import os
 import io
 import logging
+import threading
 from pathlib import Path
 from utils.logger import setup_logging
+from cloud.sdk_executor import DEFAULT
 
 logger = logging.getLogger(__name__)
 
 class GoogleDriveClient(CloudProvider):
     SCOPES = ['https://www.googleapis.com/auth/drive.file']
     DEFAULT_PORT = 52479
+    # Bytes per media request; also the most a download holds in memory
+    DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+    # Largest upload_bytes payload sent as one multipart request instead of a resumable upload
+    SIMPLE_UPLOAD_LIMIT = 5 * 1024 * 1024
     
     def __init__(self, gdrive_config: dict, login:bool=False):
         """
@@ -28,6 +36,9 @@ class GoogleDriveClient(CloudProvider):
         self.config = gdrive_config
         self.token_dir =  FileHandler.get_paht('.cache') #'.cache'
         self.token_path = os.path.join(self.token_dir, 'gdrive_token.pickle')
+        self.credentials = None
+        self._ranged_sessions = threading.local()
+        self._thread_http = threading.local()
         self.service = self._initialize_service(login)
         setup_logging()
 
@@ -69,18 +80,33 @@ class GoogleDriveClient(CloudProvider):
 
         try:
             service = build('drive', 'v3', credentials=creds)
+            self.credentials = creds
             return service
         except Exception as e:
             logging.error(f"Failed to initialize Google Drive service: {e}")
             raise
 
+    def _new_http(self) -> AuthorizedHttp:
+        return AuthorizedHttp(self.credentials, http=httplib2.Http())
+
+    def _http(self) -> AuthorizedHttp:
+        """httplib2 is not thread-safe: every SDK pool thread gets its own authorized connection."""
+        http = getattr(self._thread_http, 'http', None)
+        if http is None or http.credentials is not self.credentials:
+            http = self._thread_http.http = self._new_http()
+        return http
+
+    async def _execute(self, request, timeout=DEFAULT):
+        """Execute a googleapiclient request on the SDK thread pool."""
+        return await self._run_blocking(lambda: request.execute(http=self._http()), timeout=timeout)
+
     async def get_or_create_backup_folder(self) -> str:
             """Get or create 'backups' folder in Google Drive and return its ID"""
             folder_name = 'backups'
             
             # Buscar si la carpeta ya existe
             query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-            results = self.service.files().list(q=query, spaces='drive', fields='files(id)').execute()
+            results = await self._execute(self.service.files().list(q=query, spaces='drive', fields='files(id)'))
             files = results.get('files', [])
             
             if files:
@@ -93,10 +119,10 @@ class GoogleDriveClient(CloudProvider):
                 'mimeType': 'application/vnd.google-apps.folder'
             }
             
-            folder = self.service.files().create(
+            folder = await self._execute(self.service.files().create(
                 body=folder_metadata,
                 fields='id'
-            ).execute()
+            ))
             
             return folder.get('id')
 
@@ -120,11 +146,26 @@ class GoogleDriveClient(CloudProvider):
                 resumable=True
             )
 
-            file = self.service.files().create(
+            request = self.service.files().create(
                 body=file_metadata,
                 media_body=media,
                 fields='id'
-            ).execute()
+            )
+            cancel_event = threading.Event()
+
+            def upload():
+                # Resumable upload, one chunk per request, so cancellation takes effect between chunks
+                response = None
+                http = self._http()
+                while response is None:
+                    if cancel_event.is_set():
+                        raise Exception(f"Upload of {file_path.name} cancelled")
+                    status, response = request.next_chunk(http=http)
+                    if status:
+                        logging.info(f"Upload Progress: {int(status.progress() * 100)}%")
+                return response
+
+            file = await self._run_blocking(upload, timeout=None, cancel_event=cancel_event)
 
             file_id = file.get('id')
             if not file_id:
@@ -137,24 +178,49 @@ class GoogleDriveClient(CloudProvider):
             logging.error(f"Failed to upload file to Google Drive: {e}")
             raise
 
+    async def upload_bytes(self, data: bytes, file_name: str, destination: str) -> str:
+        """Upload data with a single multipart request when it is below SIMPLE_UPLOAD_LIMIT."""
+        if len(data) > self.SIMPLE_UPLOAD_LIMIT:
+            return await super().upload_bytes(data, file_name, destination)
+        try:
+            backup_folder_id = await self.get_or_create_backup_folder()
+            media = MediaIoBaseUpload(io.BytesIO(data), mimetype='application/octet-stream', resumable=False)
+            request = self.service.files().create(
+                body={'name': file_name, 'parents': [backup_folder_id]},
+                media_body=media,
+                fields='id'
+            )
+            file = await self._execute(request)
+            file_id = file.get('id')
+            if not file_id:
+                raise Exception("No file ID returned from Google Drive")
+            return file_id
+        except Exception as e:
+            logging.error(f"Failed to upload {file_name} to Google Drive: {e}")
+            raise
+
     async def download_file(self, file_id: str, destination: str):
         try:
             logging.info(f"Downloading Google Drive file ID: {file_id}")
             
             request = self.service.files().get_media(fileId=file_id)
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
-                if status:
-                    logging.info(f"Download Progress: {int(status.progress() * 100)}%")
+            cancel_event = threading.Event()
+
+            def download():
+                request.http = self._http()
+                # MediaIoBaseDownload writes each chunk straight into the file
+                with open(destination, 'wb') as fh:
+                    downloader = MediaIoBaseDownload(fh, request, chunksize=self.DOWNLOAD_CHUNK_SIZE)
+
+                    done = False
+                    while done is False:
+                        if cancel_event.is_set():
+                            raise Exception(f"Download of {file_id} cancelled")
+                        status, done = downloader.next_chunk()
+                        if status:
+                            logging.info(f"Download Progress: {int(status.progress() * 100)}%")
 
-            fh.seek(0)
-            with open(destination, 'wb') as f:
-                f.write(fh.read())
-                f.flush()
+            await self._run_blocking(download, timeout=None, cancel_event=cancel_event)
 
             logging.info(f"Successfully downloaded file to {destination}")
             return True
@@ -162,12 +228,45 @@ class GoogleDriveClient(CloudProvider):
             logging.error(f"Failed to download file from Google Drive: {e}")
             raise 
 
+    async def download_stream(self, file_id: str):
+        """Yield the file's content one downloaded chunk at a time."""
+        request = self.service.files().get_media(fileId=file_id)
+        # next_chunk may run on a different pool thread each time: give this download its own connection
+        request.http = self._new_http()
+        buffer = io.BytesIO()
+        downloader = MediaIoBaseDownload(buffer, request, chunksize=self.DOWNLOAD_CHUNK_SIZE)
+        done = False
+        while done is False:
+            _, done = await self._run_blocking(downloader.next_chunk, timeout=None)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    async def _open_ranged(self, file_id: str):
+        metadata = await self._execute(self.service.files().get(fileId=file_id, fields='size'))
+        url = f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
+
+        def read_range(start: int, end: int) -> bytes:
+            # httplib2 (used by self.service) is not thread-safe: one requests session per thread
+            session = getattr(self._ranged_sessions, 'session', None)
+            if session is None or session.credentials is not self.credentials:
+                session = self._ranged_sessions.session = AuthorizedSession(self.credentials)
+            response = session.get(url, headers={"Range": f"bytes={start}-{end}"})
+            if response.status_code != 206:
+                raise Exception(f"Ranged download failed with status {response.status_code}: {response.text}")
+            return response.content
+
+        async def fetch(start: int, end: int) -> bytes:
+            return await self._run_blocking(read_range, start, end, timeout=None)
+
+        return int(metadata['size']), fetch
+
     async def verify_connection(self):
         """Verify the current connection is valid."""
         try:
             logging.info("Verifying Google Drive connection...")
-            # Try to list files (with minimal fields) to verify connection
-            self.service.files().list(pageSize=1, fields="files(id)").execute()
+            # Read the storage quota: constant cost, unlike listing files
+            await self._execute(self.service.about().get(fields="storageQuota"))
             logging.info("Connection verified successfully")
             return True
         except Exception as e:
@@ -183,12 +282,13 @@ class GoogleDriveClient(CloudProvider):
                     creds = pickle.load(token)
             
             if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
+                await self._run_blocking(creds.refresh, Request())
                 # Save refreshed credentials
                 with open(self.token_path, 'wb') as token:
                     pickle.dump(creds, token)
                 # Rebuild service with new credentials
                 self.service = build('drive', 'v3', credentials=creds)
+                self.credentials = creds
                 logging.info("Token refreshed successfully")
                 return True
             else:
@@ -204,7 +304,8 @@ class GoogleDriveClient(CloudProvider):
                 {"installed": self.config["installed"]},
                 self.SCOPES
             )
-            creds = flow.run_local_server(port=self.DEFAULT_PORT)
+            # Waits for the user in the browser: no timeout
+            creds = await self._run_blocking(flow.run_local_server, port=self.DEFAULT_PORT, timeout=None)
             
             # Save new credentials
             with open(self.token_path, 'wb') as token:
@@ -212,6 +313,7 @@ class GoogleDriveClient(CloudProvider):
             
             # Rebuild service with new credentials
             self.service = build('drive', 'v3', credentials=creds)
+            self.credentials = creds
             logging.info("Authentication completed successfully")
             return True
         except Exception as e:
@@ -220,8 +322,33 @@ class GoogleDriveClient(CloudProvider):
 
     async def delete_file(self, file_id: str):
         try:
-            self.service.files().delete(fileId=file_id).execute()
+            await self._execute(self.service.files().delete(fileId=file_id))
             logging.info(f"Successfully deleted file with ID: {file_id} from Google Drive")
         except Exception as e:
             logging.error(f"Failed to delete file from Google Drive: {e}")
-            raise 
\ No newline at end of file
+            raise
+
+    # Drive batch requests take up to 100 calls
+    DELETE_BATCH_SIZE = 100
+
+    async def delete_files(self, file_ids):
+        """Delete many files with Drive batch requests (100 deletes per HTTP call)."""
+        deleted = []
+
+        def on_response(request_id, response, exception):
+            # 404: already gone
+            if exception is None or getattr(getattr(exception, 'resp', None), 'status', None) == 404:
+                deleted.append(request_id)
+            else:
+                logging.error(f"Failed to delete {request_id} from Google Drive: {exception}")
+
+        for i in range(0, len(file_ids), self.DELETE_BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for file_id in file_ids[i:i + self.DELETE_BATCH_SIZE]:
+                batch.add(self.service.files().delete(fileId=file_id), request_id=file_id)
+            try:
+                await self._run_blocking(lambda batch=batch: batch.execute(http=self._http()))
+            except Exception as e:
+                logging.error(f"Failed to delete files from Google Drive: {e}")
+        logging.info(f"Deleted {len(deleted)} of {len(file_ids)} files from Google Drive")
+        return deleted 
\ No newline at end of file
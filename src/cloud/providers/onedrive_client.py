@@ -7,7 +7,11 @@ import asyncio
 import aiohttp
 import urllib.parse
 import os
+import json
 import pickle
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from utils.file_handler import FileHandler
 
 logger = logging.getLogger(__name__)
@@ -20,12 +24,22 @@ class OneDriveClient(CloudProvider):
         'Files.ReadWrite.All',
         'Sites.ReadWrite.All'
     ]
+    # Graph recommends a single PUT only for small files; bigger ones use an upload session
+    SIMPLE_UPLOAD_LIMIT = 4 * 1024 * 1024
+    # Upload session fragments must be multiples of 320 KiB (and below 60 MiB)
+    FRAGMENT_SIZE = 32 * 320 * 1024
+    FRAGMENT_RETRIES = 5
+    # Refresh tokens this many seconds before they actually expire
+    TOKEN_EXPIRY_MARGIN = 300
+    # Graph JSON batching accepts at most 20 requests per $batch call
+    BATCH_SIZE = 20
     
     def __init__(self, client_id: str, client_secret: str, login:bool=False):
         self.client_id = client_id
         self.client_secret = client_secret
         self.token_dir = FileHandler.get_paht('.cache') #'.cache'
         self.token_path = os.path.join(self.token_dir, 'onedrive_token.pickle')
+        self.sessions_path = os.path.join(self.token_dir, 'onedrive_upload_sessions.json')
         self.app = PublicClientApplication(
             client_id=self.client_id,
             authority="https://login.microsoftonline.com/common",
@@ -33,6 +47,9 @@ class OneDriveClient(CloudProvider):
         )
         self._credentials = None
         self._token = None
+        self._token_expires_at = 0.0
+        self._session = None
+        self._session_loop = None
         self.login = login
 
     def _load_token_cache(self):
@@ -61,7 +78,7 @@ class OneDriveClient(CloudProvider):
             if accounts:
                 result = self.app.acquire_token_silent(self.SCOPES, account=accounts[0])
                 if result:
-                    self._token = result["access_token"]
+                    self._set_token(result)
                     logging.info("Token retrieved from cache")
                     self._save_token_cache()  # Save any cache changes
                     return
@@ -76,7 +93,7 @@ class OneDriveClient(CloudProvider):
             
             if "access_token" in result:
                 logging.info("Access token obtained successfully")
-                self._token = result["access_token"]
+                self._set_token(result)
                 self._save_token_cache()  # Save the token cache
             else:
                 logging.info("Failed to obtain access token")
@@ -86,6 +103,45 @@ class OneDriveClient(CloudProvider):
             logging.error(f"Failed to initialize OneDrive client: {e}")
             raise
 
+    def _set_token(self, result: dict):
+        self._token = result["access_token"]
+        self._token_expires_at = time.time() + int(result.get("expires_in", 3600))
+
+    async def _ensure_token(self):
+        """Reuse the current token until shortly before it expires, then renew it silently."""
+        if self._token and time.time() < self._token_expires_at - self.TOKEN_EXPIRY_MARGIN:
+            return
+        if self._token:
+            await self.refresh_token()
+        else:
+            # may open the browser for an interactive login: no timeout
+            await self._run_blocking(self._initialize_client, timeout=None)
+
+    async def _auth_headers(self, **extra) -> dict:
+        await self._ensure_token()
+        return {"Authorization": f"Bearer {self._token}", **extra}
+
+    @asynccontextmanager
+    async def _session_scope(self):
+        """Yield the client's long-lived HTTP session, creating it on first use.
+
+        The session pools keep-alive connections to Graph and caches DNS, so
+        consecutive calls skip the TCP/TLS handshake. It belongs to the event
+        loop that created it and is replaced if used from another loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._session_loop = loop
+        yield self._session
+
+    async def close(self):
+        """Close the pooled HTTP session."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
     def _clean_path(self, path: str) -> str:
         return path.strip()
 
@@ -94,9 +150,9 @@ class OneDriveClient(CloudProvider):
         try:
             encoded_path = urllib.parse.quote(folder_path)
             url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{encoded_path}:/children"
-            headers = {"Authorization": f"Bearer {self._token}"}
+            headers = await self._auth_headers()
 
-            async with aiohttp.ClientSession() as session:
+            async with self._session_scope() as session:
                 async with session.get(url, headers=headers) as response:
                     if response.status == 200:
                         data = await response.json()
@@ -123,26 +179,17 @@ class OneDriveClient(CloudProvider):
             # Get download URL
             url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}/content"
             logging.info(f">>> Requesting file from URL: {url}")
-            headers = {"Authorization": f"Bearer {self._token}"}
-
-            async with aiohttp.ClientSession() as session:
-                logging.info(">>> Making download request...")
-                async with session.get(url, headers=headers) as response:
-                    if response.status == 200:
-                        logging.info(">>> File content received successfully")
-                        content = await response.read()
-                        logging.info(f">>> Read {len(content)} bytes")
-                        
-                        logging.info(f">>> Writing file to: {destination_path}")
-                        with open(destination_path, 'wb') as f:
-                            f.write(content)
-                        logging.info(f">>> File downloaded successfully to {destination_path}")
-                        return destination_path
-                    else:
-                        error_text = await response.text()
-                        logging.info(f">>> ERROR: Download failed with status {response.status}")
-                        logging.info(f">>> Error details: {error_text}")
-                        raise Exception(f"Download failed: {error_text}")
+            headers = await self._auth_headers()
+
+            logging.info(">>> Making download request...")
+            size = 0
+            with open(destination_path, 'wb') as f:
+                async for chunk in self._stream_item(url, headers):
+                    f.write(chunk)
+                    size += len(chunk)
+            logging.info(f">>> Read {size} bytes")
+            logging.info(f">>> File downloaded successfully to {destination_path}")
+            return destination_path
 
         except Exception as e:
             logging.info(f">>> ERROR: Error downloading file: {e}")
@@ -231,6 +278,8 @@ class OneDriveClient(CloudProvider):
         try:
             # Limpiar la ruta de destino
             destination = self._clean_path(destination)
+            if file_path.stat().st_size > self.SIMPLE_UPLOAD_LIMIT:
+                return await self._upload_large_file(file_path, destination)
             
             logging.info(f"Starting async upload for file: {file_path}")
             logging.info(f"Reading file content...")
@@ -239,31 +288,7 @@ class OneDriveClient(CloudProvider):
             logging.info(f"File content read successfully ({len(file_content)} bytes)")
 
             try:
-                # Construir y codificar la ruta completa para el archivo
-                full_path = f"{destination}/{file_path.name}"
-                encoded_path = urllib.parse.quote(full_path)
-                logging.info(f"Uploading to path: {full_path}")
-                logging.info(f"Encoded path: {encoded_path}")
-
-                # Preparar la URL y headers para la petición
-                url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{encoded_path}:/content"
-                headers = {
-                    "Authorization": f"Bearer {self._token}",
-                    "Content-Type": "application/octet-stream"
-                }
-
-                logging.info(f"Making request to URL: {url}")
-                # Realizar la petición HTTP
-                async with aiohttp.ClientSession() as session:
-                    async with session.put(url, headers=headers, data=file_content) as response:
-                        if response.status == 200 or response.status == 201:
-                            result = await response.json()
-                            logging.info("File content uploaded successfully")
-                            return result.get('id')
-                        else:
-                            error_text = await response.text()
-                            raise Exception(f"Upload failed with status {response.status}: {error_text}")
-
+                return await self._put_content(f"{destination}/{file_path.name}", file_content)
             except Exception as e:
                 logging.info(f"Error during file operations: {e}")
                 logging.error(f"Error during file operations: {e}")
@@ -274,6 +299,200 @@ class OneDriveClient(CloudProvider):
             logging.error(f"Error during async file upload: {e}")
             raise
 
+    async def _put_content(self, full_path: str, content: bytes) -> str:
+        """Simple upload (up to SIMPLE_UPLOAD_LIMIT) of content to full_path; returns the item id."""
+        # Construir y codificar la ruta completa para el archivo
+        encoded_path = urllib.parse.quote(full_path)
+        logging.info(f"Uploading to path: {full_path}")
+        logging.info(f"Encoded path: {encoded_path}")
+
+        # Preparar la URL y headers para la petición
+        url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{encoded_path}:/content"
+        headers = await self._auth_headers(**{"Content-Type": "application/octet-stream"})
+
+        logging.info(f"Making request to URL: {url}")
+        # Realizar la petición HTTP
+        async with self._session_scope() as session:
+            async with session.put(url, headers=headers, data=content) as response:
+                if response.status == 200 or response.status == 201:
+                    result = await response.json()
+                    logging.info("File content uploaded successfully")
+                    return result.get('id')
+                else:
+                    error_text = await response.text()
+                    raise Exception(f"Upload failed with status {response.status}: {error_text}")
+
+    async def upload_bytes(self, data: bytes, file_name: str, destination: str) -> str:
+        """Upload data with a single PUT when it is below the upload session threshold."""
+        if len(data) > self.SIMPLE_UPLOAD_LIMIT:
+            return await super().upload_bytes(data, file_name, destination)
+        try:
+            result = await self._put_content(f"{self._clean_path(destination)}/{file_name}", data)
+            if not result or not isinstance(result, str):
+                raise Exception("No file ID returned from OneDrive")
+            return result
+        except Exception as e:
+            logging.error(f"Failed to upload {file_name} to OneDrive: {e}")
+            raise
+
+    @staticmethod
+    def _session_expired(session_info: dict) -> bool:
+        expires = session_info.get('expires')
+        if not expires:
+            return True
+        return datetime.fromisoformat(expires.replace('Z', '+00:00')) <= datetime.now(timezone.utc)
+
+    def _load_upload_sessions(self) -> dict:
+        """Saved upload sessions, leaving out the ones past their expirationDateTime."""
+        if os.path.exists(self.sessions_path):
+            with open(self.sessions_path, 'r') as f:
+                sessions = json.load(f)
+            return {key: info for key, info in sessions.items() if not self._session_expired(info)}
+        return {}
+
+    def _save_upload_session(self, key: str, session_info: dict | None):
+        """Store (or drop, when session_info is None) the upload session for key; expired ones are pruned."""
+        sessions = self._load_upload_sessions()
+        if session_info is None:
+            sessions.pop(key, None)
+        else:
+            sessions[key] = session_info
+        os.makedirs(self.token_dir, exist_ok=True)
+        temp_path = f"{self.sessions_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(sessions, f)
+        os.replace(temp_path, self.sessions_path)
+
+    @staticmethod
+    def _session_key(file_path: Path, remote_path: str) -> str:
+        """Remote name plus the local file's size and mtime.
+
+        A retry of the same file resumes its session, in this process or after
+        a restart. A backup spooled again (a new archive, or a new encryption
+        with fresh nonces) has a new mtime and starts a new session, so bytes of
+        two different files are never spliced. The server's nextExpectedRanges
+        decides where a resumed upload continues.
+        """
+        stat = file_path.stat()
+        return f"{remote_path}|{stat.st_size}|{stat.st_mtime_ns}"
+
+    @staticmethod
+    def _next_offset(status: dict) -> int | None:
+        ranges = status.get('nextExpectedRanges') or []
+        if not ranges:
+            return None
+        return int(ranges[0].split('-')[0])
+
+    async def _create_upload_session(self, session: aiohttp.ClientSession, remote_path: str) -> dict:
+        encoded_path = urllib.parse.quote(remote_path)
+        url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{encoded_path}:/createUploadSession"
+        headers = await self._auth_headers()
+        body = {"item": {"@microsoft.graph.conflictBehavior": "replace"}}
+        async with session.post(url, headers=headers, json=body) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise Exception(f"Failed to create upload session: {error_text}")
+            result = await response.json()
+            return {'upload_url': result['uploadUrl'], 'expires': result.get('expirationDateTime')}
+
+    async def _resume_offset(self, session: aiohttp.ClientSession, session_info: dict) -> int | None:
+        """Return the first byte the server still expects, or None if the session is gone."""
+        if self._session_expired(session_info):
+            return None
+        # The upload URL is pre-authenticated; Graph rejects an Authorization header on it
+        async with session.get(session_info['upload_url']) as response:
+            if response.status != 200:
+                return None
+            return self._next_offset(await response.json())
+
+    async def _get_item_id(self, session: aiohttp.ClientSession, remote_path: str) -> str:
+        encoded_path = urllib.parse.quote(remote_path)
+        url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{encoded_path}?$select=id"
+        headers = await self._auth_headers()
+        async with session.get(url, headers=headers) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise Exception(f"Uploaded {remote_path} but could not look up its id: {error_text}")
+            return (await response.json())['id']
+
+    async def _upload_large_file(self, file_path: Path, destination: str) -> str:
+        """Upload a file through a Graph upload session, resuming a saved one if possible.
+
+        Graph only accepts fragments in order, so uploads stay sequential; the
+        next fragment is read from disk while the current one is being sent.
+        """
+        remote_path = f"{destination}/{file_path.name}"
+        total = file_path.stat().st_size
+        loop = asyncio.get_running_loop()
+        key = self._session_key(file_path, remote_path)
+
+        async with self._session_scope() as session:
+            session_info = self._load_upload_sessions().get(key)
+            offset = await self._resume_offset(session, session_info) if session_info else None
+            if offset is None:
+                session_info = await self._create_upload_session(session, remote_path)
+                self._save_upload_session(key, session_info)
+                offset = 0
+            else:
+                logging.info(f"Resuming OneDrive upload of {file_path.name} at byte {offset}/{total}")
+
+            def read_fragment(start: int) -> bytes:
+                with open(file_path, 'rb') as f:
+                    f.seek(start)
+                    return f.read(self.FRAGMENT_SIZE)
+
+            pending_read = loop.run_in_executor(None, read_fragment, offset)
+            retries = 0
+            while True:
+                fragment = await pending_read
+                end = offset + len(fragment) - 1
+                if end + 1 < total:
+                    pending_read = loop.run_in_executor(None, read_fragment, end + 1)
+                headers = {
+                    "Content-Length": str(len(fragment)),
+                    "Content-Range": f"bytes {offset}-{end}/{total}"
+                }
+                try:
+                    async with session.put(session_info['upload_url'], headers=headers, data=fragment) as response:
+                        if response.status in (200, 201):
+                            result = await response.json()
+                            self._save_upload_session(key, None)
+                            logging.info(f"Upload session for {file_path.name} completed ({total} bytes)")
+                            return result.get('id')
+                        if response.status != 202:
+                            error_text = await response.text()
+                            raise aiohttp.ClientResponseError(
+                                response.request_info, response.history,
+                                status=response.status, message=error_text
+                            )
+                        next_offset = self._next_offset(await response.json())
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    retries += 1
+                    if retries > self.FRAGMENT_RETRIES or getattr(e, 'status', 500) in (400, 403, 404, 413, 416):
+                        raise Exception(f"Upload session for {file_path.name} failed at byte {offset}: {e}")
+                    logging.warning(f"Fragment at byte {offset} failed ({e}), retry {retries}/{self.FRAGMENT_RETRIES}")
+                    await asyncio.sleep(2 ** retries)
+                    next_offset = await self._resume_offset(session, session_info)
+                    if next_offset is None:
+                        raise Exception(f"Upload session for {file_path.name} expired at byte {offset}")
+                else:
+                    retries = 0
+                    logging.info(f"Uploaded {file_path.name}: {end + 1}/{total} bytes")
+
+                if next_offset is None:
+                    next_offset = end + 1
+                if next_offset >= total:
+                    # every byte is on the server but the last answer was a 202 without the item
+                    self._save_upload_session(key, None)
+                    logging.info(f"Upload session for {file_path.name} completed ({total} bytes)")
+                    return await self._get_item_id(session, remote_path)
+                if next_offset != end + 1:
+                    # the server committed a different range than expected: re-read from there
+                    if not pending_read.done():
+                        await pending_read
+                    pending_read = loop.run_in_executor(None, read_fragment, next_offset)
+                offset = next_offset
+
     async def upload_file(self, file_path: str, destination: str) -> str:
         try:
             file_path = Path(file_path)
@@ -297,25 +516,53 @@ class OneDriveClient(CloudProvider):
             logging.info(f"Downloading OneDrive file ID: {file_id}")
             
             url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}/content"
-            headers = {
-                "Authorization": f"Bearer {self._token}",
-            }
+            headers = await self._auth_headers()
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers) as response:
-                    if response.status == 200:
-                        content = await response.read()
-                        with open(destination, 'wb') as f:
-                            f.write(content)
-                        logging.info(f"Successfully downloaded file to {destination}")
-                        return True
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"Download failed with status {response.status}: {error_text}")
+            with open(destination, 'wb') as f:
+                async for chunk in self._stream_item(url, headers):
+                    f.write(chunk)
+            logging.info(f"Successfully downloaded file to {destination}")
+            return True
         except Exception as e:
             logging.error(f"Failed to download file from OneDrive: {e}")
             raise
 
+    async def _stream_item(self, url: str, headers: dict):
+        """Yield a Graph content response body in STREAM_CHUNK_SIZE pieces."""
+        async with self._session_scope() as session:
+            async with session.get(url, headers=headers) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise Exception(f"Download failed with status {response.status}: {error_text}")
+                async for chunk in response.content.iter_chunked(self.STREAM_CHUNK_SIZE):
+                    yield chunk
+
+    async def download_stream(self, file_id: str):
+        url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}/content"
+        async for chunk in self._stream_item(url, await self._auth_headers()):
+            yield chunk
+
+    async def _open_ranged(self, file_id: str):
+        url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}?select=size,@microsoft.graph.downloadUrl"
+        async with self._session_scope() as session:
+            async with session.get(url, headers=await self._auth_headers()) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise Exception(f"Failed to get item {file_id}: {error_text}")
+                item = await response.json()
+        # Pre-authenticated, short-lived URL that honours Range headers
+        download_url = item['@microsoft.graph.downloadUrl']
+
+        async def fetch(start: int, end: int) -> bytes:
+            async with self._session_scope() as session:
+                async with session.get(download_url, headers={"Range": f"bytes={start}-{end}"}) as response:
+                    if response.status != 206:
+                        error_text = await response.text()
+                        raise Exception(f"Ranged download failed with status {response.status}: {error_text}")
+                    return await response.read()
+
+        return int(item['size']), fetch
+
     def restore_file(self, file_id: str, destination_path: str):
         """Synchronous wrapper for file download."""
         try:
@@ -340,9 +587,9 @@ class OneDriveClient(CloudProvider):
             logging.info("Attempting to refresh token...")
             accounts = self.app.get_accounts()
             if accounts:
-                result = self.app.acquire_token_silent(self.SCOPES, account=accounts[0])
-                if result:
-                    self._token = result["access_token"]
+                result = await self._run_blocking(self.app.acquire_token_silent, self.SCOPES, account=accounts[0])
+                if result and "access_token" in result:
+                    self._set_token(result)
                     self._save_token_cache()
                     logging.info("Token refreshed successfully")
                     return True
@@ -355,14 +602,16 @@ class OneDriveClient(CloudProvider):
         """Perform interactive authentication."""
         try:
             logging.info("Starting interactive authentication...")
-            result = self.app.acquire_token_interactive(
+            result = await self._run_blocking(
+                self.app.acquire_token_interactive,
                 scopes=self.SCOPES,
-                prompt="select_account"
+                prompt="select_account",
+                timeout=None
             )
             
             if "access_token" in result:
                 logging.info("Access token obtained successfully")
-                self._token = result["access_token"]
+                self._set_token(result)
                 self._save_token_cache()
                 return True
             else:
@@ -379,15 +628,15 @@ class OneDriveClient(CloudProvider):
             # First ensure we have a valid token
             if not self._token:
                 logging.info("No token found, initializing client...")
-                self._initialize_client()
+                await self._run_blocking(self._initialize_client, timeout=None)
                 
             if not self._token:
                 raise Exception("Failed to obtain valid token")
 
-            url = "https://graph.microsoft.com/v1.0/me/drive"
-            headers = {"Authorization": f"Bearer {self._token}"}
+            url = "https://graph.microsoft.com/v1.0/me/drive?$select=id,quota"
+            headers = await self._auth_headers()
             
-            async with aiohttp.ClientSession() as session:
+            async with self._session_scope() as session:
                 async with session.get(url, headers=headers) as response:
                     if response.status == 200:
                         logging.info("Connection verified successfully")
@@ -408,9 +657,9 @@ class OneDriveClient(CloudProvider):
     async def delete_file(self, file_id: str):
         try:
             url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}"
-            headers = {"Authorization": f"Bearer {self._token}"}
+            headers = await self._auth_headers()
             
-            async with aiohttp.ClientSession() as session:
+            async with self._session_scope() as session:
                 async with session.delete(url, headers=headers) as response:
                     if response.status in [200, 204]:
                         logging.info(f"Successfully deleted file with ID: {file_id} from OneDrive")
@@ -419,4 +668,34 @@ class OneDriveClient(CloudProvider):
                         raise Exception(f"Failed to delete file: {error_text}")
         except Exception as e:
             logging.error(f"Failed to delete file from OneDrive: {e}")
-            raise 
\ No newline at end of file
+            raise
+
+    async def delete_files(self, file_ids):
+        """Delete many items through Graph JSON batching (20 DELETEs per $batch request)."""
+        deleted = []
+        url = "https://graph.microsoft.com/v1.0/$batch"
+        async with self._session_scope() as session:
+            for i in range(0, len(file_ids), self.BATCH_SIZE):
+                batch = file_ids[i:i + self.BATCH_SIZE]
+                body = {'requests': [
+                    {'id': str(n), 'method': 'DELETE', 'url': f"/me/drive/items/{file_id}"}
+                    for n, file_id in enumerate(batch)
+                ]}
+                try:
+                    headers = await self._auth_headers()
+                    async with session.post(url, headers=headers, json=body) as response:
+                        if response.status != 200:
+                            raise Exception(f"Batch request failed: {await response.text()}")
+                        result = await response.json()
+                except Exception as e:
+                    logging.error(f"Failed to delete files from OneDrive: {e}")
+                    continue
+                for item in result.get('responses', []):
+                    file_id = batch[int(item['id'])]
+                    # 404: already gone
+                    if item.get('status') in [200, 204, 404]:
+                        deleted.append(file_id)
+                    else:
+                        logging.error(f"Failed to delete {file_id} from OneDrive: {item.get('body')}")
+        logging.info(f"Deleted {len(deleted)} of {len(file_ids)} items from OneDrive")
+        return deleted 
\ No newline at end of file
@@ -0,0 +1,97 @@
+import time
+import asyncio
+import logging
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Sentinel: use the executor's default timeout
+DEFAULT = object()
+
+
+class SDKExecutor:
+    """Bounded thread pool for the blocking calls of the provider SDKs (boto3, Azure, Google).
+
+    Keeps them off the event loop that also runs the WebSocket listener and
+    the scheduler, and apart from asyncio's default executor (used for file
+    I/O and the database). Every call gets a timeout. Threads cannot be
+    interrupted, so on a timeout or cancellation the caller gets the
+    exception right away, and the cancel_event passed to run() is set;
+    long transfers check it between chunks (or from SDK progress
+    callbacks) and stop.
+
+    Config (providers in config.json): sdk_workers, sdk_timeout_seconds
+    """
+
+    def __init__(self, max_workers: int = 16, timeout: float | None = 120):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.timeouts = 0
+        self.active = 0
+        self.max_active = 0
+        self.total_seconds = 0.0
+
+    def configure(self, config: dict | None):
+        config = config or {}
+        self.max_workers = max(1, config.get('sdk_workers', self.max_workers))
+        self.timeout = config.get('sdk_timeout_seconds', self.timeout)
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="cloud-sdk")
+            return self._executor
+
+    def _call(self, func, *args, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        start = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.total_seconds += time.monotonic() - start
+
+    async def run(self, func, *args, timeout=DEFAULT, cancel_event: threading.Event | None = None, **kwargs):
+        """Run func(*args, **kwargs) in the pool; timeout=None waits indefinitely."""
+        if timeout is DEFAULT:
+            timeout = self.timeout
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pool(), partial(self._call, func, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            if cancel_event is not None:
+                cancel_event.set()
+            logging.error(f"{getattr(func, '__qualname__', func)} timed out after {timeout}s")
+            raise
+        except asyncio.CancelledError:
+            if cancel_event is not None:
+                cancel_event.set()
+            raise
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.max_workers,
+            'active': self.active,
+            'max_active': self.max_active,
+            'calls': self.calls,
+            'timeouts': self.timeouts,
+            'busy_seconds': round(self.total_seconds, 1),
+        }
+
+
+sdk_executor = SDKExecutor()
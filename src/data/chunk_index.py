@@ -0,0 +1,190 @@
+import json
+import asyncio
+import sqlite3
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+from data.database_handler import DatabaseHandler, AsyncOperations, on_db_thread
+
+
+def init_chunk_index(conn: sqlite3.Connection):
+    """Create the index tables, upgrading an index from before encrypted namespaces."""
+    cursor = conn.cursor()
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(Chunk)')]
+    if columns and 'encrypted' not in columns:
+        # Chunks indexed before namespaces: keep them for find_orphans
+        # (encrypted = -1) but never hand them out for reuse
+        cursor.execute('ALTER TABLE Chunk RENAME TO Chunk_unscoped')
+        cursor.execute('DROP TABLE IF EXISTS FileCache')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Chunk (
+            provider TEXT NOT NULL,
+            encrypted INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            object_id TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            PRIMARY KEY (provider, encrypted, hash)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chunk_hash ON Chunk (provider, hash)')
+    if columns and 'encrypted' not in columns:
+        cursor.execute('''INSERT INTO Chunk (provider, encrypted, hash, object_id, size)
+                          SELECT provider, -1, hash, object_id, size FROM Chunk_unscoped''')
+        cursor.execute('DROP TABLE Chunk_unscoped')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ManifestChunk (
+            provider TEXT NOT NULL,
+            manifest_id TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            PRIMARY KEY (provider, manifest_id, hash)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_manifestchunk_hash ON ManifestChunk (provider, hash)')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS FileCache (
+            path TEXT NOT NULL,
+            encrypted INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            chunks TEXT NOT NULL,
+            PRIMARY KEY (path, encrypted)
+        )
+    ''')
+    conn.commit()
+
+
+class ChunkIndex:
+    """Local index of deduplicated chunks, kept next to backup_tasks.db.
+
+    Chunk records which chunks each provider already holds and under which
+    object id. Encrypted and plaintext chunks live in separate namespaces
+    (the encrypted column), so a backup only reuses chunks stored the way
+    it stores its own. ManifestChunk links every dedup backup (its manifest
+    object) to the chunks it references; a chunk with no remaining
+    references can be deleted from the provider. FileCache remembers the
+    chunk ids of files by path, size, mtime and namespace so unchanged files
+    are not re-read.
+
+    Queries run on the database thread of a DatabaseHandler (WAL, one
+    connection); async code awaits chunk_index.aio.<method>(...). A backup
+    writes the chunks it uploaded, its manifest references and its file
+    cache entries in one transaction (record_backup).
+
+    Until then its uploads live in memory as claims: the first backup to
+    miss a chunk claims it and uploads it, and concurrent backups that need
+    the same chunk wait for that upload instead of storing a second copy.
+    A backup still being created has no ManifestChunk rows yet, so it also
+    pins the chunks it uses; find_orphans never returns a pinned chunk.
+    Chunk lookups and the deletion of orphans both run under release_lock,
+    so a backup cannot pick up a chunk that is being deleted.
+    """
+
+    def __init__(self, db_path="chunk_index.db"):
+        self.db_handler = DatabaseHandler.shared(db_path, schema=init_chunk_index)
+        self.aio = AsyncOperations(self)
+        self.release_lock = asyncio.Lock()
+        self._pinned = Counter()
+        # (provider, encrypted, hash) -> future with the object id of a chunk uploaded but not recorded yet
+        self._claims = {}
+
+    @on_db_thread
+    def get_cached_chunks(self, path: str, size: int, mtime_ns: int, encrypted: bool) -> List[str] | None:
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT chunks FROM FileCache WHERE path = ? AND encrypted = ? AND size = ? AND mtime_ns = ?',
+                           (path, int(encrypted), size, mtime_ns))
+            row = cursor.fetchone()
+            return json.loads(row[0]) if row else None
+
+    @on_db_thread
+    def get_known_chunks(self, provider: str, hashes: Iterable[str], encrypted: bool) -> Dict[str, str]:
+        """Return {hash: object_id} for the hashes this provider already holds in the given namespace."""
+        hashes = list(set(hashes))
+        known = {}
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            # stay well below SQLite's bound-parameter limit
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                cursor.execute(f'''
+                               SELECT hash, object_id FROM Chunk
+                               WHERE provider = ? AND encrypted = ? AND hash IN ({",".join("?" * len(batch))})''',
+                               (provider, int(encrypted), *batch))
+                known.update(cursor.fetchall())
+        return known
+
+    @on_db_thread
+    def record_backup(self, provider: str, encrypted: bool, chunks: Iterable[Tuple[str, str, int]],
+                      manifest_id: str | None = None, hashes: Iterable[str] = (),
+                      cache_entries: Iterable[Tuple[str, int, int, List[str]]] = ()):
+        """Store a backup's uploaded (hash, object_id, size) chunks, manifest references and file cache in one transaction."""
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.executemany('INSERT OR REPLACE INTO Chunk (provider, encrypted, hash, object_id, size) VALUES (?, ?, ?, ?, ?)',
+                               [(provider, int(encrypted), h, object_id, size) for h, object_id, size in chunks])
+            if manifest_id is not None:
+                cursor.executemany('INSERT OR IGNORE INTO ManifestChunk (provider, manifest_id, hash) VALUES (?, ?, ?)',
+                                   [(provider, manifest_id, h) for h in set(hashes)])
+            cursor.executemany('INSERT OR REPLACE INTO FileCache (path, encrypted, size, mtime_ns, chunks) VALUES (?, ?, ?, ?, ?)',
+                               [(path, int(encrypted), size, mtime_ns, json.dumps(file_chunks))
+                                for path, size, mtime_ns, file_chunks in cache_entries])
+            conn.commit()
+
+    def claimed(self, provider: str, chunk_hash: str, encrypted: bool) -> asyncio.Future | None:
+        """The upload another backup claimed for this chunk, if any."""
+        return self._claims.get((provider, int(encrypted), chunk_hash))
+
+    def claim(self, provider: str, chunk_hash: str, encrypted: bool) -> asyncio.Future:
+        """Claim a chunk nobody holds; the caller uploads it and sets the future to its object id (None on failure)."""
+        claim = asyncio.get_running_loop().create_future()
+        self._claims[(provider, int(encrypted), chunk_hash)] = claim
+        return claim
+
+    def settle(self, provider: str, hashes: Iterable[str], encrypted: bool):
+        """Drop claims once their chunks are recorded in the index (or their upload failed)."""
+        for h in hashes:
+            self._claims.pop((provider, int(encrypted), h), None)
+
+    def pin(self, provider: str, hashes: Iterable[str]):
+        for h in hashes:
+            self._pinned[(provider, h)] += 1
+
+    def unpin(self, provider: str, hashes: Iterable[str]):
+        for h in hashes:
+            self._pinned[(provider, h)] -= 1
+            if self._pinned[(provider, h)] <= 0:
+                del self._pinned[(provider, h)]
+
+    async def find_orphans(self, provider: str, manifest_ids: List[str]) -> List[Tuple[str, str]]:
+        """Return (hash, object_id) of the unpinned chunks referenced only by these manifests; the index is not changed."""
+        candidates = await self.aio.orphan_candidates(provider, manifest_ids)
+        return [(h, object_id) for h, object_id in candidates if (provider, h) not in self._pinned]
+
+    @on_db_thread
+    def orphan_candidates(self, provider: str, manifest_ids: List[str]) -> List[Tuple[str, str]]:
+        placeholders = ",".join("?" * len(manifest_ids))
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                           SELECT DISTINCT C.hash, C.object_id
+                           FROM ManifestChunk AS M
+                            JOIN Chunk AS C ON C.provider = M.provider AND C.hash = M.hash
+                            WHERE M.provider = ? AND M.manifest_id IN ({placeholders})
+                            AND NOT EXISTS (
+                                SELECT 1 FROM ManifestChunk AS O
+                                WHERE O.provider = M.provider AND O.hash = M.hash
+                                AND O.manifest_id NOT IN ({placeholders})
+                            )''', (provider, *manifest_ids, *manifest_ids))
+            return cursor.fetchall()
+
+    @on_db_thread
+    def release(self, provider: str, manifest_ids: List[str], chunks: Iterable[Tuple[str, str]]):
+        """Drop deleted manifests' references and the (hash, object_id) chunks deleted from the provider."""
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.executemany('DELETE FROM ManifestChunk WHERE provider = ? AND manifest_id = ?',
+                               [(provider, manifest_id) for manifest_id in manifest_ids])
+            cursor.executemany('DELETE FROM Chunk WHERE provider = ? AND hash = ? AND object_id = ?',
+                               [(provider, h, object_id) for h, object_id in chunks])
+            conn.commit()
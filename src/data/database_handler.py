@@ -1,41 +1,136 @@
+import os
+import asyncio
 import sqlite3
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from utils.file_handler import FileHandler
+from data.migrations import migrate
 import json
 
+
+def on_db_thread(method):
+    """Run a DatabaseOperations method on its handler's database thread."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.db_handler.run(method, self, *args, **kwargs)
+    return wrapper
+
+
+class AsyncOperations:
+    """await <operations>.aio.<method>(...) runs an @on_db_thread method on the database thread."""
+
+    def __init__(self, operations):
+        self._operations = operations
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            # Not a database method (and keeps pickle's lookups from recursing before _operations is set)
+            raise AttributeError(name)
+        method = getattr(self._operations, name)
+
+        async def call(*args, **kwargs):
+            return await self._operations.db_handler.run_async(method, *args, **kwargs)
+        return call
+
+
 class DatabaseHandler:
-    def __init__(self, db_path="backup_tasks.db"):
+    """Owns the one SQLite connection for a database file.
+
+    The connection is opened once, in WAL mode, and is only ever used from a
+    dedicated database thread. Calls from other threads are handed to that
+    thread, and async code awaits run_async() so queries never run on the
+    event loop. Keeping the connection open also keeps sqlite3's prepared
+    statement cache warm. Use shared() so every DatabaseOperations in the
+    process goes through the same connection and thread. schema brings a
+    new or old database file up to date (migrations.migrate by default). A forked child
+    (the background service) opens its own connection on first use; a
+    handler pickled into a spawned child is rebuilt there through shared().
+    """
+
+    PRAGMAS = (
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',   # WAL keeps the database consistent; only the last commits can be lost on power failure
+        'PRAGMA cache_size=-16000',    # 16 MiB
+        'PRAGMA temp_store=MEMORY',
+        'PRAGMA busy_timeout=5000',
+    )
+    STATEMENT_CACHE_SIZE = 256
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, db_path="backup_tasks.db", schema=migrate):
+        self.name = db_path
         self.db_path = FileHandler.get_paht(db_path)
+        self.schema = schema
+        self.conn = None
+        self._pid = None
+        self._executor = None
+        self._thread_id = None
+        self._inherited = []
+        self._lock = threading.Lock()
         self.init_database()
 
+    @classmethod
+    def shared(cls, db_path="backup_tasks.db", schema=migrate):
+        with cls._shared_lock:
+            handler = cls._shared.get(db_path)
+            if handler is None:
+                handler = cls._shared[db_path] = cls(db_path, schema)
+            return handler
+
+    def __reduce__(self):
+        # The connection, its thread and the locks cannot cross processes
+        return DatabaseHandler.shared, (self.name, self.schema)
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, cached_statements=self.STATEMENT_CACHE_SIZE)
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        self.conn = conn
+        self._thread_id = threading.get_ident()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self.conn is not None:
+                # Inherited from the parent process: never use or close it here
+                self._inherited.append(self.conn)
+                self.conn = None
+            self._thread_id = None
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite", initializer=self._open)
+            self._pid = os.getpid()
+
+    def run(self, func, *args, **kwargs):
+        """Run func on the database thread and wait for its result."""
+        self._ensure_thread()
+        if threading.get_ident() == self._thread_id:
+            return func(*args, **kwargs)
+        return self._executor.submit(func, *args, **kwargs).result()
+
+    async def run_async(self, func, *args, **kwargs):
+        """Run func on the database thread without blocking the event loop."""
+        self._ensure_thread()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def close(self):
+        if self._executor is None or self._pid != os.getpid():
+            return
+
+        def close_connection():
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+        self._executor.submit(close_connection).result()
+        self._executor.shutdown()
+        self._pid = None
+
     def init_database(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS BackupTask (
-                    id INTEGER PRIMARY KEY,
-                    source_path TEXT NOT NULL,
-                    encrypt BOOLEAN NOT NULL,
-                    frequency TEXT NOT NULL,
-                    provider TEXT NOT NULL,
-                    backup_limit INTEGER NOT NULL,
-                    agent_id TEXT NOT NULL,
-                    start_date TIMESTAMP NOT NULL,
-                    is_active BOOLEAN NOT NULL,
-                    is_directory BOOLEAN NOT NULL,
-                    last_run TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS BackupHistory (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    task_id INTEGER NOT NULL,
-                    backup_id TEXT NOT NULL,
-                    original_name TEXT NOT NULL,
-                    timestamp TIMESTAMP NOT NULL,
-                    status TEXT NOT NULL,
-                    FOREIGN KEY (task_id) REFERENCES BackupTask(id)
-                )
-            ''')
-            conn.commit()
\ No newline at end of file
+        self.run(self._init_database)
+
+    def _init_database(self):
+        self.schema(self.conn)
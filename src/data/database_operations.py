@@ -1,13 +1,18 @@
-import sqlite3
 from datetime import datetime
-from data.database_handler import DatabaseHandler
+from data.database_handler import DatabaseHandler, AsyncOperations, on_db_thread
+
 
 class DatabaseOperations:
     def __init__(self, db_path="backup_tasks.db"):
-        self.db_handler = DatabaseHandler(db_path)
+        self.db_handler = DatabaseHandler.shared(db_path)
+        self.aio = AsyncOperations(self)
+
+    def close(self):
+        self.db_handler.close()
 
+    @on_db_thread
     def add_backup_task(self, parameters):
-        with sqlite3.connect(self.db_handler.db_path) as conn:
+        with self.db_handler.conn as conn:
             cursor = conn.cursor()
             cursor.execute('''
                            INSERT INTO BackupTask (
@@ -28,8 +33,9 @@ class DatabaseOperations:
                             ))
             conn.commit()
 
+    @on_db_thread
     def fetch_daily_tasks(self, current_date):
-        with sqlite3.connect(self.db_handler.db_path) as conn:
+        with self.db_handler.conn as conn:
             cursor = conn.cursor()
             cursor.execute('''
                            SELECT * FROM BackupTask 
@@ -39,8 +45,23 @@ class DatabaseOperations:
             
             return cursor.fetchall()
         
+    @on_db_thread
+    def fetch_active_tasks(self):
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM BackupTask WHERE is_active = 1')
+            return cursor.fetchall()
+
+    @on_db_thread
+    def get_task(self, task_id):
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM BackupTask WHERE id = ?', (task_id,))
+            return cursor.fetchone()
+
+    @on_db_thread
     def get_backup_history(self, task_id):
-        with sqlite3.connect(self.db_handler.db_path) as conn:
+        with self.db_handler.conn as conn:
             cursor = conn.cursor()
             cursor.execute('''
                            SELECT backup_id FROM BackupHistory 
@@ -50,8 +71,9 @@ class DatabaseOperations:
             
             return cursor.fetchall()
 
+    @on_db_thread
     def update_backup_task(self, task_id, current_date_str, next_run_str):
-        with sqlite3.connect(self.db_handler.db_path) as conn:
+        with self.db_handler.conn as conn:
             cursor = conn.cursor()
             cursor.execute('''
                            UPDATE BackupTask 
@@ -60,40 +82,205 @@ class DatabaseOperations:
             
             conn.commit()
 
-    def record_backup_history(self, task_id, backup_id, original_name, current_date_str):
-        with sqlite3.connect(self.db_handler.db_path) as conn:
+    @on_db_thread
+    def reschedule_task(self, task_id, next_run_str):
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE BackupTask SET start_date = ? WHERE id = ?', (next_run_str, task_id))
+            conn.commit()
+
+    @on_db_thread
+    def deactivate_task(self, task_id):
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE BackupTask SET is_active = 0 WHERE id = ?', (task_id,))
+            conn.commit()
+
+    @on_db_thread
+    def record_backup_history(self, task_id, backup_id, original_name, current_date_str, backup_type='archive'):
+        with self.db_handler.conn as conn:
             cursor = conn.cursor()
             cursor.execute('''
                            INSERT INTO BackupHistory (
-                           task_id, backup_id, original_name, timestamp, status
-                           ) VALUES (?, ?, ?, ?, ?)''', (task_id,backup_id,original_name,current_date_str,'completed'))
+                           task_id, backup_id, original_name, timestamp, status, backup_type
+                           ) VALUES (?, ?, ?, ?, ?, ?)''', (task_id,backup_id,original_name,current_date_str,'completed',backup_type))
             
             conn.commit()
 
+    @on_db_thread
+    def record_backup_run(self, task_id, current_date_str, next_run_str, backup_id, original_name, backup_type='archive'):
+        """update_backup_task and record_backup_history in a single transaction."""
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE BackupTask SET last_run = ?, start_date = ? WHERE id = ?',
+                           (current_date_str, next_run_str, task_id))
+            cursor.execute('''
+                           INSERT INTO BackupHistory (
+                           task_id, backup_id, original_name, timestamp, status, backup_type
+                           ) VALUES (?, ?, ?, ?, ?, ?)''', (task_id, backup_id, original_name, current_date_str, 'completed', backup_type))
+
+    @on_db_thread
     def delete_backup(self, backup_id):
-        with sqlite3.connect(self.db_handler.db_path) as conn:
+        with self.db_handler.conn as conn:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM BackupHistory WHERE backup_id = ?', (backup_id,))
 
             conn.commit()
 
+    @on_db_thread
+    def delete_backups(self, backup_ids, outbox_rows=()):
+        """Delete history rows and queue their (command, payload) outbox messages in one transaction."""
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.executemany('DELETE FROM BackupHistory WHERE backup_id = ?', [(backup_id,) for backup_id in backup_ids])
+            created_at = datetime.now().isoformat()
+            cursor.executemany('INSERT INTO Outbox (command, payload, created_at) VALUES (?, ?, ?)',
+                               [(command, payload, created_at) for command, payload in outbox_rows])
+
+    @on_db_thread
+    def plan_retention(self, task_ids=None, reserve=0):
+        """Backups beyond each task's backup_limit, as (task_id, provider, backup_id, backup_type).
+
+        reserve keeps room for that many upcoming backups (1 right before a
+        run). task_ids limits the plan to those tasks; None plans all of them.
+
+        Chains are kept or deleted whole: every non-incremental backup starts a
+        chain with the increments that follow it, and a chain goes only when
+        none of its backups is among the newest backup_limit - reserve. A
+        full backup is never deleted while a retained increment needs it, so
+        a task may keep up to full_every backups beyond its limit.
+        """
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            task_filter = ''
+            if task_ids is not None:
+                task_ids = list(task_ids)
+                if not task_ids:
+                    return []
+                task_filter = f'WHERE H.task_id IN ({",".join("?" * len(task_ids))})'
+            cursor.execute(f'''
+                           SELECT task_id, provider, backup_id, backup_type FROM (
+                               SELECT *, MIN(position) OVER (PARTITION BY task_id, chain) AS newest_in_chain FROM (
+                                   SELECT H.task_id, T.provider, H.backup_id, H.backup_type, T.backup_limit,
+                                          ROW_NUMBER() OVER (PARTITION BY H.task_id ORDER BY H.timestamp DESC, H.id DESC) AS position,
+                                          SUM(COALESCE(H.backup_type, 'archive') != 'incremental') OVER (
+                                              PARTITION BY H.task_id ORDER BY H.timestamp ASC, H.id ASC
+                                              ROWS UNBOUNDED PRECEDING
+                                          ) AS chain
+                                   FROM BackupHistory AS H
+                                   JOIN BackupTask AS T ON T.id = H.task_id
+                                   {task_filter}
+                               )
+                           )
+                           WHERE newest_in_chain > MAX(backup_limit - ?, 0)
+                           ORDER BY provider, task_id''', (*(task_ids or []), reserve))
+            return cursor.fetchall()
+
+    @on_db_thread
     def delete_task(self, task_id):
-        with sqlite3.connect(self.db_handler.db_path) as conn:
+        with self.db_handler.conn as conn:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM BackupTask WHERE id = ?', (task_id,))
             cursor.execute('DELETE FROM BackupHistory WHERE task_id = ?', (task_id,))
+            cursor.execute('DELETE FROM FileManifest WHERE task_id = ?', (task_id,))
 
             conn.commit()
 
+    @on_db_thread
     def get_backup_info(self, backup_id):
-        with sqlite3.connect(self.db_handler.db_path) as conn:
+        with self.db_handler.conn as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                           SELECT T.source_path, T.is_directory, T.provider, T.encrypt, H.timestamp, H.original_name, H.task_id, H.backup_id
+                           SELECT T.source_path, T.is_directory, T.provider, T.encrypt, H.timestamp, H.original_name, H.task_id, H.backup_id, H.backup_type
                            FROM BackupTask AS T
                             JOIN BackupHistory AS H ON T.id = H.task_id
                             WHERE H.backup_id = ?
                             ORDER BY H.timestamp DESC
                             LIMIT 1''', (backup_id,))
             
-            return cursor.fetchone() 
\ No newline at end of file
+            return cursor.fetchone()
+
+    @on_db_thread
+    def get_file_manifest(self, task_id):
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                           SELECT path, size, mtime_ns, inode, content_hash FROM FileManifest
+                           WHERE task_id = ?''', (task_id,))
+
+            return {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+    @on_db_thread
+    def update_file_manifest(self, task_id, backup_id, current, updated, deleted, replace=False):
+        """Record the file state after a backup.
+
+        current maps every path to (size, mtime_ns, inode, content_hash);
+        only the paths in updated are written unless replace is set, which
+        rewrites the whole manifest (full backups).
+        """
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            if replace:
+                cursor.execute('DELETE FROM FileManifest WHERE task_id = ?', (task_id,))
+                updated = list(current)
+            else:
+                cursor.executemany('DELETE FROM FileManifest WHERE task_id = ? AND path = ?',
+                                   [(task_id, path) for path in deleted])
+            # touched-but-identical files keep the backup_id that holds their content
+            cursor.executemany('''
+                               INSERT INTO FileManifest (task_id, path, size, mtime_ns, inode, content_hash, backup_id)
+                               VALUES (?, ?, ?, ?, ?, ?, ?)
+                               ON CONFLICT (task_id, path) DO UPDATE SET
+                               size = excluded.size, mtime_ns = excluded.mtime_ns, inode = excluded.inode,
+                               backup_id = CASE WHEN FileManifest.content_hash = excluded.content_hash
+                                           THEN FileManifest.backup_id ELSE excluded.backup_id END,
+                               content_hash = excluded.content_hash''',
+                               [(task_id, path, *current[path], backup_id) for path in updated])
+
+            conn.commit()
+
+    @on_db_thread
+    def get_backup_chain(self, task_id, backup_id=None):
+        """Backups needed to rebuild backup_id (or the latest): the last full backup up to it plus its increments."""
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                           SELECT backup_id, backup_type FROM BackupHistory
+                           WHERE task_id = ?
+                           ORDER BY timestamp ASC, id ASC''', (task_id,))
+            history = cursor.fetchall()
+
+        if backup_id is not None:
+            ids = [row[0] for row in history]
+            if backup_id not in ids:
+                return []
+            history = history[:ids.index(backup_id) + 1]
+        for i in range(len(history) - 1, -1, -1):
+            if history[i][1] == 'full':
+                return history[i:]
+            if history[i][1] != 'incremental':
+                break
+        return []
+
+    @on_db_thread
+    def enqueue_outbox(self, command, payloads):
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            created_at = datetime.now().isoformat()
+            cursor.executemany('INSERT INTO Outbox (command, payload, created_at) VALUES (?, ?, ?)',
+                               [(command, payload, created_at) for payload in payloads])
+            conn.commit()
+
+    @on_db_thread
+    def fetch_outbox(self, limit):
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, command, payload FROM Outbox ORDER BY id LIMIT ?', (limit,))
+            return cursor.fetchall()
+
+    @on_db_thread
+    def delete_outbox(self, message_ids):
+        with self.db_handler.conn as conn:
+            cursor = conn.cursor()
+            cursor.executemany('DELETE FROM Outbox WHERE id = ?', [(message_id,) for message_id in message_ids])
+            conn.commit()
@@ -0,0 +1,142 @@
+import logging
+import sqlite3
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def _initial_schema(cursor: sqlite3.Cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS BackupTask (
+            id INTEGER PRIMARY KEY,
+            source_path TEXT NOT NULL,
+            encrypt BOOLEAN NOT NULL,
+            frequency TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            backup_limit INTEGER NOT NULL,
+            agent_id TEXT NOT NULL,
+            start_date TIMESTAMP NOT NULL,
+            is_active BOOLEAN NOT NULL,
+            is_directory BOOLEAN NOT NULL,
+            last_run TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS BackupHistory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INTEGER NOT NULL,
+            backup_id TEXT NOT NULL,
+            original_name TEXT NOT NULL,
+            timestamp TIMESTAMP NOT NULL,
+            status TEXT NOT NULL,
+            FOREIGN KEY (task_id) REFERENCES BackupTask(id)
+        )
+    ''')
+
+
+def _add_backup_type(cursor: sqlite3.Cursor):
+    # Databases created before backup types existed lack the column
+    cursor.execute('PRAGMA table_info(BackupHistory)')
+    if 'backup_type' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE BackupHistory ADD COLUMN backup_type TEXT NOT NULL DEFAULT 'archive'")
+
+
+def _add_file_manifest(cursor: sqlite3.Cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS FileManifest (
+            task_id INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            backup_id TEXT NOT NULL,
+            PRIMARY KEY (task_id, path),
+            FOREIGN KEY (task_id) REFERENCES BackupTask(id)
+        )
+    ''')
+
+
+def _add_outbox(cursor: sqlite3.Cursor):
+    # Messages waiting to be sent to the server (deleted once sent, or on the server's ack)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            command TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    ''')
+
+
+def _add_history_indexes(cursor: sqlite3.Cursor):
+    # get_backup_history / get_backup_chain: task_id filter, timestamp order, answered from the index alone
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_backuphistory_task_timestamp
+        ON BackupHistory (task_id, timestamp, backup_id, backup_type)
+    ''')
+    # get_backup_info / delete_backup
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_backuphistory_backup_id ON BackupHistory (backup_id)')
+    cursor.execute('ANALYZE BackupHistory')
+
+
+def _local_schedule_times(cursor: sqlite3.Cursor):
+    # Older agents stored local times with a 'Z' suffix (strftime('%Y-%m-%dT%H:%M:%SZ')); server dates
+    # are stored with '+00:00', so a 'Z' marks those rows. Rewrite them with the local UTC offset.
+    for column in ('start_date', 'last_run'):
+        cursor.execute(f"SELECT id, {column} FROM BackupTask WHERE {column} LIKE '%Z'")
+        for task_id, value in cursor.fetchall():
+            local = datetime.fromisoformat(value[:-1].split('.')[0]).astimezone()
+            cursor.execute(f'UPDATE BackupTask SET {column} = ? WHERE id = ?',
+                           (local.isoformat(timespec='seconds'), task_id))
+
+
+# Ordered and append-only: never edit or renumber a released migration, add a new one.
+# Each one must also work on databases that predate schema_version (hence IF NOT EXISTS).
+MIGRATIONS = [
+    (1, "initial BackupTask and BackupHistory tables", _initial_schema),
+    (2, "BackupHistory.backup_type", _add_backup_type),
+    (3, "FileManifest table", _add_file_manifest),
+    (4, "Outbox table", _add_outbox),
+    (5, "BackupHistory indexes", _add_history_indexes),
+    (6, "BackupTask times with a 'Z' suffix are local", _local_schedule_times),
+]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Bring the database up to the latest schema; returns the resulting version.
+
+    Each pending migration runs in its own transaction together with its
+    schema_version row, so an interrupted upgrade resumes where it stopped.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL
+        )
+    ''')
+    conn.commit()
+    version = current_version(conn)
+    for number, description, apply in MIGRATIONS:
+        if number <= version:
+            continue
+        try:
+            conn.execute('BEGIN')
+            apply(conn.cursor())
+            conn.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                         (number, description, datetime.now().isoformat()))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Database migration {number} ({description}) failed: {e}")
+            raise
+        logging.info(f"Applied database migration {number}: {description}")
+        version = number
+    return version
@@ -0,0 +1,177 @@
+import os
+import struct
+import zlib
+import logging
+from typing import BinaryIO, Iterator, List, Tuple
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+logger = logging.getLogger(__name__)
+
+# Container layout (all integers big-endian):
+#
+#   header: MAGIC(4) | version(u8) | algorithm(u8) | reserved(u16) | chunk_size(u32) | salt(16)
+#   frame:  length(u32) | flags(u8) | nonce(12) | ciphertext + GCM tag (length bytes)
+#
+# Chunks flagged FLAG_COMPRESSED were zlib-compressed before sealing.
+# Every frame is authenticated with AAD = header | index(u64) | flags, so frames
+# cannot be reordered, moved between files or have their flags altered. The
+# stream ends with an empty frame carrying FLAG_FINAL; a missing final frame
+# means the container was truncated.
+MAGIC = b'BKAC'
+VERSION = 1
+ALGORITHM_AES_256_GCM = 1
+HEADER = struct.Struct('>4sBBHI16s')
+FRAME = struct.Struct('>IB12s')
+INDEX = struct.Struct('>Q')
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+FLAG_FINAL = 0x01
+FLAG_COMPRESSED = 0x02
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class ContainerError(Exception):
+    """Raised when a chunked container is malformed, truncated or fails authentication."""
+
+
+def _derive_key(master_key: bytes, salt: bytes) -> bytes:
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        info=b'bk-agent chunked container v1',
+    ).derive(master_key)
+
+
+class ChunkedEncryptor:
+    """Produces the header and frames of one container.
+
+    seal() is stateless apart from the key, so chunks may be sealed out of
+    order (on other threads, or other processes since the encryptor pickles)
+    as long as the caller assigns the indexes.
+    """
+
+    def __init__(self, master_key: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        salt = os.urandom(16)
+        self.chunk_size = chunk_size
+        self.header = HEADER.pack(MAGIC, VERSION, ALGORITHM_AES_256_GCM, 0, chunk_size, salt)
+        self._key = _derive_key(master_key, salt)
+        self._aead = AESGCM(self._key)
+
+    def __getstate__(self):
+        return {'chunk_size': self.chunk_size, 'header': self.header, 'key': self._key}
+
+    def __setstate__(self, state):
+        self.chunk_size = state['chunk_size']
+        self.header = state['header']
+        self._key = state['key']
+        self._aead = AESGCM(self._key)
+
+    def seal(self, index: int, data: bytes, flags: int = 0) -> bytes:
+        nonce = os.urandom(NONCE_SIZE)
+        aad = self.header + INDEX.pack(index) + bytes([flags])
+        ciphertext = self._aead.encrypt(nonce, data, aad)
+        return FRAME.pack(len(ciphertext), flags, nonce) + ciphertext
+
+    def seal_compressed(self, index: int, data: bytes, level: int = 6) -> bytes:
+        """Compress then seal a chunk; stores it uncompressed if compression does not help."""
+        compressed = zlib.compress(data, level)
+        if len(compressed) < len(data):
+            return self.seal(index, compressed, FLAG_COMPRESSED)
+        return self.seal(index, data)
+
+    def final_frame(self, index: int) -> bytes:
+        return self.seal(index, b'', FLAG_FINAL)
+
+
+class ChunkedDecryptor:
+    """Reads a container from a binary file object."""
+
+    def __init__(self, master_key: bytes, fileobj: BinaryIO):
+        self.fileobj = fileobj
+        self.header = fileobj.read(HEADER.size)
+        if len(self.header) < HEADER.size:
+            raise ContainerError("Container header is truncated")
+        magic, version, algorithm, _, self.chunk_size, salt = HEADER.unpack(self.header)
+        if magic != MAGIC:
+            raise ContainerError("Not a chunked backup container")
+        if version != VERSION or algorithm != ALGORITHM_AES_256_GCM:
+            raise ContainerError(f"Unsupported container version {version}/{algorithm}")
+        self.data_offset = HEADER.size
+        self._aead = AESGCM(_derive_key(master_key, salt))
+
+    def _read_frame(self) -> Tuple[int, bytes, bytes] | None:
+        raw = self.fileobj.read(FRAME.size)
+        if not raw:
+            return None
+        if len(raw) < FRAME.size:
+            raise ContainerError("Frame header is truncated")
+        length, flags, nonce = FRAME.unpack(raw)
+        ciphertext = self.fileobj.read(length)
+        if len(ciphertext) < length:
+            raise ContainerError("Frame body is truncated")
+        return flags, nonce, ciphertext
+
+    def _open(self, index: int, flags: int, nonce: bytes, ciphertext: bytes) -> bytes:
+        aad = self.header + INDEX.pack(index) + bytes([flags])
+        try:
+            plaintext = self._aead.decrypt(nonce, ciphertext, aad)
+        except Exception as e:
+            raise ContainerError(f"Chunk {index} failed authentication") from e
+        if flags & FLAG_COMPRESSED:
+            plaintext = zlib.decompress(plaintext)
+        return plaintext
+
+    def chunks(self) -> Iterator[Tuple[int, bytes]]:
+        """Yield (flags, plaintext) for every data chunk in order, verifying the final frame."""
+        index = 0
+        while True:
+            frame = self._read_frame()
+            if frame is None:
+                raise ContainerError("Container is truncated (no final frame)")
+            flags, nonce, ciphertext = frame
+            plaintext = self._open(index, flags, nonce, ciphertext)
+            if flags & FLAG_FINAL:
+                return
+            yield flags, plaintext
+            index += 1
+
+    def chunk_offsets(self) -> List[int]:
+        """Return the file offset of every data frame by walking frame headers only."""
+        offsets = []
+        offset = self.data_offset
+        while True:
+            self.fileobj.seek(offset)
+            raw = self.fileobj.read(FRAME.size)
+            if len(raw) < FRAME.size:
+                raise ContainerError("Container is truncated (no final frame)")
+            length, flags, _ = FRAME.unpack(raw)
+            if flags & FLAG_FINAL:
+                return offsets
+            offsets.append(offset)
+            offset += FRAME.size + length
+
+    def read_chunk(self, index: int, offsets: List[int] | None = None) -> Tuple[int, bytes]:
+        """Decrypt a single chunk without touching the others."""
+        offsets = offsets if offsets is not None else self.chunk_offsets()
+        if index < 0 or index >= len(offsets):
+            raise IndexError(f"Chunk {index} out of range (container has {len(offsets)} chunks)")
+        self.fileobj.seek(offsets[index])
+        flags, nonce, ciphertext = self._read_frame()
+        return flags, self._open(index, flags, nonce, ciphertext)
+
+
+def is_container(fileobj: BinaryIO) -> bool:
+    """Check the magic bytes without moving the file position."""
+    if hasattr(fileobj, 'peek') and not fileobj.seekable():
+        # buffered streams (e.g. a download being decrypted on the fly)
+        return fileobj.peek(len(MAGIC))[:len(MAGIC)] == MAGIC
+    position = fileobj.tell()
+    magic = fileobj.read(len(MAGIC))
+    fileobj.seek(position)
+    return magic == MAGIC
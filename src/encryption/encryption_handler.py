@@ -1,31 +1,92 @@
 import base64
+import hashlib
+import hmac
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import logging
 
+from encryption.chunked_container import (
+    ChunkedEncryptor, ChunkedDecryptor, ContainerError, is_container, DEFAULT_CHUNK_SIZE
+)
+
 logger = logging.getLogger(__name__)
 
 class EncryptionHandler:
     def __init__(self, key: str):
         """Initialize the encryption handler with a key."""
         # Convert the key to bytes and ensure it's valid for Fernet
-        key_bytes = base64.b64encode(key.encode()[:32].ljust(32, b'\0'))
+        self.master_key = key.encode()[:32].ljust(32, b'\0')
+        key_bytes = base64.b64encode(self.master_key)
         self.fernet = Fernet(key_bytes)
-        
+        self._chunk_id_key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'bk-agent chunk id v1',
+        ).derive(self.master_key)
+
     def encrypt(self, data: bytes) -> bytes:
         """Encrypt the given data."""
         try:
             return self.fernet.encrypt(data)
         except Exception as e:
             logging.error(f"Encryption failed: {e}")
-            
-            
+
+
     def decrypt(self, encrypted_data: bytes) -> bytes:
-        """Decrypt the given data."""
+        """Decrypt the given data (legacy whole-blob Fernet backups)."""
         try:
             return self.fernet.decrypt(encrypted_data)
         except Exception as e:
             logging.error(f"Decryption failed: {e}")
-            
+
+    def chunk_id(self, data: bytes) -> str:
+        """Keyed id (HMAC-SHA256) of a dedup chunk; unlike a plain hash it reveals nothing without the key."""
+        return hmac.new(self._chunk_id_key, data, hashlib.sha256).hexdigest()
+
+    def chunk_encryptor(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> ChunkedEncryptor:
+        """Create an encryptor for a new chunked container."""
+        return ChunkedEncryptor(self.master_key, chunk_size)
+
+    def encrypt_stream(self, src, dst, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+        """Encrypt file object src into dst as a chunked container; returns the chunk count."""
+        encryptor = self.chunk_encryptor(chunk_size)
+        dst.write(encryptor.header)
+        index = 0
+        while True:
+            data = src.read(chunk_size)
+            if not data:
+                break
+            dst.write(encryptor.seal(index, data))
+            index += 1
+        dst.write(encryptor.final_frame(index))
+        return index
+
+    def decrypt_stream(self, src, dst):
+        """Decrypt file object src into dst.
+
+        Chunked containers are decrypted one chunk at a time. Anything else is
+        treated as a legacy backup: a single Fernet token for the whole file.
+        """
+        try:
+            if is_container(src):
+                for _, plaintext in ChunkedDecryptor(self.master_key, src).chunks():
+                    dst.write(plaintext)
+                return
+            dst.write(self.fernet.decrypt(src.read()))
+        except ContainerError as e:
+            logging.error(f"Decryption failed: {e}")
+            raise
+        except Exception as e:
+            logging.error(f"Decryption failed: {e}")
+            raise ContainerError(f"Failed to decrypt backup: {e}") from e
+
+    def decrypt_chunk(self, src, index: int) -> bytes:
+        """Decrypt a single chunk of a chunked container (random access)."""
+        _, plaintext = ChunkedDecryptor(self.master_key, src).read_chunk(index)
+        return plaintext
+
 
 # Make sure to export the class
-__all__ = ['EncryptionHandler'] 
\ No newline at end of file
+__all__ = ['EncryptionHandler']
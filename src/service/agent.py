@@ -6,6 +6,7 @@ import logging
 import platform
 import socket
 import uuid
+from collections import defaultdict
 from typing import Dict, Any, TypedDict, Optional
 import signal
 import sqlite3
@@ -15,13 +16,20 @@ from pathlib import Path
 from backup.backup_manager import BackupManager
 from service.service_handler import ServiceHandler
 from service.connection_manager import ConnectionManager
+from service.command_dispatcher import CommandDispatcher
+from service.outbox import Outbox
 from service.notifier import Notifier
 from service.process_manager import ProcessManager
+from service.task_executor import TaskExecutor
+from service.scheduler import TaskScheduler, parse_schedule_time, format_schedule_time
+from service.schedule_engine import CATCH_UP_POLICIES, compile_schedule, plan_next_run
 #from backup.backup_manifest import DatabaseHandler
 from data.database_handler import DatabaseHandler
 from data.database_operations import DatabaseOperations
 from utils.file_handler import FileHandler
 from utils.logger import setup_logging
+from utils.loop_monitor import LoopLagMonitor
+from cloud.sdk_executor import sdk_executor
 
 class BackupTask(TypedDict):
     id: int
@@ -41,11 +49,39 @@ class Agent:
         self.agent_id = self.load_or_create_agent_id()
         self.backup_manager = backup_manager
         self.connection_manager = ConnectionManager(server_config)
+        self.command_dispatcher = CommandDispatcher(
+            self.handle_command,
+            self.connection_manager.send_response,
+            self.agent_id,
+            limits=server_config.get('command_limits'),
+            default_limit=server_config.get('default_command_limit', 2)
+        )
         self.notifier = Notifier(email_config)
         self.service_handler = service_handler
         self.db_operations = DatabaseOperations()  # Instancia de DatabaseOperations
+        self.outbox = Outbox(
+            self.db_operations,
+            self.connection_manager.send,
+            self.is_connected,
+            self.agent_id,
+            server_config.get('outbox')
+        )
+        self.task_executor = TaskExecutor(backup_manager.backup_config.get('concurrency'))
+        schedule_config = backup_manager.backup_config.get('schedule', {})
+        self.scheduler = TaskScheduler(schedule_config.get('jitter_seconds', 0))
+        self.retry_seconds = schedule_config.get('retry_seconds', 900)
+        self.catch_up = schedule_config.get('catch_up', 'once')
+        if self.catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"Invalid catch_up policy '{self.catch_up}'. Valid policies are: {', '.join(CATCH_UP_POLICIES)}")
+        # A run counts as missed once it is this late (on top of any jitter)
+        self.misfire_grace = timedelta(seconds=schedule_config.get('misfire_grace_seconds', 300) + self.scheduler.jitter_seconds)
+        self._running_tasks = set()
+        self.loop_monitor = LoopLagMonitor()
         setup_logging()
         
+    def is_connected(self) -> bool:
+        return self.connection_manager.is_active
+
     def load_or_create_agent_id(self) -> str:
         """Loads existing GUID or creates a new one"""
         logging.info(f"Loads existing GUID or creates a new one") # Borrar
@@ -77,29 +113,18 @@ class Agent:
         
         # Create task for checking daily backups
         asyncio.create_task(self.check_daily_tasks())
+        outbox_task = asyncio.create_task(self.outbox.run())
+        self.loop_monitor.start()
         
         try:
-            while self.service_handler.is_running:
-                connected = await self.connection_manager.connect_with_retry(
-                    self.agent_id,
-                    providers_status,
-                    self.send_agent_info,
-                    self.handle_command
-                )
-                
-                if not connected:
-                    error_message = f"Failed to connect after {self.connection_manager.MAX_RETRIES} attempts"
-                    try:
-                        self.notifier.send_error_email(self.agent_id, error_message)
-                    except Exception as e:
-                        logging.error(f"Error en el servicio: {e}")
-
-                    self.service_handler.process_manager.kill_process(
-                        pid=self.service_handler.process_manager.pid
-                    )
-                    break
-                
-                await asyncio.sleep(1)  # Pequeña pausa para no consumir CPU
+            # Reconnects forever with backoff; backups keep running while disconnected
+            await self.connection_manager.connect_with_retry(
+                self.agent_id,
+                providers_status,
+                self.send_agent_info,
+                self.receive_message,
+                self.send_connection_alert
+            )
 
         except KeyboardInterrupt:
             print("\nServicio terminado por el usuario")
@@ -109,10 +134,22 @@ class Agent:
             logging.error(f"Error en el servicio: {e}")
         finally:
             logging.warning(f"Start in finally") # Borrar
+            outbox_task.cancel()
+            self.loop_monitor.stop()
+            await self.command_dispatcher.close()
+            await self.backup_manager.close()
+            self.db_operations.close()
             self.service_handler.process_manager.kill_process(
                 pid=self.service_handler.process_manager.pid
             )
 
+    def send_connection_alert(self, error_message: str):
+        """Emails the admin when the control connection has been down for a while"""
+        try:
+            self.notifier.send_error_email(self.agent_id, error_message)
+        except Exception as e:
+            logging.error(f"Error en el servicio: {e}")
+
     async def send_agent_info(self, ws, providers_status: Dict):
         """Sends agent information to the server"""
         available_providers = []
@@ -148,9 +185,18 @@ class Agent:
         )
 
         logging.info("Agent info sent successfully")
+        # Reconectado: enviar lo que quedó pendiente
+        self.outbox.notify()
+
+    async def receive_message(self, command_data: Dict):
+        """Routes a message from the server: outbox acks are handled here, commands go to the dispatcher"""
+        if command_data.get('command') == 'Outbox_Ack':
+            self.outbox.acknowledge(command_data.get('parameters', {}).get('batchId'))
+        else:
+            await self.command_dispatcher.submit(command_data)
 
     async def handle_command(self, command_data: Dict):
-        """Handles commands received through WebSocket"""
+        """Handles commands received through WebSocket (run by the command dispatcher)"""
         try:
             command = command_data.get('command')
             parameters = command_data.get('parameters', {})
@@ -163,19 +209,12 @@ class Agent:
                 await self.handle_delete_task(parameters)
             elif command == "Restore_Backup":
                 await self.handle_restore_backup(parameters)
-            # Handle other commands...
-            
-            # await self.connection_manager.send_response({
-            #     'command': 'success',
-            #     'parameters': command
-            # })
-                
+            else:
+                raise ValueError(f"Unknown command: {command}")
+
         except Exception as e:
             logging.error(f"Error handling command: {e}")
-            # await self.connection_manager.send_response({
-            #     'command': 'error',
-            #     'parameters': {'command': command_data.get('command'), 'message': str(e)}
-            # })
+            raise
 
     async def handle_new_task(self, parameters: Dict):
         try:
@@ -188,6 +227,9 @@ class Agent:
             if parameters.get('LastRun'):
                 last_run = datetime.fromisoformat(parameters['LastRun'].replace('Z', '+00:00'))
 
+            # Reject unknown frequencies and invalid cron expressions up front
+            compile_schedule(parameters['Frequency'])
+
             data = {
                 'id': parameters['BackupTaskId'],
                 'source_path': parameters['SourcePath'].strip(),
@@ -202,119 +244,194 @@ class Agent:
                 'last_run': last_run.isoformat() if last_run else None
             }
             
-            self.db_operations.add_backup_task(data)
-            
-            backup_result = await self._execute_backup_task(data, datetime.now())
-            
-            await self.connection_manager.send_response({
-                'command': 'Backup_History',
-                'parameters': {
-                   'backup_results': [backup_result]
-                },
-                "agentId": self.agent_id
-            })
+            await self.db_operations.aio.add_backup_task(data)
+
+            # First run goes through the executor's limits like any scheduled run;
+            # _task_finished schedules the next one and reports the result
+            task_id = data['id']
+            self._running_tasks.add(task_id)
+            future = self.task_executor.submit(
+                f"task {task_id}",
+                data['provider'],
+                data['source_path'],
+                lambda: self._execute_backup_task(data, datetime.now())
+            )
+            future.add_done_callback(lambda future: self._task_finished(task_id, future))
 
         except Exception as e:
-            await self.connection_manager.send_response({
-                'command': 'Delete_Task',
-                'parameters': {'BackupTaskId':parameters['BackupTaskId']},
-                "agentId": self.agent_id
-            })
+            await self.outbox.put('Delete_Task', {'BackupTaskId':parameters['BackupTaskId']})
             logging.error(f"Error creating new task: {e}")
             raise
 
     async def send_result(self, backup_results):
-        while not self.connection_manager.is_active:
-            await self.connection_manager.send_response({
-                'command': 'Backup_History',
-                'parameters': {
-                    'backup_results': backup_results
-                },
-                "agentId": self.agent_id
-            })
-            await asyncio.sleep(30)
-        return 0
+        """Queues backup results in the outbox; they are sent (batched) once the connection is up"""
+        await self.outbox.put('Backup_History', {'backup_results': backup_results})
+
+    def _task_from_row(self, task) -> BackupTask:
+        return {
+            'id': task[0],
+            'source_path': task[1],
+            'encrypt': task[2],
+            'frequency': task[3],
+            'provider': task[4],
+            'backup_limit': task[5],
+            'agent_id': task[6],
+            'start_date': task[7],
+            'is_active': task[8],
+            'last_run': task[9]
+        }
+
+    async def schedule_task(self, task_id: int):
+        """(Re)load a task from the database into the scheduler, or drop it if inactive/deleted."""
+        task = await self.db_operations.aio.get_task(task_id)
+        if not task or not task[8]:
+            self.scheduler.remove(task_id)
+            return
+        self.scheduler.schedule(task_id, parse_schedule_time(task[7]))
 
     async def check_daily_tasks(self):
+        """Run tasks as they become due, sleeping until the next one in between."""
+        for task in await self.db_operations.aio.fetch_active_tasks():
+            self.scheduler.schedule(task[0], parse_schedule_time(task[7]))
+
         while True:
             try:
-                if not self.connection_manager.is_enable:
-                    return 0
-                
+                due = await self.scheduler.wait_due()
                 current_date = datetime.now()
-                logging.info(current_date)
-                tasks = self.db_operations.fetch_daily_tasks(current_date)
-
-                backup_results = []
-
-                logging.info(f"BackupTask: {tasks}")
-
-                for task in tasks:
-                    task_dict: BackupManager = {
-                        'id': task[0],
-                        'source_path': task[1],
-                        'encrypt': task[2],
-                        'frequency': task[3],
-                        'provider': task[4],
-                        'backup_limit': task[5],
-                        'agent_id': task[6],
-                        'start_date': task[7],
-                        'is_active': task[8],
-                        'last_run': task[9]
-                    }
-                    
-                    backup_history = self.db_operations.get_backup_history(task_dict['id'])                 
-                    
-                    if len(backup_history) >= task_dict['backup_limit']:
-                        # Delete oldest backups to maintain the limit
-                        for backup in backup_history[:len(backup_history) - task_dict['backup_limit'] + 1]:
-                            backup_id = backup[0]
-                            await self.handle_delete_backup({'backupId': backup_id})
-                    
-                    result = await self._execute_backup_task(task_dict, current_date)
-                    if result:
-                        backup_results.append(result)
-                    
-                # Send results through WebSocket if there were any backups
-                if len(backup_results) > 0:
-                    asyncio.create_task(self.send_result(backup_results))
-                
-                # Sleep until next day
-                tomorrow = (current_date + timedelta(days=1)).replace(
-                    hour=0, minute=0, second=0, microsecond=0
-                )
-                sleep_seconds = (tomorrow - current_date).total_seconds()
-                next_check = current_date + timedelta(seconds=sleep_seconds)
-                logging.info(f"Próxima verificación de tareas programada para: {next_check.strftime("%Y-%m-%dT%H:%M:%SZ")}")
-                
-                await asyncio.sleep(sleep_seconds)
-                
+                logging.info(f"Tasks due at {current_date}: {due}")
+
+                runnable = []
+                for task_id in due:
+                    if task_id in self._running_tasks:
+                        continue
+                    task = await self.db_operations.aio.get_task(task_id)
+                    if not task or not task[8]:
+                        continue
+                    task_dict = self._task_from_row(task)
+                    scheduled = parse_schedule_time(task_dict['start_date'])
+                    if self.catch_up == 'skip' and scheduled + self.misfire_grace < current_date:
+                        next_run = plan_next_run(task_dict['frequency'], scheduled, current_date, 'skip')
+                        logging.info(f"Task {task_id} missed its run at {scheduled}, skipping to {next_run}")
+                        await self.db_operations.aio.reschedule_task(task_id, format_schedule_time(next_run))
+                        self.scheduler.schedule(task_id, next_run)
+                        continue
+                    self._running_tasks.add(task_id)
+                    runnable.append(task_dict)
+
+                # Make room for the new backups before starting them
+                if runnable:
+                    try:
+                        await self.apply_retention([task_dict['id'] for task_dict in runnable])
+                    except Exception as e:
+                        logging.error(f"Error applying retention: {e}")
+
+                for task_dict in runnable:
+                    task_id = task_dict['id']
+                    future = self.task_executor.submit(
+                        f"task {task_id}",
+                        task_dict['provider'],
+                        task_dict['source_path'],
+                        lambda task_dict=task_dict: self._execute_backup_task(task_dict, current_date)
+                    )
+                    future.add_done_callback(lambda future, task_id=task_id: self._task_finished(task_id, future))
+
             except Exception as e:
                 logging.error(f"Error checking daily tasks: {e}")
-                await asyncio.sleep(3600)  # Retry in 1 hour if there's an error
+                await asyncio.sleep(60)
+
+    def _task_finished(self, task_id: int, future: asyncio.Future):
+        """Done callback of a task run; the database work happens in _reschedule_task."""
+        self._running_tasks.discard(task_id)
+        result = None if future.cancelled() or future.exception() else future.result()
+        asyncio.create_task(self._reschedule_task(task_id, result))
+
+    async def _reschedule_task(self, task_id: int, result: Dict | None):
+        """Reschedule a task after it ran and report its result."""
+        try:
+            if result:
+                # _execute_backup_task stored the next run as start_date
+                await self.schedule_task(task_id)
+                await self.send_result([result])
+            else:
+                task = await self.db_operations.aio.get_task(task_id)
+                if task and task[8]:
+                    logging.warning(f"Task {task_id} failed, retrying in {self.retry_seconds}s")
+                    self.scheduler.schedule(task_id, datetime.now() + timedelta(seconds=self.retry_seconds))
+        except Exception as e:
+            logging.error(f"Error rescheduling task {task_id}: {e}")
+        logging.info(f"Task executor stats: {self.task_executor.stats()}")
+        logging.info(f"Connection stats: {self.connection_manager.stats()}")
+        logging.info(f"Event loop lag: {self.loop_monitor.stats()}, SDK pool: {sdk_executor.stats()}")
+
+    async def apply_retention(self, task_ids=None, reserve: int = 1):
+        """Delete backups beyond the tasks' backup_limit, keeping room for `reserve` new ones.
+
+        The expired set for all tasks comes from one query; each provider then
+        gets one bulk delete (and one more for orphaned dedup chunks), and the
+        history rows and Delete_Backup messages are committed together.
+        """
+        expired = await self.db_operations.aio.plan_retention(task_ids, reserve)
+        if not expired:
+            return []
+
+        by_provider = defaultdict(list)
+        for task_id, provider, backup_id, backup_type in expired:
+            by_provider[provider].append((backup_id, backup_type))
+        logging.info(f"Retention: {len(expired)} expired backups across {len(by_provider)} providers")
+
+        results = await asyncio.gather(*[
+            self.backup_manager.delete_backups(provider, backups)
+            for provider, backups in by_provider.items()
+        ], return_exceptions=True)
+        deleted = []
+        for provider, result in zip(by_provider, results):
+            if isinstance(result, Exception):
+                logging.error(f"Retention failed for {provider}: {result}")
+            else:
+                deleted.extend(result)
+
+        if deleted:
+            outbox_rows = [
+                ('Delete_Backup', payload)
+                for backup_id in deleted
+                for payload in self.outbox.encode('Delete_Backup', {'BackupId': backup_id})
+            ]
+            await self.db_operations.aio.delete_backups(deleted, outbox_rows)
+            self.outbox.notify()
+        return deleted
 
     async def _execute_backup_task(self, task_dict: BackupTask, current_date: datetime) -> Dict | None:
         """Execute a single backup task and return the result"""
         try:
-            
+            # Plan the next run first: an invalid frequency must not leave an unrecorded upload behind
+            start_date = parse_schedule_time(task_dict['start_date'])
+            try:
+                next_run = plan_next_run(task_dict['frequency'], start_date, current_date, self.catch_up)
+            except ValueError as e:
+                logging.error(f"Task {task_dict['id']} has an invalid frequency, disabling it: {e}")
+                await self.db_operations.aio.deactivate_task(task_dict['id'])
+                self.scheduler.remove(task_dict['id'])
+                return None
+
             await self.backup_manager.set_cloud_provider(task_dict['provider'])
+            backup_type = await self.backup_manager.resolve_backup_type(
+                task_dict['id'],
+                Path(task_dict['source_path']).is_dir()
+            )
             backup_id = await self.backup_manager.create_backup(
                 task_dict['source_path'],
-                encrypt=task_dict['encrypt']
+                encrypt=task_dict['encrypt'],
+                backup_type=backup_type,
+                task_id=task_dict['id']
             )
+
+            current_date_str = format_schedule_time(current_date)
+            next_run_str = format_schedule_time(next_run)
             
-            try:
-                start_date = datetime.fromisoformat(task_dict['start_date'])
-            except ValueError:
-                cleaned_date = task_dict['start_date'].split('.')[0]
-                start_date = datetime.fromisoformat(cleaned_date)
-                
-            next_run = self.calculate_next_run(task_dict['frequency'], start_date)
-            current_date_str = current_date.strftime("%Y-%m-%dT%H:%M:%SZ")
-            next_run_str = next_run.strftime("%Y-%m-%dT%H:%M:%SZ")
-            
-            self.db_operations.update_backup_task(task_dict['id'], current_date_str, next_run_str)
-            self.db_operations.record_backup_history(task_dict['id'], backup_id, Path(task_dict['source_path']).name, current_date_str)
+            await self.db_operations.aio.record_backup_run(
+                task_dict['id'], current_date_str, next_run_str,
+                backup_id, Path(task_dict['source_path']).name, backup_type
+            )
             
             return {
                 'task_id': task_dict['id'],
@@ -328,71 +445,38 @@ class Agent:
             logging.error(f"Error executing backup task {task_dict['id']}: {e}")
             return None
 
-    def calculate_next_run(self, frequency: str, current_date: datetime) -> datetime:
-        if frequency == 'daily':
-            return current_date + timedelta(days=1)
-        elif frequency == 'weekly':
-            return current_date + timedelta(weeks=1)
-        elif frequency == 'monthly':
-            if current_date.month == 12:
-                year = current_date.year + 1
-                month = 1
-            else:
-                year = current_date.year
-                month = current_date.month + 1
-                
-            try:
-                return current_date.replace(year=year, month=month)
-            except ValueError:
-                if month == 12:
-                    next_month = datetime(year + 1, 1, 1)
-                else:
-                    next_month = datetime(year, month + 1, 1)
-                return next_month - timedelta(days=1)
-                
-        elif frequency == 'yearly':
-            return current_date.replace(year=current_date.year + 1)
-        return current_date
-
     async def handle_delete_backup(self, parameters: Dict):
         try:
-            backup_info = self.db_operations.get_backup_info(parameters['backupId'])
+            backup_info = await self.db_operations.aio.get_backup_info(parameters['backupId'])
             
             if backup_info:
 
-                await self.backup_manager.delete_backup(parameters['backupId'], backup_info[2])
-                self.db_operations.delete_backup(parameters['backupId'])
+                await self.backup_manager.delete_backup(parameters['backupId'], backup_info[2], backup_info[8])
+                await self.db_operations.aio.delete_backup(parameters['backupId'])
                 
                 logging.info(f"Backup {parameters['backupId']} deleted successfully")
             else: 
                 logging.error(f"Backup {parameters['backupId']} no found")
             
-            await self.connection_manager.send_response({
-                'command': 'Delete_Backup',
-                'parameters': {'BackupId': parameters['backupId']},
-                "agentId": self.agent_id
-            })
+            await self.outbox.put('Delete_Backup', {'BackupId': parameters['backupId']})
         except Exception as e:
             logging.error(f"Error deleting backup: {e}")
             raise
 
     async def handle_delete_task(self, parameters: Dict):
         try:
-            backups = self.db_operations.get_backup_history(parameters['backupTaskId'])
+            backups = await self.db_operations.aio.get_backup_history(parameters['backupTaskId'])
             
             logging.info(f"delete_backup {backups}")
             if backups:
                 for backup in backups:
                     await self.handle_delete_backup({'backupId': backup[0]})
             
-            self.db_operations.delete_task(parameters['backupTaskId'])
+            await self.db_operations.aio.delete_task(parameters['backupTaskId'])
+            self.scheduler.remove(parameters['backupTaskId'])
             logging.info(f"Task {parameters['backupTaskId']} and its backups deleted successfully")
 
-            await self.connection_manager.send_response({
-                'command': 'Delete_Task',
-                'parameters': {'BackupTaskId': parameters['backupTaskId']},
-                "agentId": self.agent_id
-            })
+            await self.outbox.put('Delete_Task', {'BackupTaskId': parameters['backupTaskId']})
 
         except Exception as e:
             logging.error(f"Error deleting task: {e}")
@@ -400,7 +484,7 @@ class Agent:
 
     async def handle_restore_backup(self, parameters: Dict):
         try:
-            backup_info = self.db_operations.get_backup_info(parameters['backupId'])
+            backup_info = await self.db_operations.aio.get_backup_info(parameters['backupId'])
             logging.info(f"backup_info: {backup_info}")
             await self.backup_manager.restore_backup({
                 'source_path': backup_info[0],
@@ -410,13 +494,11 @@ class Agent:
                 'timestamp': backup_info[4],
                 'original_name': backup_info[5],
                 'backup_id': parameters['backupId'],
+                'task_id': backup_info[6],
+                'backup_type': backup_info[8],
                 })
             
-            await self.connection_manager.send_response({
-                'command': 'Restore_Backup',
-                'parameters': {'BackupId': parameters['backupId']},
-                "agentId": self.agent_id
-            })
+            await self.outbox.put('Restore_Backup', {'BackupId': parameters['backupId']})
             logging.info(f"Backup {parameters['backupId']} restored successfully to {backup_info[0]}")
             
         except Exception as e:
@@ -0,0 +1,111 @@
+import uuid
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class CommandDispatcher:
+    """Runs WebSocket commands off the listener so it can keep reading the socket.
+
+    submit() only queues the command and acknowledges it, so it returns at
+    once. Each command type has its own queue of at most queue_size commands
+    and a consumer that takes a slot of the type's semaphore before dequeuing
+    the next one, so at most limit commands of a type run at once (e.g. one
+    restore, several deletes). A type whose queue is full rejects new
+    commands without holding up the others. When a command finishes, success
+    or failure is reported back to the server with the same command id as
+    the acknowledgement.
+    """
+
+    DEFAULT_LIMITS = {
+        "New_Task": 2,
+        "Restore_Backup": 1,
+        "Delete_Backup": 4,
+        "Delete_Task": 1,
+    }
+
+    def __init__(self, handler: Callable[[Dict], Awaitable[Any]], send: Callable[[Dict], Awaitable[None]],
+                 agent_id: str, limits: Dict[str, int] | None = None, default_limit: int = 2, queue_size: int = 100):
+        self.handler = handler
+        self.send = send
+        self.agent_id = agent_id
+        self.limits = {**self.DEFAULT_LIMITS, **(limits or {})}
+        self.default_limit = default_limit
+        self.queue_size = queue_size
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._consumers: Dict[str, asyncio.Task] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._tasks = set()
+
+    def _semaphore(self, command: str) -> asyncio.Semaphore:
+        if command not in self._semaphores:
+            self._semaphores[command] = asyncio.Semaphore(max(1, self.limits.get(command, self.default_limit)))
+        return self._semaphores[command]
+
+    def _queue(self, command: str) -> asyncio.Queue:
+        """The command type's queue, (re)starting its consumer if needed."""
+        if command not in self._queues:
+            self._queues[command] = asyncio.Queue(maxsize=self.queue_size)
+        consumer = self._consumers.get(command)
+        if consumer is None or consumer.done():
+            self._consumers[command] = asyncio.create_task(self._consume(command))
+        return self._queues[command]
+
+    async def _report(self, command: str, command_id: str, status: str, message: str | None = None):
+        parameters = {'command': command, 'commandId': command_id, 'status': status}
+        if message:
+            parameters['message'] = message
+        await self.send({'command': 'Command_Status', 'parameters': parameters, "agentId": self.agent_id})
+
+    async def submit(self, command_data: Dict):
+        """Queue a command and acknowledge it without waiting for it to run."""
+        command = command_data.get('command')
+        command_id = command_data.get('commandId') or str(uuid.uuid4())
+        queue = self._queue(command)
+        try:
+            queue.put_nowait((command_id, command_data))
+        except asyncio.QueueFull:
+            logging.error(f"Command queue for {command} full, rejecting {command_id}")
+            await self._report(command, command_id, 'rejected', 'Agent command queue is full')
+            return
+        logging.info(f"Queued command {command} ({command_id}); queue depth {queue.qsize()}")
+        await self._report(command, command_id, 'accepted')
+
+    async def _consume(self, command: str):
+        queue = self._queues[command]
+        semaphore = self._semaphore(command)
+        while True:
+            # Wait for a free slot first, so commands beyond the limit stay in the bounded queue
+            await semaphore.acquire()
+            try:
+                command_id, command_data = await queue.get()
+            except BaseException:
+                semaphore.release()
+                raise
+            task = asyncio.create_task(self._run(command, command_id, command_data))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            # Released even if the task is cancelled before it starts
+            task.add_done_callback(lambda task: semaphore.release())
+            queue.task_done()
+
+    async def _run(self, command: str, command_id: str, command_data: Dict):
+        logging.info(f"Running command {command} ({command_id})")
+        try:
+            await self.handler(command_data)
+        except Exception as e:
+            logging.error(f"Command {command} ({command_id}) failed: {e}")
+            await self._report(command, command_id, 'failed', str(e))
+            return
+        logging.info(f"Command {command} ({command_id}) completed")
+        await self._report(command, command_id, 'completed')
+
+    async def close(self):
+        """Cancel the consumers and any command still running."""
+        tasks = list(self._tasks) + list(self._consumers.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._consumers.clear()
@@ -1,3 +1,5 @@
+import time
+import random
 import logging
 import asyncio
 import websockets
@@ -10,36 +12,107 @@ logger = logging.getLogger(__name__)
 
 
 class ConnectionManager:
+    """WebSocket control connection to the server.
+
+    connect_with_retry() reconnects forever with exponential backoff and
+    full jitter (a random delay between 0 and min(max_delay, base * 2^n)),
+    so a fleet of agents does not reconnect in lockstep after a server
+    restart. The backoff resets once a connection has stayed up for
+    stable_seconds. Nothing else in the agent depends on the connection;
+    the scheduler and the task executor keep running while it is down.
+
+    Config (server.reconnect in config.json):
+        base_delay_seconds, max_delay_seconds, stable_seconds,
+        alert_after_attempts (failed attempts before the alert callback runs, once per outage)
+    """
+
     def __init__(self, config: Dict[str, Any]):
         self.config = config
-        self.MAX_RETRIES = 10
-        self.RETRY_DELAY = 30
+        reconnect_config = config.get('reconnect', {})
+        self.base_delay = reconnect_config.get('base_delay_seconds', 1)
+        self.max_delay = reconnect_config.get('max_delay_seconds', 300)
+        self.stable_seconds = reconnect_config.get('stable_seconds', 60)
+        self.alert_after_attempts = reconnect_config.get('alert_after_attempts', 10)
         self.connection_attempts = 0
         self.ws = None
         self.is_active = False
         self.is_enable = True
+        # Counters (see stats())
+        self.connected_at = None
+        self.disconnected_at = time.monotonic()
+        self.total_uptime = 0.0
+        self.connections = 0
+        self.last_reconnect_latency = None
+        self.max_reconnect_latency = 0.0
+        self.total_reconnect_latency = 0.0
         setup_logging()
 
-    async def connect_with_retry(self, agent_id: str, providers_status: Dict, agent_info_callback, command_handler):
-        """Attempts to connect to WebSocket with retry logic"""
-        while self.connection_attempts < self.MAX_RETRIES:
+    def backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given (1-based) failed attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _mark_connected(self):
+        now = time.monotonic()
+        latency = now - self.disconnected_at
+        self.connections += 1
+        self.last_reconnect_latency = latency
+        self.max_reconnect_latency = max(self.max_reconnect_latency, latency)
+        self.total_reconnect_latency += latency
+        self.connected_at = now
+        self.is_active = True
+
+    def _mark_disconnected(self):
+        self.is_active = False
+        if self.connected_at is not None:
+            now = time.monotonic()
+            self.total_uptime += now - self.connected_at
+            self.disconnected_at = now
+            self.connected_at = None
+
+    def stats(self) -> dict:
+        """Connection uptime and reconnect latency counters."""
+        uptime = self.total_uptime
+        if self.connected_at is not None:
+            uptime += time.monotonic() - self.connected_at
+        return {
+            'connected': self.is_active,
+            'connections': self.connections,
+            'uptime_seconds': round(uptime, 1),
+            'current_session_seconds': round(time.monotonic() - self.connected_at, 1) if self.connected_at is not None else 0.0,
+            'failed_attempts': self.connection_attempts,
+            'last_reconnect_latency_seconds': round(self.last_reconnect_latency, 1) if self.last_reconnect_latency is not None else None,
+            'avg_reconnect_latency_seconds': round(self.total_reconnect_latency / self.connections, 1) if self.connections else None,
+            'max_reconnect_latency_seconds': round(self.max_reconnect_latency, 1),
+        }
+
+    async def connect_with_retry(self, agent_id: str, providers_status: Dict, agent_info_callback, command_handler, alert_callback=None):
+        """Keeps the WebSocket connected until is_enable is cleared, reconnecting with backoff"""
+        while self.is_enable:
             try:
-                self.connection_attempts += 1
-                logger.info(f"Connection attempt {self.connection_attempts} of {self.MAX_RETRIES}")
-                
+                logger.info(f"Connection attempt {self.connection_attempts + 1}")
                 await self.connect_websocket(agent_id, providers_status, agent_info_callback, command_handler)
-                self.connection_attempts = 0  # Reset counter on successful connection
-                return True
-                
             except Exception as e:
-                logger.error(f"Connection attempt {self.connection_attempts} failed: {e}")
-                self.is_active = False
-                if self.connection_attempts >= self.MAX_RETRIES:
-                    self.is_enable = False
-                    return False
-                
-                logger.info(f"Waiting {self.RETRY_DELAY} seconds before next attempt...")
-                await asyncio.sleep(self.RETRY_DELAY)
+                logger.error(f"Connection attempt {self.connection_attempts + 1} failed: {e}")
+            finally:
+                was_connected = self.connected_at is not None
+                session = time.monotonic() - self.connected_at if was_connected else 0.0
+                self._mark_disconnected()
+                if was_connected:
+                    logger.info(f"WebSocket connection ended: {self.stats()}")
+
+            if session >= self.stable_seconds:
+                self.connection_attempts = 0
+            self.connection_attempts += 1
+            if self.connection_attempts == self.alert_after_attempts and alert_callback:
+                try:
+                    alert_callback(f"Failed to connect after {self.connection_attempts} attempts; still retrying")
+                except Exception as e:
+                    logger.error(f"Error sending connection alert: {e}")
+
+            delay = self.backoff_delay(self.connection_attempts)
+            logger.info(f"Waiting {delay:.1f} seconds before next attempt...")
+            await asyncio.sleep(delay)
+        return False
 
     async def connect_websocket(self, agent_id: str, providers_status: Dict, agent_info_callback, command_handler):
         """Establishes WebSocket connection with the server"""
@@ -52,8 +125,8 @@ class ConnectionManager:
 
         try:
             self.ws = await websockets.connect(ws_url, ssl=ssl_context)
-            self.is_active = True
-            logger.info("WebSocket connection established successfully")
+            self._mark_connected()
+            logger.info(f"WebSocket connection established successfully after {self.last_reconnect_latency:.1f}s")
             
             await agent_info_callback(self.ws, providers_status)
             await self.listen_for_commands(command_handler)
@@ -64,7 +137,11 @@ class ConnectionManager:
             raise
 
     async def listen_for_commands(self, command_handler):
-        """Listens for incoming WebSocket commands"""
+        """Listens for incoming WebSocket commands.
+
+        command_handler must return quickly (the agent passes the command
+        dispatcher's submit) so the socket keeps being read while commands run.
+        """
         try:
             logger.info("Starting command listener...")
             async for message in self.ws:
@@ -87,6 +164,12 @@ class ConnectionManager:
             logger.error(f"Error in command listener: {e}")
             raise
 
+    async def send(self, data: Dict):
+        """Sends a message, raising if the socket is down (for callers that retry)"""
+        if self.ws is None or not self.is_active:
+            raise ConnectionError("WebSocket is not connected")
+        await self.ws.send(json.dumps(data))
+
     async def send_response(self, response_data: Dict):
         """Sends a response through the WebSocket"""
         try:
@@ -0,0 +1,150 @@
+import json
+import uuid
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List
+
+from data.database_operations import DatabaseOperations
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """Durable queue of messages for the server, stored in the Outbox table.
+
+    put() writes the message to SQLite before anything is sent, so results
+    survive a dropped connection or a restart. A single flusher sends
+    everything pending as soon as the connection is up: messages of a
+    batchable command (e.g. Backup_History) are coalesced into frames of up
+    to max_batch_items / max_batch_bytes, each carrying a batchId. By default
+    rows are deleted as soon as the frame is written. With require_ack true
+    (only for servers that answer with
+    {"command": "Outbox_Ack", "parameters": {"batchId": ...}}) they are
+    deleted on the ack instead, and a batch that is not acknowledged within
+    ack_timeout_seconds is sent again later.
+
+    Config (server.outbox in config.json):
+        max_batch_items, max_batch_bytes, ack_timeout_seconds,
+        retry_seconds, require_ack
+    """
+
+    # Commands whose payloads are lists that can be merged into one frame
+    BATCH_KEYS = {
+        'Backup_History': 'backup_results',
+    }
+    FETCH_LIMIT = 5000
+
+    def __init__(self, db_operations: DatabaseOperations, send: Callable[[Dict], Awaitable[None]],
+                 is_connected: Callable[[], bool], agent_id: str, config: dict | None = None):
+        config = config or {}
+        self.db_operations = db_operations
+        self.send = send
+        self.is_connected = is_connected
+        self.agent_id = agent_id
+        self.max_batch_items = max(1, config.get('max_batch_items', 500))
+        self.max_batch_bytes = max(1024, config.get('max_batch_bytes', 512 * 1024))
+        self.ack_timeout = config.get('ack_timeout_seconds', 30)
+        self.retry_seconds = config.get('retry_seconds', 30)
+        self.require_ack = config.get('require_ack', False)
+        self._wakeup = asyncio.Event()
+        self._acks: Dict[str, asyncio.Future] = {}
+
+    def encode(self, command: str, parameters: Dict) -> List[str]:
+        """Outbox rows for a message: one per item for batchable commands, else one."""
+        key = self.BATCH_KEYS.get(command)
+        if key:
+            return [json.dumps(item) for item in parameters.get(key, [])]
+        return [json.dumps(parameters)]
+
+    async def put(self, command: str, parameters: Dict):
+        """Store a message durably and wake the flusher."""
+        payloads = self.encode(command, parameters)
+        if payloads:
+            await self.db_operations.aio.enqueue_outbox(command, payloads)
+            self.notify()
+
+    def notify(self):
+        """Wake the flusher (new message, or the connection came up)."""
+        self._wakeup.set()
+
+    def acknowledge(self, batch_id: str):
+        future = self._acks.get(batch_id)
+        if future is None:
+            logging.warning(f"Ack for unknown outbox batch {batch_id}")
+        elif not future.done():
+            future.set_result(True)
+
+    def _build_batches(self, rows) -> List[tuple]:
+        """Group pending rows into (ids, frame) pairs, coalescing batchable commands."""
+        batches = []
+        open_batches = {}
+        for message_id, command, payload in rows:
+            key = self.BATCH_KEYS.get(command)
+            if not key:
+                batches.append(([message_id], command, json.loads(payload)))
+                continue
+            current = open_batches.get(command)
+            if (current is None or len(current[0]) >= self.max_batch_items
+                    or current[2] + len(payload) > self.max_batch_bytes):
+                current = ([], [], 0)
+                batches.append((current[0], command, current[1]))
+            current[0].append(message_id)
+            current[1].append(json.loads(payload))
+            open_batches[command] = (current[0], current[1], current[2] + len(payload))
+
+        frames = []
+        for ids, command, body in batches:
+            key = self.BATCH_KEYS.get(command)
+            frames.append((ids, {
+                'command': command,
+                'parameters': {key: body} if key else body,
+                'batchId': str(uuid.uuid4()),
+                "agentId": self.agent_id
+            }))
+        return frames
+
+    async def _send_batch(self, ids: List[int], frame: Dict) -> bool:
+        batch_id = frame['batchId']
+        future = asyncio.get_running_loop().create_future()
+        self._acks[batch_id] = future
+        try:
+            await self.send(frame)
+            if self.require_ack:
+                await asyncio.wait_for(future, self.ack_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Outbox batch {batch_id} ({len(ids)} messages) not acknowledged, will resend")
+            return False
+        except Exception as e:
+            logging.error(f"Error sending outbox batch {batch_id}: {e}")
+            return False
+        finally:
+            self._acks.pop(batch_id, None)
+        await self.db_operations.aio.delete_outbox(ids)
+        logging.info(f"Outbox batch {batch_id} delivered: {len(ids)} {frame['command']} messages")
+        return True
+
+    async def flush(self) -> bool:
+        """Send everything pending; returns False if a batch could not be delivered."""
+        while self.is_connected():
+            rows = await self.db_operations.aio.fetch_outbox(self.FETCH_LIMIT)
+            if not rows:
+                return True
+            for ids, frame in self._build_batches(rows):
+                if not await self._send_batch(ids, frame):
+                    return False
+        return False
+
+    async def run(self):
+        """Flush whenever something is queued or the connection comes back."""
+        while True:
+            self._wakeup.clear()
+            delivered = False
+            try:
+                delivered = await self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing outbox: {e}")
+            try:
+                # After a failure retry on a timer as well, in case no new event arrives
+                await asyncio.wait_for(self._wakeup.wait(), None if delivered else self.retry_seconds)
+            except asyncio.TimeoutError:
+                pass
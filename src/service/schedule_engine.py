@@ -0,0 +1,219 @@
+from abc import ABC, abstractmethod
+import re
+import calendar
+import logging
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+CATCH_UP_POLICIES = ["skip", "once", "all"]
+
+
+class Schedule(ABC):
+    """A compiled task frequency.
+
+    next_after(anchor, after) returns the first run strictly after `after` in
+    the series that includes `anchor` (the task's previous or planned run).
+    Every implementation jumps there directly instead of stepping through
+    each missed period.
+    """
+
+    @abstractmethod
+    def next_after(self, anchor: datetime, after: datetime) -> datetime:
+        pass
+
+
+class IntervalSchedule(Schedule):
+    """Fixed period: every N minutes/hours, daily, weekly."""
+
+    def __init__(self, period: timedelta):
+        if period <= timedelta(0):
+            raise ValueError("Schedule interval must be positive")
+        self.period = period
+
+    def next_after(self, anchor: datetime, after: datetime) -> datetime:
+        if anchor > after:
+            return anchor
+        return anchor + ((after - anchor) // self.period + 1) * self.period
+
+
+class MonthlySchedule(Schedule):
+    """Every N calendar months on the anchor's day, clamped to the month's last day."""
+
+    def __init__(self, months: int):
+        self.months = months
+
+    @staticmethod
+    def _add_months(anchor: datetime, months: int) -> datetime:
+        total = anchor.month - 1 + months
+        year, month = anchor.year + total // 12, total % 12 + 1
+        day = min(anchor.day, calendar.monthrange(year, month)[1])
+        return anchor.replace(year=year, month=month, day=day)
+
+    def next_after(self, anchor: datetime, after: datetime) -> datetime:
+        if anchor > after:
+            return anchor
+        elapsed = (after.year - anchor.year) * 12 + after.month - anchor.month
+        steps = max(1, elapsed // self.months)
+        candidate = self._add_months(anchor, steps * self.months)
+        while candidate <= after:
+            steps += 1
+            candidate = self._add_months(anchor, steps * self.months)
+        return candidate
+
+
+class CronSchedule(Schedule):
+    """Standard 5-field cron expression: minute hour day-of-month month day-of-week.
+
+    Supports *, lists, ranges, steps, month/day names and the @hourly,
+    @daily, @weekly, @monthly and @yearly macros. As in Vixie cron, when both
+    day fields are restricted a day matches if either of them does. Each
+    field is expanded once into a sorted list, so finding the next run is a
+    few bisects per month/day/hour it has to skip.
+    """
+
+    MACROS = {
+        '@yearly': '0 0 1 1 *',
+        '@annually': '0 0 1 1 *',
+        '@monthly': '0 0 1 * *',
+        '@weekly': '0 0 * * 0',
+        '@daily': '0 0 * * *',
+        '@midnight': '0 0 * * *',
+        '@hourly': '0 * * * *',
+    }
+    NAMES = {
+        'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+        'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+        'sun': 0, 'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4, 'fri': 5, 'sat': 6,
+    }
+    # A valid expression matches within this many years (e.g. Feb 29 needs up to 8)
+    SEARCH_YEARS = 9
+
+    def __init__(self, expression: str):
+        self.expression = expression.strip()
+        fields = self.MACROS.get(self.expression, self.expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: '{expression}'")
+        self.minutes = self._parse(fields[0], 0, 59)
+        self.hours = self._parse(fields[1], 0, 23)
+        self.days = self._parse(fields[2], 1, 31)
+        self.months = self._parse(fields[3], 1, 12)
+        # cron allows 7 for Sunday; Python's weekday() is Monday=0, cron's is Sunday=0
+        self.weekdays = sorted({d % 7 for d in self._parse(fields[4], 0, 7)})
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+        self._day_set = set(self.days)
+        self._weekday_set = set(self.weekdays)
+        # Catch expressions like '0 0 31 2 *' at compile time rather than on the first run
+        longest_month = max(29 if month == 2 else calendar.monthrange(2001, month)[1] for month in self.months)
+        if self.any_weekday and self.days[0] > longest_month:
+            raise ValueError(f"Cron expression '{expression}' never matches")
+
+    def _value(self, token: str, low: int, high: int) -> int:
+        value = self.NAMES.get(token.lower()) if not token.isdigit() else int(token)
+        if value is None or not low <= value <= high:
+            raise ValueError(f"Invalid cron value '{token}' in '{self.expression}'")
+        return value
+
+    def _parse(self, field: str, low: int, high: int) -> list:
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step_text = part.split('/', 1)
+                step = int(step_text)
+                if step <= 0:
+                    raise ValueError(f"Invalid cron step in '{self.expression}'")
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start_text, end_text = part.split('-', 1)
+                start, end = self._value(start_text, low, high), self._value(end_text, low, high)
+            else:
+                start = self._value(part, low, high)
+                end = high if step > 1 else start
+            if start > end:
+                raise ValueError(f"Invalid cron range '{part}' in '{self.expression}'")
+            values.update(range(start, end + 1, step))
+        return sorted(values)
+
+    def _day_matches(self, day: datetime) -> bool:
+        in_days = day.day in self._day_set
+        in_weekdays = (day.weekday() + 1) % 7 in self._weekday_set
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, anchor: datetime, after: datetime) -> datetime:
+        current = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = after.year + self.SEARCH_YEARS
+        while current.year <= limit:
+            if current.month not in self.months:
+                index = bisect_left(self.months, current.month)
+                if index == len(self.months):
+                    current = current.replace(year=current.year + 1, month=self.months[0], day=1, hour=0, minute=0)
+                else:
+                    current = current.replace(month=self.months[index], day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(current):
+                current = (current + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            index = bisect_left(self.hours, current.hour)
+            if index == len(self.hours):
+                current = (current + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if self.hours[index] != current.hour:
+                current = current.replace(hour=self.hours[index], minute=0)
+            index = bisect_left(self.minutes, current.minute)
+            if index == len(self.minutes):
+                current = current.replace(minute=0) + timedelta(hours=1)
+                continue
+            return current.replace(minute=self.minutes[index])
+        raise ValueError(f"Cron expression '{self.expression}' never matches")
+
+
+_INTERVAL = re.compile(r'^every\s+(\d+)\s*(m|min|mins|minutes?|h|hours?|d|days?)$')
+_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+
+
+@lru_cache(maxsize=256)
+def compile_schedule(frequency: str) -> Schedule:
+    """Compile a task frequency once; later calls for the same string hit the cache.
+
+    Accepts hourly, daily, weekly, monthly, yearly, 'every N minutes|hours|days'
+    (e.g. 'every 15m'), cron expressions, and cron macros; 'cron:' is an
+    optional prefix for cron expressions.
+    """
+    text = frequency.strip().lower()
+    if text == 'hourly':
+        return IntervalSchedule(timedelta(hours=1))
+    if text == 'daily':
+        return IntervalSchedule(timedelta(days=1))
+    if text == 'weekly':
+        return IntervalSchedule(timedelta(weeks=1))
+    if text == 'monthly':
+        return MonthlySchedule(1)
+    if text == 'yearly':
+        return MonthlySchedule(12)
+    match = _INTERVAL.match(text)
+    if match:
+        return IntervalSchedule(timedelta(**{_UNITS[match.group(2)[0]]: int(match.group(1))}))
+    if text.startswith('cron:'):
+        text = text[len('cron:'):]
+    if text.startswith('@') or len(text.split()) == 5:
+        return CronSchedule(text)
+    raise ValueError(f"Unsupported frequency: '{frequency}'")
+
+
+def plan_next_run(frequency: str, scheduled: datetime, now: datetime, policy: str = "once") -> datetime:
+    """Next run after a run planned for `scheduled` took place at `now`.
+
+    With "all" every missed occurrence is still run (the result may already
+    be due); "once" and "skip" continue with the first occurrence after now.
+    """
+    schedule = compile_schedule(frequency)
+    if policy == "all":
+        return schedule.next_after(scheduled, scheduled)
+    return schedule.next_after(scheduled, max(scheduled, now))
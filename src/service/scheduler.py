@@ -0,0 +1,104 @@
+import heapq
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+def parse_schedule_time(value: str) -> datetime:
+    """Parse a task's start_date as a naive local time.
+
+    Dates from the server are UTC ('Z' or '+00:00'), the agent writes local
+    times with their offset; aware values are converted to local time and
+    values without an offset are taken as local already. Local times that
+    older agents stored with a 'Z' suffix are rewritten by migration 6.
+    """
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value.split('.')[0])
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def format_schedule_time(value: datetime) -> str:
+    """Format a naive local time as ISO 8601 with the local UTC offset."""
+    return value.astimezone().isoformat(timespec='seconds')
+
+
+class TaskScheduler:
+    """Min-heap of (run_at, task_id) that sleeps exactly until the next due task.
+
+    schedule() and remove() wake the waiter, so new, edited or deleted tasks
+    take effect immediately. Removed or rescheduled tasks leave stale heap
+    entries behind; they are skipped when popped (lazy deletion). An optional
+    random jitter spreads run times so a fleet of agents sharing a schedule
+    does not hit the providers in the same second.
+    """
+
+    # Re-check the wall clock at least this often (clock changes, suspend/resume)
+    MAX_SLEEP = 3600
+
+    def __init__(self, jitter_seconds: float = 0):
+        self.jitter_seconds = jitter_seconds
+        self._heap = []
+        self._run_at: Dict[int, datetime] = {}
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._run_at)
+
+    def schedule(self, task_id: int, next_run: datetime):
+        """(Re)schedule a task; replaces any earlier entry for it."""
+        run_at = next_run
+        if self.jitter_seconds:
+            run_at += timedelta(seconds=random.uniform(0, self.jitter_seconds))
+        self._run_at[task_id] = run_at
+        heapq.heappush(self._heap, (run_at, task_id))
+        logging.info(f"Task {task_id} scheduled for {run_at.isoformat(timespec='seconds')}")
+        self._wakeup.set()
+
+    def remove(self, task_id: int):
+        if self._run_at.pop(task_id, None) is not None:
+            logging.info(f"Task {task_id} removed from schedule")
+            self._wakeup.set()
+
+    def next_run(self) -> datetime | None:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self):
+        while self._heap and self._run_at.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now: datetime) -> List[int]:
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, task_id = heapq.heappop(self._heap)
+            del self._run_at[task_id]
+            due.append(task_id)
+
+    async def wait_due(self) -> List[int]:
+        """Sleep until at least one task is due and return the ids of all due tasks."""
+        while True:
+            self._wakeup.clear()
+            due = self._pop_due(datetime.now())
+            if due:
+                return due
+            run_at = self.next_run()
+            timeout = None
+            if run_at is not None:
+                timeout = max(0.0, (run_at - datetime.now()).total_seconds())
+                logging.info(f"Next task due at {run_at.isoformat(timespec='seconds')} (in {timeout:.0f}s)")
+                timeout = min(timeout, self.MAX_SLEEP)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,125 @@
+import os
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+def source_volume(source_path: str) -> str:
+    """Identify the disk a source lives on (device id, or drive/anchor if it cannot be stat'ed)."""
+    try:
+        return f"dev:{os.stat(source_path).st_dev}"
+    except OSError:
+        return Path(source_path).anchor or "unknown"
+
+
+class _Job:
+    def __init__(self, name: str, provider: str, volume: str, factory: Callable[[], Awaitable]):
+        self.name = name
+        self.provider = provider
+        self.volume = volume
+        self.factory = factory
+        self.future = asyncio.get_running_loop().create_future()
+        self.submitted_at = time.monotonic()
+
+
+class TaskExecutor:
+    """Runs backup jobs concurrently under global, per-provider and per-volume limits.
+
+    Jobs wait in FIFO order and each one starts as soon as every limit it
+    is subject to has room, so a job blocked on a busy disk does not hold a
+    slot or stop jobs behind it that use other disks and providers.
+
+    Config (backup.concurrency in config.json):
+        max_tasks: jobs running at once across the agent
+        per_provider: default limit per cloud provider, overridable in providers: {name: n}
+        per_volume: jobs reading from the same source disk at once
+    """
+
+    def __init__(self, config: dict | None = None):
+        config = config or {}
+        self.max_tasks = max(1, config.get('max_tasks', 4))
+        self.per_provider = max(1, config.get('per_provider', 2))
+        self.provider_limits = config.get('providers', {})
+        self.per_volume = max(1, config.get('per_volume', 1))
+        self._pending: List[_Job] = []
+        self._running = 0
+        self._running_by_provider: Dict[str, int] = defaultdict(int)
+        self._running_by_volume: Dict[str, int] = defaultdict(int)
+        self._tasks = set()
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _provider_limit(self, provider: str) -> int:
+        return max(1, self.provider_limits.get(provider, self.per_provider))
+
+    def _fits(self, job: _Job) -> bool:
+        return (self._running < self.max_tasks
+                and self._running_by_provider[job.provider] < self._provider_limit(job.provider)
+                and self._running_by_volume[job.volume] < self.per_volume)
+
+    def submit(self, name: str, provider: str, source_path: str, factory: Callable[[], Awaitable]) -> asyncio.Future:
+        """Queue factory() and return a future with its result."""
+        job = _Job(name, provider, source_volume(source_path), factory)
+        self._pending.append(job)
+        logging.info(f"Queued {name} ({provider}, {job.volume}); queue depth {len(self._pending)}, running {self._running}")
+        self._dispatch()
+        return job.future
+
+    def _dispatch(self):
+        for job in list(self._pending):
+            if self._running >= self.max_tasks:
+                break
+            if not self._fits(job):
+                continue
+            self._pending.remove(job)
+            self._running += 1
+            self._running_by_provider[job.provider] += 1
+            self._running_by_volume[job.volume] += 1
+            task = asyncio.create_task(self._run(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: _Job):
+        wait = time.monotonic() - job.submitted_at
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        logging.info(f"Starting {job.name} after waiting {wait:.1f}s; queue depth {len(self._pending)}")
+        try:
+            result = await job.factory()
+            self.completed += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"{job.name} failed: {e}")
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._running -= 1
+            self._running_by_provider[job.provider] -= 1
+            self._running_by_volume[job.volume] -= 1
+            self._dispatch()
+
+    async def run_all(self, jobs) -> list:
+        """Submit (name, provider, source_path, factory) tuples and wait for all; failures come back as exceptions."""
+        futures = [self.submit(*job) for job in jobs]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    def stats(self) -> dict:
+        started = self.completed + self.failed + self._running
+        return {
+            'queued': len(self._pending),
+            'running': self._running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'avg_wait_seconds': round(self.total_wait / started, 1) if started else 0.0,
+            'max_wait_seconds': round(self.max_wait, 1),
+            'running_by_provider': {k: v for k, v in self._running_by_provider.items() if v},
+        }
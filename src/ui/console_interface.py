@@ -33,25 +33,21 @@ class ConsoleInterface:
             print(f"Error de conexión: {e}")
 
     async def check_providers_status(self):
-        """Check status of all cloud providers"""
-        providers_status = {}
+        """Check all cloud providers concurrently, printing each result as it arrives"""
         available_providers = self.cloud_factory.get_available_providers()
-        
+        providers_status = {
+            provider_id: {"name": provider_name, "active": False}
+            for provider_id, provider_name in available_providers.items()
+        }
+        timeout = self.agent.backup_manager.config.get('providers', {}).get('status_timeout_seconds', 10)
+
         print("\nVerificando estado de proveedores de nube...")
-        for provider_id, provider_name in available_providers.items():
-            try:
-                credentials = self.agent.backup_manager.config.get(provider_id, {})
-                is_active = await self.cloud_factory.check_provider_status(provider_id, credentials)
-                providers_status[provider_id] = {
-                    "name": provider_name,
-                    "active": is_active
-                }
-            except Exception as e:
-                providers_status[provider_id] = {
-                    "name": provider_name,
-                    "active": False
-                }
-        
+        # Same cached probes BackupManager uses: the clients built here are reused by the backups
+        async for provider_id, is_active in self.agent.backup_manager.providers.check_all(available_providers, timeout):
+            providers_status[provider_id]["active"] = is_active
+            status = "✓ Activo" if is_active else "✗ Inactivo"
+            print(f"  {providers_status[provider_id]['name']}: {status}")
+
         return providers_status
     
     def limpiar_terminal(self):
@@ -0,0 +1,52 @@
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up, i.e. how long something blocked it.
+
+    Sleeps interval seconds in a loop; anything beyond that is lag. Lag above
+    warn_threshold is logged right away together with the running total of
+    stalls, so blocking calls that slipped onto the loop show up in the log.
+    """
+
+    def __init__(self, interval: float = 0.5, warn_threshold: float = 0.25):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - start - self.interval)
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.warn_threshold:
+                self.stalls += 1
+                logging.warning(f"Event loop blocked for {lag:.2f}s (stall #{self.stalls})")
+
+    def stats(self) -> dict:
+        return {
+            'samples': self.samples,
+            'avg_lag_ms': round(self.total_lag / self.samples * 1000, 1) if self.samples else 0.0,
+            'max_lag_ms': round(self.max_lag * 1000, 1),
+            'stalls': self.stalls,
+        }
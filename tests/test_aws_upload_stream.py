@@ -0,0 +1,65 @@
+"""AWSClient.upload_stream and upload_bytes against moto's in-memory S3.
+
+Run with: python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+try:
+    import boto3
+    from moto import mock_aws
+    from cloud.providers.aws_client import AWSClient, MB
+except ImportError:  # boto3 or moto not installed
+    mock_aws = None
+
+BUCKET = "backups-test"
+
+
+@unittest.skipIf(mock_aws is None, "boto3 and moto are required")
+class UploadStreamTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        self.addCleanup(self.mock.stop)
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        self.client = AWSClient("key", "secret", BUCKET, transfer={"multipart_chunksize_mb": 5, "max_concurrency": 2})
+        self.s3 = self.client.s3_client
+
+    @staticmethod
+    async def chunks(data, size=1 * MB):
+        for i in range(0, len(data), size):
+            yield data[i:i + size]
+
+    def stored(self, file_id):
+        [obj] = self.s3.list_objects_v2(Bucket=BUCKET, Prefix=f"backups/{file_id}/")["Contents"]
+        return self.s3.get_object(Bucket=BUCKET, Key=obj["Key"])["Body"].read()
+
+    async def test_streams_multiple_parts(self):
+        data = os.urandom(12 * MB + 123)
+        file_id = await self.client.upload_stream(self.chunks(data), "x.tar", "backups")
+
+        self.assertEqual(self.stored(file_id), data)
+
+    async def test_part_limit_aborts_the_upload(self):
+        self.client.MAX_PARTS = 2
+        with self.assertRaises(ValueError):
+            await self.client.upload_stream(self.chunks(os.urandom(12 * MB)), "x.tar", "backups")
+
+        self.assertNotIn("Contents", self.s3.list_objects_v2(Bucket=BUCKET))
+        self.assertNotIn("Uploads", self.s3.list_multipart_uploads(Bucket=BUCKET))
+
+    async def test_upload_bytes_uses_a_single_put_below_one_part(self):
+        data = os.urandom(100_000)
+        file_id = await self.client.upload_bytes(data, "chunk", "backups")
+
+        self.assertEqual(self.stored(file_id), data)
+        self.assertNotIn("Uploads", self.s3.list_multipart_uploads(Bucket=BUCKET))
+
+
+if __name__ == "__main__":
+    unittest.main()
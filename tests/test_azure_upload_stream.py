@@ -0,0 +1,210 @@
+"""AzureClient.upload_stream against a local stub of the Blob service.
+
+The stub implements Put Block, Put Block List and Put Blob, which is all
+upload_stream uses. Run with: python -m unittest discover -s tests
+"""
+import asyncio
+import base64
+import os
+import re
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+try:
+    from cloud.providers.azure_client import AzureClient, MB
+except ImportError:  # azure-storage-blob not installed
+    AzureClient = None
+
+# Well-known Azurite development account key
+ACCOUNT_KEY = "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=="
+
+
+class BlobStub:
+    """State of the stub service, shared by the request handler threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.staged = {}
+        self.committed = {}
+        self.block_lists = {}
+        self.active = 0
+        self.max_active = 0
+        self.staged_bytes = 0
+        self.completed = []
+        # block index -> seconds to wait before answering, or an HTTP status to fail with
+        self.delays = {}
+        self.failures = {}
+        self.default_delay = 0.02
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stub: BlobStub = None
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("x-ms-request-id", "stub")
+        self.send_header("ETag", '"0x1"')
+        self.send_header("Last-Modified", "Mon, 01 Jan 2024 00:00:00 GMT")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        stub = self.stub
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        name = unquote(url.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if query.get("comp") == ["block"]:
+            block_id = query["blockid"][0]
+            index = int(base64.b64decode(unquote(block_id)))
+            with stub.lock:
+                stub.active += 1
+                stub.max_active = max(stub.max_active, stub.active)
+            try:
+                time.sleep(stub.delays.get(index, stub.default_delay))
+                if index in stub.failures:
+                    return self._reply(stub.failures[index])
+                with stub.lock:
+                    stub.staged[(name, block_id)] = body
+                    stub.staged_bytes += len(body)
+                    stub.completed.append(index)
+            finally:
+                with stub.lock:
+                    stub.active -= 1
+            return self._reply(201)
+
+        if query.get("comp") == ["blocklist"]:
+            ids = [i.decode() for i in re.findall(rb"<(?:Latest|Uncommitted|Committed)>([^<]+)<", body)]
+            with stub.lock:
+                stub.block_lists[name] = ids
+                stub.committed[name] = b"".join(stub.staged[(name, i)] for i in ids)
+            return self._reply(201)
+
+        with stub.lock:
+            stub.committed[name] = body
+        return self._reply(201)
+
+
+@unittest.skipIf(AzureClient is None, "azure-storage-blob is not installed")
+class UploadStreamTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.stub = BlobStub()
+        StubHandler.stub = self.stub
+
+    def client(self, block_size_mb=1, max_concurrency=4):
+        connection_string = (
+            f"DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;AccountKey={ACCOUNT_KEY};"
+            f"BlobEndpoint=http://127.0.0.1:{self.server.server_port}/devstoreaccount1;"
+        )
+        transfer = {"block_size_mb": block_size_mb, "max_concurrency": max_concurrency}
+        return AzureClient(connection_string, "backups-test", transfer=transfer)
+
+    @staticmethod
+    async def chunks(data, size=300_000, yielded=None):
+        for i in range(0, len(data), size):
+            if yielded is not None:
+                yielded.append(i + len(data[i:i + size]))
+            yield data[i:i + size]
+
+    def committed_blob(self, file_id):
+        [(name, content)] = [(n, c) for n, c in self.stub.committed.items() if file_id in n]
+        return name, content
+
+    async def test_stages_multiple_blocks_and_commits_them(self):
+        data = os.urandom(5 * MB + 123)
+        file_id = await self.client().upload_stream(self.chunks(data), "x.tar", "backups")
+
+        name, content = self.committed_blob(file_id)
+        self.assertEqual(content, data)
+        self.assertEqual(len(self.stub.block_lists[name]), 6)
+
+    async def test_block_list_keeps_stream_order(self):
+        data = os.urandom(6 * MB)
+        # earlier blocks finish last
+        self.stub.delays = {0: 0.3, 1: 0.2, 2: 0.1}
+        file_id = await self.client().upload_stream(self.chunks(data), "x.tar", "backups")
+
+        name, content = self.committed_blob(file_id)
+        self.assertNotEqual(self.stub.completed, sorted(self.stub.completed))
+        self.assertEqual([int(base64.b64decode(i)) for i in self.stub.block_lists[name]], list(range(6)))
+        self.assertEqual(content, data)
+
+    async def test_in_flight_blocks_are_bounded(self):
+        data = os.urandom(12 * MB)
+        self.stub.default_delay = 0.1
+        yielded = []
+        ahead = []
+
+        async def chunks():
+            async for chunk in self.chunks(data, yielded=yielded):
+                with self.stub.lock:
+                    ahead.append(yielded[-1] - self.stub.staged_bytes)
+                yield chunk
+
+        await self.client(max_concurrency=2).upload_stream(chunks(), "x.tar", "backups")
+
+        self.assertLessEqual(self.stub.max_active, 2)
+        # two blocks staging, one being buffered and the source chunk that overflows it
+        self.assertLessEqual(max(ahead), 3 * MB + 300_000)
+
+    async def test_failed_block_aborts_without_commit(self):
+        data = os.urandom(6 * MB)
+        self.stub.failures = {3: 400}
+        with self.assertRaises(Exception):
+            await self.client().upload_stream(self.chunks(data), "x.tar", "backups")
+
+        self.assertEqual(self.stub.committed, {})
+
+    async def test_cancel_stops_staging_without_commit(self):
+        data = os.urandom(20 * MB)
+        self.stub.default_delay = 0.2
+        upload = asyncio.create_task(self.client(max_concurrency=2).upload_stream(self.chunks(data), "x.tar", "backups"))
+        await asyncio.sleep(0.3)
+        upload.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await upload
+        staged = len(self.stub.staged)
+        await asyncio.sleep(0.5)
+
+        self.assertEqual(self.stub.committed, {})
+        self.assertLess(staged, 20)
+        # nothing new is staged once the blocks in flight have finished
+        self.assertLessEqual(len(self.stub.staged), staged + 2)
+
+    async def test_block_limit_fails_before_staging_too_many(self):
+        data = os.urandom(5 * MB)
+        client = self.client()
+        client.MAX_BLOCKS = 3
+        with self.assertRaises(ValueError):
+            await client.upload_stream(self.chunks(data), "x.tar", "backups")
+
+        self.assertEqual(self.stub.committed, {})
+        self.assertLessEqual(len(self.stub.staged), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
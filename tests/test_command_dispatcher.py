@@ -0,0 +1,74 @@
+"""CommandDispatcher backpressure: per-type limits and bounded queues.
+
+Run with: python -m unittest discover -s tests
+"""
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from service.command_dispatcher import CommandDispatcher
+
+
+class CommandDispatcherTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.release = asyncio.Event()
+        self.running = []
+        self.statuses = []
+
+        async def handler(command_data):
+            self.running.append(command_data['commandId'])
+            await self.release.wait()
+
+        async def send(message):
+            parameters = message['parameters']
+            self.statuses.append((parameters['commandId'], parameters['status']))
+
+        self.dispatcher = CommandDispatcher(handler, send, "agent", limits={"Restore_Backup": 1}, queue_size=2)
+        self.addAsyncCleanup(self.dispatcher.close)
+
+    async def submit(self, command, command_id):
+        await self.dispatcher.submit({'command': command, 'commandId': command_id})
+        # let the consumers pick up what they have room for
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    def status(self, command_id):
+        return [status for cid, status in self.statuses if cid == command_id]
+
+    async def test_saturated_type_rejects_once_its_queue_is_full(self):
+        for i in range(4):
+            await self.submit("Restore_Backup", f"r{i}")
+
+        # one running, two queued, the fourth rejected
+        self.assertEqual(self.running, ["r0"])
+        self.assertEqual([self.status(f"r{i}") for i in range(4)],
+                         [["accepted"], ["accepted"], ["accepted"], ["rejected"]])
+
+    async def test_other_types_are_not_held_up(self):
+        for i in range(4):
+            await self.submit("Restore_Backup", f"r{i}")
+        await self.submit("Delete_Backup", "d0")
+
+        self.assertEqual(self.status("d0"), ["accepted"])
+        self.assertIn("d0", self.running)
+
+    async def test_queued_commands_run_once_slots_free_up(self):
+        for i in range(3):
+            await self.submit("Restore_Backup", f"r{i}")
+        self.release.set()
+        for _ in range(20):
+            await asyncio.sleep(0)
+
+        self.assertEqual(self.running, ["r0", "r1", "r2"])
+        self.assertEqual([self.status(f"r{i}") for i in range(3)], [["accepted", "completed"]] * 3)
+        # the queue has room again
+        await self.submit("Restore_Backup", "r3")
+        self.assertEqual(self.status("r3")[0], "accepted")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""The background service target must survive pickling for spawn-based processes (Windows).
+
+Run with: python -m unittest discover -s tests
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC))
+
+from utils import file_handler
+from data.database_handler import DatabaseHandler
+from encryption.encryption_handler import EncryptionHandler
+from backup.backup_manager import BackupManager
+from service.agent import Agent
+from service.service_handler import ServiceHandler
+from ui.console_interface import ConsoleInterface
+
+
+def _run_in_child(root, payload, results):
+    """Spawned process: unpickle the daemon target and query the task database."""
+    file_handler.ROOT_DIR = root
+    target = pickle.loads(payload)
+    agent = target.__self__.agent
+    tasks = asyncio.run(agent.db_operations.aio.fetch_active_tasks())
+    results.put((os.getpid(), agent.db_operations.db_handler.db_path, len(tasks)))
+
+
+class DaemonPickleTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.root = temp_dir.name
+        cwd = os.getcwd()
+        os.chdir(self.root)  # setup_logging writes to ./logs
+        self.addCleanup(os.chdir, cwd)
+        original_root = file_handler.ROOT_DIR
+        file_handler.ROOT_DIR = self.root
+        self.addCleanup(setattr, file_handler, 'ROOT_DIR', original_root)
+        self.addCleanup(DatabaseHandler._shared.clear)
+
+        with open(SRC / "config.json") as f:
+            config = json.load(f)
+        backup_manager = BackupManager(EncryptionHandler(config['encryption']['key']), config)
+        self.agent = Agent(backup_manager, config['email'], config['server'], ServiceHandler())
+        self.addCleanup(self.agent.db_operations.db_handler.close)
+
+    def test_daemon_target_pickles(self):
+        target = ConsoleInterface(self.agent).connect_websocket
+        restored = pickle.loads(pickle.dumps(target))
+
+        # In the same process the database handler is the shared one, not a second connection
+        self.assertIs(restored.__self__.agent.db_operations.db_handler, self.agent.db_operations.db_handler)
+        self.assertEqual(restored.__self__.agent.agent_id, self.agent.agent_id)
+
+    def test_spawned_process_opens_its_own_database(self):
+        payload = pickle.dumps(ConsoleInterface(self.agent).connect_websocket)
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        process = context.Process(target=_run_in_child, args=(self.root, payload, results))
+        process.start()
+        pid, db_path, tasks = results.get(timeout=60)
+        process.join(60)
+
+        self.assertEqual(process.exitcode, 0)
+        self.assertNotEqual(pid, os.getpid())
+        self.assertEqual(db_path, os.path.join(self.root, "backup_tasks.db"))
+        self.assertEqual(tasks, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()